@@ -1,7 +1,10 @@
 import time
+import struct
 import sys
+import threading
+from collections import OrderedDict
 from twisted.internet import defer
-from threading import Thread
+from gi.repository import GLib
 
 from monitoring_execution_engine import MonitoringExecutionEngine
 from acknowledged_udp.udp_client import UdpClient
@@ -10,15 +13,32 @@ from acknowledged_udp.config import global_network_config
 
 import rafcon
 from rafcon.core.singleton import state_machine_manager, state_machine_execution_engine
-from rafcon.core.states.state import StateExecutionStatus, State
+from rafcon.core.states.state import StateExecutionStatus
 from rafcon.gui.singleton import state_machine_manager_model
 from rafcon.utils import log
 
+from monitoring import constants
+from monitoring.deferred_deadline import gather_with_deadline
 from monitoring.model.network_model import network_manager_model
-from monitoring.ping_endpoint import ping_endpoint
+from monitoring.reconnect_backoff import ReconnectBackoff
+from monitoring.reliable_channel import ReliableChannel
+from monitoring.remote_state_cache import RemoteStateCache
+from monitoring.rtt_probe import RttProber
+from monitoring.state_id_table import RemoteStateIdTable
+from monitoring.status_codec import decode_status_batch, decode_state_id_batch, decode_state_id_table, \
+    decode_binary_state_id_batch, decode_mode_change, decode_loop_summary, encode_resync_request, BINARY_MAGIC, \
+    STATE_ID_BATCH, STATE_ID_TABLE, MODE_CHANGE, LOOP_SUMMARY, MODE_FULL, MODE_NAMES, SUPPORTED_CAPABILITIES, \
+    CAPABILITY_RELIABLE_CHANNEL, CAPABILITY_HEARTBEAT, KIND_SNAPSHOT_BEGIN
+from monitoring.subscription import get_configured_subscription, encode_subscription
 
 logger = log.get_logger(__name__)
 
+# the interval in milliseconds to check again, whether the GUI is ready to switch the execution engine
+ENGINE_SWAP_RETRY_INTERVAL = 100
+# the config keys sent to the server in the REGISTER message
+REGISTRATION_KEYS = frozenset(["CLIENT_ID", "SUBSCRIBED_STATE_MACHINE_ID", "SUBSCRIBED_PATH_PREFIXES",
+                               "SUBSCRIBED_MAX_DEPTH"])
+
 
 class MonitoringClient(UdpClient):
     """
@@ -37,15 +57,39 @@ class MonitoringClient(UdpClient):
         self.registered_to_server = False
         self.disabled = False
         self.last_active_state_machine = None
+        self.server_capabilities = frozenset()
+        self.state_id_tables = {}
+        # the monitoring mode of the server, which lowers the detail of the status stream while it is overloaded
+        self.server_mode = MODE_FULL
+        # the rates in cycles per second of the loops the server folded, by state machine id and container path
+        self.folded_loops = OrderedDict()
+        self._resync_requests = {}
+        self._last_sequence_number = None
+        self._synchronized = False
+        self.rtt_prober = RttProber(self, self.on_server_lost)
+        self.reliable_channel = ReliableChannel(self)
+        self.reconnect_backoff = ReconnectBackoff()
+        self._reconnect_call = None
+        self._reconnecting = False
+        # the engine the GUI is switched to next and the Deferreds fired when it was switched
+        self._pending_engine = None
+        self._engine_swaps = []
+        self._engine_swap_lock = threading.Lock()
+        self.remote_state_cache = RemoteStateCache()
+        self._pending_updates = OrderedDict()
+        self._pending_updates_lock = threading.Lock()
+        self._shutdown_trigger = None
+        self._unregistering = None
 
-    @defer.inlineCallbacks
     def connect(self):
         """
         Connect to the remote RAFCON server instance. Several things are achieved here:
         - replacing the menu bar by a menu bar controlling the remote RAFCON instance
         - registering to changes of the local execution engine
         - registering to the remote RAFCON server instance
-        :return:
+        The registration runs in the reactor and never blocks the calling thread. Failed registration attempts are
+        retried after a capped exponential backoff with jitter until the registration succeeds or is cancelled.
+        :return: True
         """
         # replace state machine execution engine
         if not self.execution_engine_replaced:
@@ -53,47 +97,360 @@ class MonitoringClient(UdpClient):
             engine = MonitoringExecutionEngine(state_machine_manager, self)
             self.init_execution_engine(engine)
 
-        if not self.disabled:
+        if self.disabled:
+            logger.info("Cannot connect to server: Client disabled!")
+        elif self.registered_to_server:
+            logger.info("Already connected to server!")
+        else:
+            from twisted.internet import reactor
+            self.server_address = (global_network_config.get_config_value("SERVER_IP"),
+                                   global_network_config.get_config_value("SERVER_UDP_PORT"))
+            logger.info("Connect to server {0} ...".format(str(self.server_address)))
+            reactor.callFromThread(self._start_registration)
+        return True
 
-            if not self.registered_to_server:
-                # setup twisted
-                from twisted.internet import reactor, threads
-                self.server_address = (global_network_config.get_config_value("SERVER_IP"),
-                                       global_network_config.get_config_value("SERVER_UDP_PORT"))
-                logger.info("Connect to server {0} ...".format(str(self.server_address)))
-                self.connector = reactor.listenUDP(0, self)
-                # logger.info("self.connector {0}".format(str(self.connector)))
-                protocol = Protocol(MessageType.REGISTER,
-                                    "Registering@{0}".format(global_network_config.get_config_value("CLIENT_ID")))
-                # logger.info("sending protocol {0}".format(str(protocol)))
-                return_value = yield threads.deferToThread(self.send_message_acknowledged,
-                                                           protocol, address=self.server_address, blocking=True)
-                if return_value:
-                    self.registered_to_server = True
-                    logger.info("Connected!")
-                    network_manager_model.add_to_message_list('Connecting', self.server_address, "send")
-                    defer.returnValue(return_value)
-                else:
-                    logger.error("Connection to server {0} timeout".format(str(self.server_address)))
-                    sleep_time = global_network_config.get_config_value("MAX_TIME_WAITING_BETWEEN_CONNECTION_TRY_OUTS")
-                    logger.info("Waiting for MAX_TIME_WAITING_BETWEEN_CONNECTION_TRY_OUTS={0} seconds!".format(str(sleep_time)))
-                    time.sleep(float(sleep_time))
-                    self.connect()
-                    defer.returnValue(return_value)
-            else:
-                logger.info("Already connected to server!")
+    def _start_registration(self):
+        """
+        Opens the socket, if it is not open yet, and starts a new series of registration attempts. Runs in the reactor.
+        :return:
+        """
+        from twisted.internet import reactor
+        self.cancel_reconnect()
+        self.reconnect_backoff.reset()
+        if self.connector is None or not self.connector.connected:
+            self.connector = reactor.listenUDP(0, self)
+        if self._shutdown_trigger is None:
+            self._shutdown_trigger = reactor.addSystemEventTrigger("before", "shutdown", self.unregister_from_server)
+        self.rtt_prober.start()
+        self._reconnecting = True
+        self._attempt_registration()
+
+    def _attempt_registration(self):
+        """
+        Sends the REGISTER message to the server and waits for its acknowledgement in a worker thread
+        :return:
+        """
+        from twisted.internet import threads
+        self._reconnect_call = None
+        if not self._reconnecting or self.disabled or self.registered_to_server:
+            return
+        self._set_connection_state("connecting")
+        subscription = get_configured_subscription(global_network_config)
+        protocol = Protocol(MessageType.REGISTER, "Registering@{0}@{1}@{2}".format(
+            global_network_config.get_config_value("CLIENT_ID"), ",".join(sorted(SUPPORTED_CAPABILITIES)),
+            encode_subscription(subscription)))
+        deferred = threads.deferToThread(self.send_message_acknowledged, protocol, address=self.server_address,
+                                         blocking=True)
+        deferred.addCallbacks(self._on_registration_result, self._on_registration_error)
+
+    def _on_registration_error(self, failure):
+        """
+        Treats a registration attempt that failed with an error, e.g. an unreachable network, as not acknowledged, thus
+        the next attempt is scheduled after the backoff delay
+        :param failure: the Failure of the attempt
+        :return:
+        """
+        logger.warn("Registration at server {0} failed: {1}".format(str(self.server_address),
+                                                                   failure.getErrorMessage()))
+        self._on_registration_result(False)
+
+    def _on_registration_result(self, acknowledged):
+        """
+        Finishes the series of registration attempts or schedules the next attempt
+        :param acknowledged: whether the server acknowledged the REGISTER message
+        :return:
+        """
+        from twisted.internet import reactor
+        if not self._reconnecting:
+            return
+        if acknowledged:
+            self._reconnecting = False
+            self.registered_to_server = True
+            self.reconnect_backoff.reset()
+            logger.info("Connected!")
+            network_manager_model.add_to_message_list('Connecting', self.server_address, "send")
+            return
+        delay = self.reconnect_backoff.next_delay()
+        logger.error("Connection to server {0} timeout, retrying in {1:.1f} seconds".format(str(self.server_address),
+                                                                                          delay))
+        self._set_connection_state("backoff", "retrying in {0:.1f} s".format(delay))
+        self._reconnect_call = reactor.callLater(delay, self._attempt_registration)
+
+    def apply_config(self, changed_keys):
+        """
+        Applies changed config values while staying connected to the server. Most values are read whenever they are
+        used, only the log sizes and the probe interval have to be updated. A changed client id or subscription is
+        sent to the server by registering again, which keeps the socket and the remote execution engine.
+        :param changed_keys: the set of the changed config keys
+        :return:
+        """
+        from twisted.internet import reactor
+        logger.info("Applying changed config values: {0}".format(", ".join(sorted(changed_keys))))
+        network_manager_model.configure_logs()
+        reactor.callFromThread(self.rtt_prober.reconfigure)
+        if changed_keys & REGISTRATION_KEYS and self.registered_to_server and not self.disabled:
+            reactor.callFromThread(self._register_again)
+        return True
+
+    def _register_again(self):
+        """
+        Sends the current client id and subscription to the server in a new series of registration attempts
+        :return:
+        """
+        self.registered_to_server = False
+        self._start_registration()
+
+    def cancel_reconnect(self):
+        """
+        Stops the current series of registration attempts. Runs in the reactor.
+        :return:
+        """
+        self._reconnecting = False
+        if self._reconnect_call is not None and self._reconnect_call.active():
+            self._reconnect_call.cancel()
+        self._reconnect_call = None
+
+    def _set_connection_state(self, state, reason=None):
+        """
+        Shows the state of the connection to the server in the network tab
+        :param state: 'connecting' or 'backoff'
+        :param reason: an optional explanation added to the history
+        :return:
+        """
+        network_manager_model.set_connected_ip_port(self.server_address)
+        if reason or network_manager_model.get_connected_status(self.server_address) != state:
+            network_manager_model.set_connected_status(self.server_address, state, reason)
+
+    def _get_monitored_state_machine(self):
+        """
+        Returns the local state machine that shows the execution of the remote server
+        :return: the active state machine, the selected one or the last active one
+        """
+        active_state_machine = state_machine_manager.get_active_state_machine()
+        if not active_state_machine:
+            active_state_machine = state_machine_manager_model.get_selected_state_machine_model().state_machine
+        if active_state_machine:
+            self.last_active_state_machine = active_state_machine
+            return active_state_machine
+        return self.last_active_state_machine
+
+    def _set_remote_state_execution_status(self, state_path, state_execution_status, as_check=False):
+        """
+        Queues the execution status received from the server for the state of the monitored state machine. The
+        queued updates are applied in a batch on the GTK main loop, only the latest status of every state is applied.
+        :param state_path: the path of the state
+        :param state_execution_status: the new StateExecutionStatus
+        :param as_check: whether a missing state is expected and must not be logged
+        :return:
+        """
+        with self._pending_updates_lock:
+            schedule = not self._pending_updates
+            # re-insert the state to keep the updates ordered by their latest change
+            self._pending_updates.pop(state_path, None)
+            self._pending_updates[state_path] = (state_execution_status, as_check)
+        if schedule:
+            GLib.idle_add(self._apply_pending_updates)
+
+    def _apply_pending_updates(self):
+        """
+        Applies all queued execution status updates to the monitored state machine. Called from the GTK main loop, the
+        graphical editor is thus redrawn once for the whole batch.
+        :return: False to be called only once
+        """
+        with self._pending_updates_lock:
+            pending_updates = self._pending_updates
+            self._pending_updates = OrderedDict()
+        state_machine = self._get_monitored_state_machine()
+        if not state_machine:
+            return False
+        for state_path, (state_execution_status, as_check) in pending_updates.iteritems():
+            state = self.remote_state_cache.get_state(state_machine, state_path, as_check=as_check)
+            if state:
+                self.remote_state_cache.set_status(state, state_execution_status)
+        return False
+
+    def _reset_states_to_inactive(self, state_paths):
+        """
+        Sets all given states to inactive, that are not already inactive. Called before a snapshot is applied.
+        :param state_paths: the paths of the states
+        :return:
+        """
+        for state_path in state_paths:
+            self._set_remote_state_execution_status(state_path, StateExecutionStatus.INACTIVE, as_check=True)
+
+    def _process_status_message(self, message_content, address):
+        """
+        Processes the content of a STATE_ID message, which is either a part of a state id table, a change of the
+        monitoring mode of the server, the summary of a folded loop or a batch of status records referring to states
+        by their ids or paths
+        :param message_content: the content of the message
+        :param address: the address of the server
+        :return:
+        """
+        if message_content.startswith(STATE_ID_TABLE):
+            state_machine_id, version, number_of_states, first_id, paths = decode_state_id_table(message_content)
+            table = self.state_id_tables.get(state_machine_id)
+            if table is None or table.version != version:
+                table = RemoteStateIdTable(state_machine_id, version, number_of_states)
+                self.state_id_tables[state_machine_id] = table
+                self._forget_folded_loops(address, state_machine_id)
+            table.add_chunk(first_id, paths)
+        elif message_content.startswith(MODE_CHANGE):
+            mode = decode_mode_change(message_content)
+            if mode != self.server_mode:
+                self.server_mode = mode
+                logger.info("Server switched the status stream to {0}".format(MODE_NAMES[mode]))
+                status = network_manager_model.get_connected_status(address)
+                network_manager_model.set_connected_status(address, status, "server mode: {0}".format(MODE_NAMES[mode]))
+        elif message_content.startswith(LOOP_SUMMARY):
+            self._apply_loop_summary(address, *decode_loop_summary(message_content))
+        elif message_content.startswith(STATE_ID_BATCH):
+            self._apply_state_id_records(address, *decode_state_id_batch(message_content))
         else:
-            logger.info("Cannot connect to server: Client disabled!")
+            for state_path, execution_status in decode_status_batch(message_content):
+                self._set_remote_state_execution_status(state_path, StateExecutionStatus(execution_status))
+
+    def _apply_state_id_records(self, address, kind, state_machine_id, version, sequence_number, records):
+        """
+        Sets the execution status of the states referred to by their ids. Outdated batches are dropped. A snapshot
+        or a state id table is requested, if a gap in the sequence numbers is detected or the records refer to an
+        unknown table version.
+        :param address: the address of the server
+        :param kind: KIND_DELTA, KIND_SNAPSHOT_BEGIN or KIND_SNAPSHOT
+        :param state_machine_id: the id of the state machine on the server
+        :param version: the version of the state id table
+        :param sequence_number: the sequence number of the batch
+        :param records: a list of (state_id, status_value) tuples
+        :return:
+        """
+        if self._last_sequence_number is not None:
+            distance = (sequence_number - self._last_sequence_number) & 0xffffffff
+            if not 0 < distance < 0x80000000:
+                return
+            in_sequence = distance == 1
+        else:
+            in_sequence = False
+        self._last_sequence_number = sequence_number
+
+        table = self.state_id_tables.get(state_machine_id)
+        if table is None or table.version != version or not table.complete:
+            self._synchronized = False
+            self._request_resync(state_machine_id, address)
+            return
+
+        if kind == KIND_SNAPSHOT_BEGIN:
+            self._synchronized = True
+            snapshot_ids = set(state_id for state_id, _ in records)
+            self._reset_states_to_inactive(path for state_id, path in enumerate(table.paths)
+                                           if state_id not in snapshot_ids)
+        elif not (self._synchronized and in_sequence):
+            # the records of this batch are still the most recent ones, but the ones in the gap are lost
+            self._synchronized = False
+            self._request_resync(state_machine_id, address)
+
+        for state_id, execution_status in records:
+            self._set_remote_state_execution_status(table.paths[state_id], StateExecutionStatus(execution_status))
+
+    def _apply_loop_summary(self, address, state_machine_id, version, container_id, window, cycles, records):
+        """
+        Shows a loop the server folded. The states of the loop are highlighted as waiting for their next cycle, which
+        RAFCON draws differently from active states, and the loop rate is shown next to the ping of the server. The
+        server sends the latest status of every state again when the loop ends.
+        :param address: the address of the server
+        :param state_machine_id: the id of the state machine on the server
+        :param version: the version of the state id table
+        :param container_id: the id of the container state running the loop
+        :param window: the length of the summarized window in seconds
+        :param cycles: the number of loop cycles within the window
+        :param records: a list of (state_id, activations, mean_duration, max_duration) tuples, which is empty if the
+            loop ended
+        :return:
+        """
+        table = self.state_id_tables.get(state_machine_id)
+        if table is None or table.version != version or not table.complete:
+            return
+        key = (state_machine_id, table.paths[container_id])
+        if not records:
+            if self.folded_loops.pop(key, None) is not None:
+                self._update_folded_loops(address, "loop ended: {0}".format(key[1]))
+            return
+        started = key not in self.folded_loops
+        self.folded_loops[key] = cycles / window if window else 0.
+        for state_id, activations, mean_duration, max_duration in records:
+            self._set_remote_state_execution_status(table.paths[state_id], StateExecutionStatus.WAIT_FOR_NEXT_STATE)
+        self._update_folded_loops(address, "loop folded: {0}".format(key[1]) if started else None)
+
+    def _forget_folded_loops(self, address, state_machine_id=None):
+        """
+        Forgets the folded loops of a state machine whose state id table was replaced or of all state machines
+        :param address: the address of the server
+        :param state_machine_id: the id of the state machine or None for all state machines
+        :return:
+        """
+        keys = [key for key in self.folded_loops if state_machine_id in (None, key[0])]
+        for key in keys:
+            del self.folded_loops[key]
+        if keys:
+            self._update_folded_loops(address)
 
-    def _recursively_mark_state_parents_active(self, state, state_execution_status):
-        # parent will be set to inactive explicitly; thus it must not be done here
-        new_status_to_set = StateExecutionStatus.ACTIVE
-        if isinstance(state.parent, State):
-            if state.parent.state_execution_status is not state_execution_status:
-                state.parent.state_execution_status = new_status_to_set
-            return self._recursively_mark_state_parents_active(state.parent, state_execution_status)
+    def _update_folded_loops(self, address, reason=None):
+        """
+        Updates the loop rates shown for the server and adds the reason to the history
+        :param address: the address of the server
+        :param reason: the history entry or None
+        :return:
+        """
+        network_manager_model.set_connected_loops(address, ", ".join(
+            "{0} {1:.0f}/s".format(path.rsplit("/", 1)[-1], rate)
+            for (_, path), rate in self.folded_loops.iteritems()) or None)
+        if reason:
+            network_manager_model.set_connected_status(address, network_manager_model.get_connected_status(address),
+                                                       reason)
+
+    def datagramReceived(self, datagram, address):
+        """
+        Processes binary datagrams, round trip time probes and reliable channel datagrams directly and passes all
+        others to the acknowledged udp protocol
+        :param datagram: the received datagram
+        :param address: the address where the datagram originates
+        :return:
+        """
+        if self.rtt_prober.handle_datagram(datagram, address) or \
+                self.reliable_channel.handle_datagram(datagram, address):
+            return
+        if datagram.startswith(BINARY_MAGIC):
+            if not self.disabled:
+                try:
+                    batch = decode_binary_state_id_batch(datagram)
+                except (struct.error, ValueError) as e:
+                    # the records of this datagram are lost, thus the known state machines are resynchronized
+                    logger.debug("Invalid binary datagram from {0}: {1}".format(address, e))
+                    self._synchronized = False
+                    for state_machine_id in self.state_id_tables.keys():
+                        self._request_resync(state_machine_id, address)
+                    return
+                network_manager_model.add_to_message_list("{0} binary status records".format(len(batch[4])),
+                                                          address, "received")
+                self._apply_state_id_records(address, *batch)
         else:
-            pass  # reached root state
+            UdpClient.datagramReceived(self, datagram, address)
+
+    def _request_resync(self, state_machine_id, address):
+        """
+        Requests the current state id table and a snapshot of a state machine from the server. Further requests for the
+        same state machine are suppressed until MAX_TIME_WAITING_FOR_ACKNOWLEDGEMENTS elapsed.
+        :param state_machine_id: the id of the state machine
+        :param address: the address of the server
+        :return:
+        """
+        now = time.time()
+        timeout = float(global_network_config.get_config_value("MAX_TIME_WAITING_FOR_ACKNOWLEDGEMENTS"))
+        if now - self._resync_requests.get(state_machine_id, 0.) < timeout:
+            return
+        self._resync_requests[state_machine_id] = now
+        message_content = encode_resync_request(state_machine_id)
+        self.send_message_non_acknowledged(Protocol(MessageType.STATE_ID, message_content), address)
+        network_manager_model.add_to_message_list(message_content, address, "send")
 
     def monitoring_data_received_function(self, message, address):
         """
@@ -107,34 +464,36 @@ class MonitoringClient(UdpClient):
         network_manager_model.add_to_message_list(message, address, "received")
 
         if message.message_type is MessageType.ID:
+            # 'server_id@capability,capability' where the capabilities are the ones the server agreed on
+            ident = message.message_content.split("@")
+            self.server_capabilities = frozenset(ident[1].split(",")) if len(ident) > 1 and ident[1] else frozenset()
+            if CAPABILITY_RELIABLE_CHANNEL in self.server_capabilities:
+                self.reliable_channel.add_peer(address)
+            else:
+                self.reliable_channel.remove_peer(address)
+            if CAPABILITY_HEARTBEAT in self.server_capabilities:
+                self.rtt_prober.add_peer(address)
+            else:
+                self.rtt_prober.remove_peer(address)
             network_manager_model.set_connected_ip_port(address)
-            network_manager_model.set_connected_id(address, message.message_content)
+            network_manager_model.set_connected_id(address, ident[0])
+            # the server starts a new status stream for every registration
+            self._last_sequence_number = None
+            self._synchronized = False
             network_manager_model.set_connected_status(address, "connected")
-            thread = Thread(target=ping_endpoint, args=(address, ))
-            thread.daemon = True
-            thread.start()
 
         if not self.disabled:
             if message.message_type is MessageType.STATE_ID:
-                (state_path, execution_status) = message.message_content.split("@")
-                state_execution_status = StateExecutionStatus(int(execution_status))
-                active_state_machine = state_machine_manager.get_active_state_machine()
-                if not active_state_machine:
-                    active_state_machine = state_machine_manager_model.get_selected_state_machine_model().state_machine
-                if active_state_machine:
-                    current_state = active_state_machine.get_state_by_path(state_path)
-                    current_state.state_execution_status = state_execution_status
-                    self._recursively_mark_state_parents_active(current_state, state_execution_status)
-                    self.last_active_state_machine = active_state_machine
-                elif self.last_active_state_machine:
-                    current_state = self.last_active_state_machine.get_state_by_path(state_path)
-                    current_state.state_execution_status = state_execution_status
+                self._process_status_message(message.message_content, address)
             if message.message_type is MessageType.UNREGISTER:
                 if network_manager_model.get_connected_status(address) is not "disconnected":
                     logger.info("Disconnected by {0}".format(global_network_config.get_config_value("SERVER_IP")))
                     network_manager_model.set_connected_status(address, "disconnected")
                     self.registered_to_server = False
                     self.disabled = False
+                    self.rtt_prober.stop()
+                    self.reliable_channel.remove_peer(address)
+                    self.rtt_prober.remove_peer(address)
                     self.connector.stopListening()
                     self.set_on_local_control()
             if message.message_type is MessageType.DISABLE:
@@ -153,8 +512,47 @@ class MonitoringClient(UdpClient):
                 network_manager_model.set_connected_status(address, "disconnected")
                 self.registered_to_server = False
                 self.disabled = False
+                self.rtt_prober.stop()
+                self.reliable_channel.remove_peer(address)
+                self.rtt_prober.remove_peer(address)
                 self.connector.stopListening()
 
+    def on_server_lost(self, address, reason):
+        """
+        Falls back to local control, if the server did not send any heartbeat for too long
+        :param address: the address of the server
+        :param reason: the reason recorded in the history
+        :return:
+        """
+        logger.warn("Lost server {0}: {1}".format(address, reason))
+        network_manager_model.set_connected_status(address, "disconnected", reason)
+        self._forget_folded_loops(address)
+        self.registered_to_server = False
+        self.disabled = False
+        self.rtt_prober.stop()
+        self.reliable_channel.remove_peer(address)
+        self.rtt_prober.remove_peer(address)
+        self.set_on_local_control()
+        # keep trying to register, the server may just be restarting
+        from twisted.internet import reactor
+        delay = self.reconnect_backoff.next_delay()
+        network_manager_model.set_connected_status(address, "backoff", "retrying in {0:.1f} s".format(delay))
+        self._reconnecting = True
+        self._reconnect_call = reactor.callLater(delay, self._reconnect_after_loss)
+
+    def _reconnect_after_loss(self):
+        """
+        Starts controlling the server again and continues the registration attempts after the server was lost
+        :return:
+        """
+        self._reconnect_call = None
+        if not self._reconnecting:
+            return
+        # set_on_local_control switched to the local engine
+        self.init_execution_engine(MonitoringExecutionEngine(state_machine_manager, self))
+        self.rtt_prober.start()
+        self._attempt_registration()
+
     @defer.inlineCallbacks
     def disconnect(self, address):
         """
@@ -163,11 +561,14 @@ class MonitoringClient(UdpClient):
         :return:
         """
         logger.info("Disconnect from server: {0} ...".format(address))
+        from twisted.internet import reactor
+        reactor.callFromThread(self.cancel_reconnect)
         if network_manager_model.get_connected_status(address) is not "disconnected":
             protocol = Protocol(MessageType.UNREGISTER, "Disconnecting")
-            # logger.info("sending protocol {0}".format(str(protocol)))
-            from twisted.internet import reactor, threads
-            yield threads.deferToThread(self.send_message_acknowledged, protocol, address=address, blocking=True)
+            yield self.reliable_channel.send(protocol, address)
+            self.reliable_channel.remove_peer(address)
+            self.rtt_prober.remove_peer(address)
+            self.rtt_prober.stop()
             yield defer.maybeDeferred(self.connector.stopListening)
             self.disabled = False
             network_manager_model.set_connected_status(address, "disconnected")
@@ -181,11 +582,47 @@ class MonitoringClient(UdpClient):
 
     def shutdown(self):
         """
-        A function to log off clients when shutting down Rafcon
+        A function to log off clients when shutting down Rafcon. Can be called from any thread. Called from another
+        thread, it blocks until the server acknowledged or DISCONNECT_DEADLINE passed. Called from the reactor thread,
+        the UNREGISTER message is sent right away and the reactor waits for its acknowledgement before it shuts down.
         :return:
         """
-        protocol = Protocol(MessageType.UNREGISTER, "Disconnecting")
-        self.send_message_non_acknowledged(protocol, self.server_address)
+        from twisted.internet import reactor, threads
+        from twisted.python import threadable
+        if threadable.isInIOThread() or not reactor.running:
+            self.unregister_from_server()
+        else:
+            threads.blockingCallFromThread(reactor, self.unregister_from_server)
+
+    def unregister_from_server(self):
+        """
+        Sends UNREGISTER to the server, acknowledged if the server supports the reliable channel. Only the first call
+        sends, it is triggered before the reactor shuts down at the latest. Has to be called from within the reactor
+        thread.
+        :return: a Deferred fired as soon as the server acknowledged or DISCONNECT_DEADLINE passed
+        """
+        if self._unregistering is None:
+            self.cancel_reconnect()
+            self.rtt_prober.stop()
+            unregistered = {}
+            if self.server_address is not None:
+                protocol = Protocol(MessageType.UNREGISTER, "Disconnecting")
+                if self.reliable_channel.has_peer(self.server_address):
+                    unregistered[self.server_address] = self.reliable_channel.send(protocol, self.server_address)
+                else:
+                    self.send_message_non_acknowledged(protocol, self.server_address)
+            deadline = float(global_network_config.get_config_value("DISCONNECT_DEADLINE",
+                                                                    constants.DISCONNECT_DEADLINE))
+            self._unregistering = gather_with_deadline(unregistered, deadline)
+            self._unregistering.addCallback(self._on_unregistered_from_server)
+        # every caller gets its own Deferred, as the callbacks of one caller must not change the result of the others
+        return defer.DeferredList([self._unregistering])
+
+    @staticmethod
+    def _on_unregistered_from_server(results):
+        if not all(results.values()):
+            logger.warn("The server did not acknowledge the shutdown")
+        return results
 
     def set_on_local_control(self):
         """
@@ -212,35 +649,60 @@ class MonitoringClient(UdpClient):
 
     def init_execution_engine(self, engine):
         """
-        A function to set the execution engine. Triggered by set_on_local_control() and connect()
+        A function to set the execution engine. Triggered by set_on_local_control() and connect().
+        The core singleton is replaced right away. The GUI is switched to the engine in the GTK main loop as soon as
+        the menu bar controller registered its view, thus the calling thread, which may be the reactor, never waits for
+        the GUI. If the engine is replaced several times before the GUI is switched, only the latest engine is shown.
         :param engine: target execution engine
-        :return:
+        :return: a Deferred fired with the engine in the reactor thread, when the GUI was switched to it
         """
-        monitoring_execution_engine = engine
         # global replacement
         # TODO: modules that have already imported the singleton.state_machine_execution_engine
         # still have their old reference!!!
-        rafcon.core.singleton.state_machine_execution_engine = monitoring_execution_engine
-
-        if 'rafcon.gui' in sys.modules:
-            from rafcon.gui.singleton import main_window_controller
-            # wait until the main window controller registered its view
-            while not main_window_controller.get_controller("menu_bar_controller").registered_view:
-                time.sleep(0.1)
-
-            from rafcon.gui.models.state_machine_execution_engine import StateMachineExecutionEngineModel
-            rafcon.gui.singleton.state_machine_execution_manager_model = \
-                StateMachineExecutionEngineModel(rafcon.core.singleton.state_machine_execution_engine)
-            main_window_controller.switch_state_machine_execution_engine(
-                rafcon.gui.singleton.state_machine_execution_manager_model)
-            logger.info("Execution engine replaced!")
-
-            # replacement for main_window_controller_only
-            from rafcon.gui.singleton import main_window_controller
-            main_window_controller.get_controller("menu_bar_controller").state_machine_execution_engine = \
-                monitoring_execution_engine
+        rafcon.core.singleton.state_machine_execution_engine = engine
         self.execution_engine_replaced = True
 
+        swapped = defer.Deferred()
+        if 'rafcon.gui' not in sys.modules:
+            swapped.callback(engine)
+            return swapped
+        with self._engine_swap_lock:
+            self._pending_engine = engine
+            self._engine_swaps.append(swapped)
+            schedule = len(self._engine_swaps) == 1
+        if schedule:
+            GLib.idle_add(self._swap_gui_execution_engine)
+        return swapped
+
+    def _swap_gui_execution_engine(self):
+        """
+        Switches the GUI to the latest engine passed to init_execution_engine. Called from the GTK main loop, it checks
+        again after ENGINE_SWAP_RETRY_INTERVAL milliseconds, if the menu bar controller did not register its view yet.
+        :return: False to be called only once
+        """
+        from twisted.internet import reactor
+        from rafcon.gui.singleton import main_window_controller
+        menu_bar_controller = main_window_controller.get_controller("menu_bar_controller") \
+            if main_window_controller else None
+        if menu_bar_controller is None or not menu_bar_controller.registered_view:
+            GLib.timeout_add(ENGINE_SWAP_RETRY_INTERVAL, self._swap_gui_execution_engine)
+            return False
+
+        with self._engine_swap_lock:
+            engine = self._pending_engine
+            swaps = self._engine_swaps
+            self._engine_swaps = []
+        from rafcon.gui.models.state_machine_execution_engine import StateMachineExecutionEngineModel
+        rafcon.gui.singleton.state_machine_execution_manager_model = StateMachineExecutionEngineModel(engine)
+        main_window_controller.switch_state_machine_execution_engine(
+            rafcon.gui.singleton.state_machine_execution_manager_model)
+        # replacement for main_window_controller_only
+        menu_bar_controller.state_machine_execution_engine = engine
+        logger.info("Execution engine replaced!")
+        for swapped in swaps:
+            reactor.callFromThread(swapped.callback, engine)
+        return False
+
     @defer.inlineCallbacks
     def cut_connection(self, addresses):
         """
@@ -35,3 +35,29 @@ ICON_DISABLED = "f05e"
 ICON_MAIL = "f003"
 ICON_NET = "f0ec"
 
+
+
+# defaults of the optional monitoring keys of the network config
+STATUS_BATCH_INTERVAL = 0.01
+STATUS_BATCH_MAX_SIZE = 1400
+HISTORY_LENGTH = 1000
+LOG_SPILL_MAX_BYTES = 1024 * 1024
+LOG_SPILL_BACKUP_COUNT = 5
+GUI_REFRESH_RATE = 10
+RTT_PROBE_INTERVAL = 1.0
+HEARTBEAT_STALE_THRESHOLD = 3
+HEARTBEAT_EVICTION_THRESHOLD = 10
+STATUS_QUEUE_LENGTH = 256
+STATUS_QUEUE_DRAIN_BUDGET = 64
+GOVERNOR_CPU_BUDGET = 0.05
+GOVERNOR_BATCH_FACTOR = 5
+GOVERNOR_MAX_DEPTH = 3
+GOVERNOR_LEAF_SAMPLE_INTERVAL = 0.5
+LOOP_FOLD_MIN_RATE = 20
+LOOP_FOLD_INTERVAL = 0.5
+RECONNECT_INITIAL_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+RECONNECT_BACKOFF_FACTOR = 2.0
+RELIABLE_WINDOW_SIZE = 32
+DISCONNECT_DEADLINE = 2.0
+STATUS_HANDOFF_LENGTH = 65536
@@ -6,6 +6,8 @@
 .. moduleauthor:: Benno Voggenreiter
 
 """
+from gi.repository import Gtk
+
 from monitoring.model.network_model import network_manager_model
 from monitoring.monitoring_manager import global_monitoring_manager
 from acknowledged_udp.config import global_network_config
@@ -15,6 +17,48 @@ import time
 logger = log.get_logger(__name__)
 
 
+class LogViewUpdater(object):
+    """
+    Keeps a list store showing the message_list or the history_list of the model up to date. Instead of refilling the
+    store on every change, only the rows of new entries are appended and the rows of trimmed entries are removed.
+    The store is refilled only if the model list was reloaded.
+    """
+
+    def __init__(self, list_store, tree_view, get_entries, format_entry):
+        """
+        :param list_store: the Gtk.ListStore with a single string column
+        :param tree_view: the Gtk.TreeView showing the list store
+        :param get_entries: network_manager_model.get_message_entries or network_manager_model.get_history_entries
+        :param format_entry: a function turning an entry into the text of its row
+        """
+        self.list_store = list_store
+        self.get_entries = get_entries
+        self.format_entry = format_entry
+        self._generation = None
+        self._first = 0
+        # all rows have the same height, so the tree view does not have to measure every row to lay out the list
+        for column in tree_view.get_columns():
+            column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        tree_view.set_fixed_height_mode(True)
+
+    def sync(self):
+        """
+        Applies the changes of the model list since the last call to the list store
+        :return:
+        """
+        generation, first, entries = self.get_entries(self._generation, self._first + len(self.list_store))
+        if generation != self._generation:
+            self.list_store.clear()
+            self._generation = generation
+        else:
+            evicted = min(first - self._first, len(self.list_store))
+            for _ in range(evicted):
+                self.list_store.remove(self.list_store.get_iter_first())
+        self._first = first
+        for entry in entries:
+            self.list_store.append([self.format_entry(entry)])
+
+
 class AbstractController():
     """
     Controller handling the redundant functions for server and client
@@ -23,6 +67,27 @@ class AbstractController():
     def __init__(self):
         self._actual_entry = None
 
+    @staticmethod
+    def format_history_entry(entry):
+        """
+        Creates the text of a row of the history view
+        :param entry: an (address, status) entry of history_list
+        :return: the text of the row
+        """
+        address, status = entry
+        return "Server {0} {1} at port {2}".format(address[0], status, address[1])
+
+    @staticmethod
+    def format_message_entry(entry):
+        """
+        Creates the text of a row of the message view
+        :param entry: a (message_content, address, direction) entry of message_list
+        :return: the text of the row
+        """
+        if entry[2] == "received":
+            return "Message: {0} {1} from {2}".format(entry[0], entry[2], entry[1])
+        return "Message: {0} {1} to {2}".format(entry[0], entry[2], entry[1])
+
     @staticmethod
     def on_load_button_clicked(self, *args):
         """
@@ -90,7 +155,7 @@ class AbstractController():
     @staticmethod
     def on_apply_button_clicked(*args):
         """
-        Reinitialize the client plugin with config.
+        Applies the changed config values. The plugin is reinitialized only if the role or the server address changed.
         :param args:
         :return:
         """
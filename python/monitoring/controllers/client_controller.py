@@ -14,7 +14,8 @@ from rafcon.gui.controllers.utils.extended_controller import ExtendedController
 from acknowledged_udp.config import global_network_config
 from monitoring.monitoring_manager import global_monitoring_manager
 from monitoring import constants
-from monitoring.controllers.abstract_endpoint_controller import AbstractController
+from monitoring.controllers.abstract_endpoint_controller import AbstractController, LogViewUpdater
+from monitoring.controllers.refresh_scheduler import RefreshScheduler
 logger = log.get_logger(__name__)
 
 
@@ -33,6 +34,9 @@ class ClientController(ExtendedController):
         self.list = []
         self.history_list_store = Gtk.ListStore(str)
         self.message_list_store = Gtk.ListStore(str)
+        self.history_view_updater = None
+        self.message_view_updater = None
+        self.refresh_scheduler = RefreshScheduler()
         self.network_manager_model = model
 
     def register_view(self, view):
@@ -45,6 +49,14 @@ class ClientController(ExtendedController):
 
         self.view['history_tree_view2'].set_model(self.history_list_store)
         self.view['message_tree_view1'].set_model(self.message_list_store)
+        self.history_view_updater = LogViewUpdater(self.history_list_store, self.view['history_tree_view2'],
+                                                   self.network_manager_model.get_history_entries,
+                                                   AbstractController.format_history_entry)
+        self.message_view_updater = LogViewUpdater(self.message_list_store, self.view['message_tree_view1'],
+                                                   self.network_manager_model.get_message_entries,
+                                                   AbstractController.format_message_entry)
+        self.history_view_updater.sync()
+        self.message_view_updater.sync()
 
         self.view['connection_tree_view1'].set_model(self.connection_list_store)
         self.view['connect_btn1'].connect('clicked', self.on_connect_button_clicked)
@@ -101,21 +113,35 @@ class ClientController(ExtendedController):
                         global_network_config.get_config_value("SERVER_UDP_PORT")))
             global_monitoring_manager.reconnect(address)
 
-    @ExtendedController.observe("ping", after=True)
+    def destroy(self):
+        self.refresh_scheduler.cancel()
+        ExtendedController.destroy(self)
+
+    @ExtendedController.observe("ping", assign=True)
     def on_ping_received(self, model, prop_name, info):
         """
-        Observes ping list in model. Refreshes connection_list_store when triggered
+        Observes the ping counter of the model. Schedules a refresh of connection_list_store when triggered
         :param model:
         :param prop_name:
         :param info:
         :return:
         """
-        self.refresh_con()
+        self.refresh_scheduler.mark_dirty(self.refresh_con)
+
+    @ExtendedController.observe("status", assign=True)
+    def on_status_changed(self, model, prop_name, info):
+        """
+        Observes the status counter of the model. Schedules a refresh of connection_list_store when triggered
+        :param model:
+        :param prop_name:
+        :param info:
+        :return:
+        """
+        self.refresh_scheduler.mark_dirty(self.refresh_con)
 
-    @ExtendedController.observe("status", after=True)
     def refresh_con(self, *args):
         """
-        Observes status list in model. Refreshes connection_list_store triggered
+        Refreshes connection_list_store
         :param args:
         :return:
         """
@@ -128,7 +154,7 @@ class ClientController(ExtendedController):
                 ip = address[0]
                 port = address[1]
                 ident = self.network_manager_model.get_connected_id(address)
-                ping = self.network_manager_model.get_connected_ping(address)
+                ping = self.get_ping_text(address)
                 status = self.network_manager_model.get_connected_status(address)
                 if status == "connected":
                     self.connection_list_store.append([str(ip), str(ident), str(port),
@@ -145,17 +171,29 @@ class ClientController(ExtendedController):
                 if path is not None:
                     self.view["connection_tree_view1"].set_cursor(path)
 
-    @ExtendedController.observe("config_list", after=True)
+    def get_ping_text(self, address):
+        """
+        Creates the text shown in brackets behind the status of a server
+        :param address: the address of the server
+        :return: the ping of the server followed by the rates of the loops the server folded
+        """
+        ping = self.network_manager_model.get_connected_ping(address)
+        connection = self.network_manager_model.get_connection(address)
+        if connection is None or not connection.loops:
+            return ping
+        return "{0}, loops {1}".format(ping, connection.loops)
+
+    @ExtendedController.observe("config", assign=True)
     def refresh_config(self, model, prop_name, info):
         """
-        Observes config_list in model. Refreshes config_list_store
+        Observes the config counter of the model. Refreshes config_list_store
         :param model:
         :param prop_name:
         :param info:
         :return:
         """
         self.config_list_store.clear()
-        for key in info.instance:
+        for key in self.network_manager_model.config_list:
             self.config_list_store.append(key)
 
     def editing_started(self, renderer, editable, path):
@@ -209,32 +247,27 @@ class ClientController(ExtendedController):
         except RuntimeError as e:
             logger.exception(e)
 
-    @ExtendedController.observe("history_list", after=True)
+    @ExtendedController.observe("history", assign=True)
     def update_history(self, model, prop_name, info):
         """
-        Observes history_list from model. Updates history_list_store when triggered
+        Observes the history counter of the model. Schedules a refresh of history_list_store when triggered
         :param model:
         :param prop_name:
         :param info:
         :return:
         """
-        self.history_list_store.clear()
-        for key in info.instance:
-            address, status = key
-            self.history_list_store.append(["Server {0} {1} at port {2}".format(address[0], status, address[1])])
+        # the view is registered after the first notifications may have arrived, it catches up on registration
+        if self.history_view_updater:
+            self.refresh_scheduler.mark_dirty(self.history_view_updater.sync)
 
-    @ExtendedController.observe("message_list", after=True)
+    @ExtendedController.observe("messages", assign=True)
     def update_message(self, model, prop_name, info):
         """
-        Observes message_list from model. Updates message_list_store when triggered
+        Observes the messages counter of the model. Schedules a refresh of message_list_store when triggered
         :param model:
         :param prop_name:
         :param info:
         :return:
         """
-        self.message_list_store.clear()
-        for key in info.instance:
-            if key[2] == "received":
-                self.message_list_store.append(["Message: {0} {1} from {2}".format(key[0], key[2], key[1])])
-            elif key[2] == "send":
-                self.message_list_store.append(["Message: {0} {1} to {2}".format(key[0], key[2], key[1])])
+        if self.message_view_updater:
+            self.refresh_scheduler.mark_dirty(self.message_view_updater.sync)
@@ -0,0 +1,78 @@
+"""
+.. module:: refresh scheduler
+   :platform: Unix, Windows
+   :synopsis: a module limiting how often the views of the monitoring plugin are redrawn
+
+"""
+import threading
+import time
+
+from gi.repository import GLib
+
+from acknowledged_udp.config import global_network_config
+from monitoring import constants
+from rafcon.utils import log
+
+logger = log.get_logger(__name__)
+
+
+class RefreshScheduler(object):
+    """
+    Collects the refresh functions of views marked dirty and calls each of them once, at most GUI_REFRESH_RATE times
+    per second. The refresh functions are always called from the GTK main loop, whichever thread marked them dirty.
+    """
+
+    def __init__(self):
+        self._dirty = []
+        self._lock = threading.Lock()
+        self._source_id = None
+        self._last_refresh = 0.
+
+    def mark_dirty(self, refresh_function):
+        """
+        Schedules a refresh function. A function marked dirty several times before the next refresh is called once.
+        :param refresh_function: a function without arguments redrawing a view
+        :return:
+        """
+        with self._lock:
+            if refresh_function not in self._dirty:
+                self._dirty.append(refresh_function)
+            if self._source_id is None:
+                delay = self._last_refresh + self._get_interval() - time.time()
+                if delay > 0:
+                    self._source_id = GLib.timeout_add(int(delay * 1000), self._refresh)
+                else:
+                    self._source_id = GLib.idle_add(self._refresh)
+
+    def cancel(self):
+        """
+        Drops all scheduled refresh functions, e.g. when the views are destroyed
+        :return:
+        """
+        with self._lock:
+            if self._source_id is not None:
+                GLib.source_remove(self._source_id)
+                self._source_id = None
+            del self._dirty[:]
+
+    def _refresh(self):
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = []
+            self._source_id = None
+            self._last_refresh = time.time()
+        for refresh_function in dirty:
+            try:
+                refresh_function()
+            except Exception as e:
+                logger.exception(e)
+        return False
+
+    @staticmethod
+    def _get_interval():
+        """
+        Returns the minimal time between two refreshes
+        :return: the reciprocal of GUI_REFRESH_RATE of the network config
+        """
+        rate = float(global_network_config.get_config_value("GUI_REFRESH_RATE", constants.GUI_REFRESH_RATE))
+        return 1. / rate if rate > 0 else 0.
@@ -16,7 +16,8 @@ from rafcon.gui.controllers.utils.extended_controller import ExtendedController
 from acknowledged_udp.config import global_network_config
 from monitoring.monitoring_manager import global_monitoring_manager
 from monitoring import constants
-from monitoring.controllers.abstract_endpoint_controller import AbstractController
+from monitoring.controllers.abstract_endpoint_controller import AbstractController, LogViewUpdater
+from monitoring.controllers.refresh_scheduler import RefreshScheduler
 
 logger = log.get_logger(__name__)
 
@@ -36,6 +37,9 @@ class ServerController(ExtendedController):
         self._actual_entry = None
         self.history_list_store = Gtk.ListStore(str)
         self.message_list_store = Gtk.ListStore(str)
+        self.history_view_updater = None
+        self.message_view_updater = None
+        self.refresh_scheduler = RefreshScheduler()
         self.network_manager_model = model
 
     def register_view(self, view):
@@ -47,6 +51,14 @@ class ServerController(ExtendedController):
 
         self.view['history_tree_view2'].set_model(self.history_list_store)
         self.view['message_tree_view1'].set_model(self.message_list_store)
+        self.history_view_updater = LogViewUpdater(self.history_list_store, self.view['history_tree_view2'],
+                                                   self.network_manager_model.get_history_entries,
+                                                   AbstractController.format_history_entry)
+        self.message_view_updater = LogViewUpdater(self.message_list_store, self.view['message_tree_view1'],
+                                                   self.network_manager_model.get_message_entries,
+                                                   AbstractController.format_message_entry)
+        self.history_view_updater.sync()
+        self.message_view_updater.sync()
 
         self.view['connection_tree_view1'].set_model(self.connection_list_store)
         self.view['connection_tree_view1'].connect('cursor-changed', self.update_button)
@@ -103,10 +115,35 @@ class ServerController(ExtendedController):
                 global_monitoring_manager.disable(address)
             self.view["connection_tree_view1"].set_cursor(path)
 
-    @ExtendedController.observe("status", after=True)
+    def destroy(self):
+        self.refresh_scheduler.cancel()
+        ExtendedController.destroy(self)
+
+    @ExtendedController.observe("status", assign=True)
+    def on_status_changed(self, model, prop_name, info):
+        """
+        Observes the status counter of the model. Schedules a refresh of connection_tree_view when triggered
+        :param model:
+        :param prop_name:
+        :param info:
+        :return:
+        """
+        self.refresh_scheduler.mark_dirty(self.refresh_con)
+
+    @ExtendedController.observe("ping", assign=True)
+    def on_ping_changed(self, model, prop_name, info):
+        """
+        Observes the ping counter of the model. Schedules a refresh of the pings in connection_tree_view when triggered
+        :param model:
+        :param prop_name:
+        :param info:
+        :return:
+        """
+        self.refresh_scheduler.mark_dirty(self.refresh_ping)
+
     def refresh_con(self, *args):
         """
-        Observes status list from model. Updates connection_tree_view when triggered
+        Refreshes connection_tree_view
         :param args:
         :return:
         """
@@ -114,7 +151,7 @@ class ServerController(ExtendedController):
         self.connection_list_store.clear()
         for address in self.network_manager_model.connected_ip_port:
             ident = self.network_manager_model.get_connected_id(address)
-            ping = self.network_manager_model.get_connected_ping(address)
+            ping = self.get_ping_text(address)
             status = self.network_manager_model.get_connected_status(address)
             if status == "connected":
                 self.connection_list_store.append([address[0], ident, address[1],
@@ -127,45 +164,49 @@ class ServerController(ExtendedController):
         if path is not None:
             self.view["connection_tree_view1"].set_cursor(path)
 
-    @ExtendedController.observe("ping", after=True)
-    def refresh_ping(self, model, prop_name, info):
+    def get_ping_text(self, address):
         """
-        Observes the ping list from model. Updates the connection_tree_view when triggered
-        :param model:
-        :param prop_name:
-        :param info:
+        Creates the text shown in brackets behind the status of a client
+        :param address: the address of the client
+        :return: the ping of the client, the length of its send queue and the number of dropped status records
+        """
+        connection = self.network_manager_model.get_connection(address)
+        if connection is None:
+            return None
+        return "{0}, queue {1}, dropped {2}".format(connection.ping, connection.queue_length, connection.dropped)
+
+    def refresh_ping(self):
+        """
+        Updates the pings shown in connection_tree_view
         :return:
         """
         iterator = self.connection_list_store.get_iter_first()
-        for address, port in info.instance:
-            if iterator is not None:
-                if address == (self.connection_list_store.get_value(iterator, 0),
-                               self.connection_list_store.get_value(iterator, 2)):
-                    status = self.network_manager_model.get_connected_status(address)
-                    ping = self.network_manager_model.get_connected_ping(address)
-                    if status == "connected":
-                        self.connection_list_store.set_value(iterator, 3,
-                                                             constants.set_icon_and_text(constants.ICON_NET,
-                                                                                         status, 'fgcolor="#07F743"',
-                                                                                         ping))
-                    else:
-                        self.connection_list_store.set_value(iterator, 3,
-                                                             constants.set_icon_and_text(constants.ICON_NET,
-                                                                                         status, 'fgcolor="#d98508"',
-                                                                                         ping))
-                iterator = self.connection_list_store.iter_next(iterator)
-
-    @ExtendedController.observe("config_list", after=True)
+        while iterator is not None:
+            address = (self.connection_list_store.get_value(iterator, 0),
+                       self.connection_list_store.get_value(iterator, 2))
+            status = self.network_manager_model.get_connected_status(address)
+            ping = self.get_ping_text(address)
+            if status == "connected":
+                self.connection_list_store.set_value(iterator, 3,
+                                                     constants.set_icon_and_text(constants.ICON_NET,
+                                                                                 status, 'fgcolor="#07F743"', ping))
+            else:
+                self.connection_list_store.set_value(iterator, 3,
+                                                     constants.set_icon_and_text(constants.ICON_NET,
+                                                                                 status, 'fgcolor="#d98508"', ping))
+            iterator = self.connection_list_store.iter_next(iterator)
+
+    @ExtendedController.observe("config", assign=True)
     def refresh_config(self, model, prop_name, info):
         """
-        Observes the config_list in model. Updates config_list_store when triggered
+        Observes the config counter of the model. Updates config_list_store when triggered
         :param model:
         :param prop_name:
         :param info:
         :return:
         """
         self.config_list_store.clear()
-        for key in info.instance:
+        for key in self.network_manager_model.config_list:
             self.config_list_store.append(key)
 
     def editing_started(self, renderer, editable, path):
@@ -236,35 +277,30 @@ class ServerController(ExtendedController):
                 else:
                     self.view["disable_btn1"].set_label("Enable")
 
-    @ExtendedController.observe("history_list", after=True)
+    @ExtendedController.observe("history", assign=True)
     def update_history(self, model, prop_name, info):
         """
-        Observes history_list in model. Updates history_list_store if triggered
+        Observes the history counter of the model. Schedules a refresh of history_list_store if triggered
         :param model:
         :param prop_name:
         :param info:
         :return:
         """
-        self.history_list_store.clear()
-        for key in info.instance:
-            address, status = key
-            self.history_list_store.append(["Server {0} {1} at port {2}".format(address[0], status, address[1])])
+        # the view is registered after the first notifications may have arrived, it catches up on registration
+        if self.history_view_updater:
+            self.refresh_scheduler.mark_dirty(self.history_view_updater.sync)
 
-    @ExtendedController.observe("message_list", after=True)
+    @ExtendedController.observe("messages", assign=True)
     def update_message(self, model, prop_name, info):
         """
-        Observes message_list in model. Updates message_list_store if triggered
+        Observes the messages counter of the model. Schedules a refresh of message_list_store if triggered
         :param model:
         :param prop_name:
         :param info:
         :return:
         """
-        self.message_list_store.clear()
-        for key in info.instance:
-            if key[2] == "received":
-                self.message_list_store.append(["Message: {0} {1} from {2}".format(key[0], key[2], key[1])])
-            elif key[2] == "send":
-                self.message_list_store.append(["Message: {0} {1} to {2}".format(key[0], key[2], key[1])])
+        if self.message_view_updater:
+            self.refresh_scheduler.mark_dirty(self.message_view_updater.sync)
 
 
 
@@ -0,0 +1,46 @@
+"""
+.. module:: deferred deadline
+   :platform: Unix, Windows
+   :synopsis: a module waiting for many Deferreds at once, but never longer than a deadline
+
+"""
+
+
+def gather_with_deadline(deferreds, timeout):
+    """
+    Waits for a set of Deferreds concurrently. Can be called from any thread, the Deferreds are gathered in the
+    reactor. Called from the reactor thread, the deadline starts right away.
+    :param deferreds: a dict mapping arbitrary keys to Deferreds
+    :param timeout: the deadline in seconds
+    :return: a Deferred fired in the reactor, as soon as all Deferreds fired or the deadline passed, with a dict mapping
+        every key to the result of its Deferred or to None, if it failed or did not fire in time
+    """
+    from twisted.internet import defer, reactor
+    from twisted.python import threadable
+    results = dict.fromkeys(deferreds)
+    gathered = defer.Deferred()
+
+    def record(result, key):
+        results[key] = result
+        return result
+
+    def expire():
+        if not gathered.called:
+            gathered.callback(dict(results))
+
+    def finish(_, timer):
+        if timer.active():
+            timer.cancel()
+        expire()
+
+    def start():
+        timer = reactor.callLater(timeout, expire)
+        for key, deferred in deferreds.iteritems():
+            deferred.addCallback(record, key)
+        defer.DeferredList(deferreds.values(), consumeErrors=True).addCallback(finish, timer)
+
+    if threadable.isInIOThread():
+        start()
+    else:
+        reactor.callFromThread(start)
+    return gathered
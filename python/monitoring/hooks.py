@@ -26,6 +26,8 @@ def post_init(setup_config):
     logger.info("Running post init of the monitoring plugin")
 
     global_network_config.load(path=setup_config['net_config_path'])
+    from monitoring.model.network_model import network_manager_model
+    network_manager_model.configure_logs()
 
     if global_monitoring_manager.networking_enabled():
 
@@ -60,9 +62,13 @@ def main_window_setup(main_window_controller):
     from monitoring.controllers.server_controller import ServerController
     from monitoring.controllers.client_controller import ClientController
     from monitoring.model.network_model import network_manager_model
+    from monitoring.model.network_model_gtk import NetworkManagerGtkModel
     from rafcon.gui.helpers.label import create_tab_header_label
     import constants
 
+    # GTK is only imported here, a server without GUI uses the plain model only
+    network_manager_gtk_model = NetworkManagerGtkModel(network_manager_model)
+
     icon = {"network": constants.ICON_NET}
     monitoring_plugin_eventbox = create_tab_header_label("network", icon)
 
@@ -71,13 +77,15 @@ def main_window_setup(main_window_controller):
         main_window_controller.view.state_machine_server.show()
         main_window_controller.view['lower_notebook'].append_page(main_window_controller.view.state_machine_server.get_top_widget(),
                                                                   monitoring_plugin_eventbox)
-        monitoring_manager_ctrl = ServerController(network_manager_model, main_window_controller.view.state_machine_server)
+        monitoring_manager_ctrl = ServerController(network_manager_gtk_model,
+                                                   main_window_controller.view.state_machine_server)
     else:
         main_window_controller.view.state_machine_client = ClientView()
         main_window_controller.view.state_machine_client.show()
         main_window_controller.view['lower_notebook'].append_page(main_window_controller.view.state_machine_client.get_top_widget(),
                                                                   monitoring_plugin_eventbox)
-        monitoring_manager_ctrl = ClientController(network_manager_model, main_window_controller.view.state_machine_client)
+        monitoring_manager_ctrl = ClientController(network_manager_gtk_model,
+                                                   main_window_controller.view.state_machine_client)
     main_window_controller.add_controller('monitoring_manager_ctrl', monitoring_manager_ctrl)
 
 
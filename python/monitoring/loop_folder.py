@@ -0,0 +1,203 @@
+"""
+.. module:: loop folder
+   :platform: Unix, Windows
+   :synopsis: a module replacing the status changes of rapidly repeating state cycles by periodic summaries
+
+"""
+import time
+from collections import OrderedDict
+
+from acknowledged_udp.config import global_network_config
+
+from rafcon.core.states.state import StateExecutionStatus
+
+from monitoring import constants
+
+from rafcon.utils import log
+logger = log.get_logger(__name__)
+
+INACTIVE = StateExecutionStatus.INACTIVE.value
+
+
+class StateStatistics(object):
+    """
+    The activations and active durations of a single state within the current window
+    """
+    __slots__ = ("activations", "durations", "total_duration", "max_duration", "active_since", "status_value")
+
+    def __init__(self):
+        self.activations = 0
+        self.durations = 0
+        self.total_duration = 0.
+        self.max_duration = 0.
+        self.active_since = None
+        self.status_value = INACTIVE
+
+    def reset(self):
+        self.activations = 0
+        self.durations = 0
+        self.total_duration = 0.
+        self.max_duration = 0.
+
+
+class LoopFolder(object):
+    """
+    This class detects containers whose child states are activated more than LOOP_FOLD_MIN_RATE times per second and
+    folds these loops: the status changes of the looping states are no longer sent, instead a summary of the cycles
+    and the active durations of the states is sent every LOOP_FOLD_INTERVAL seconds.
+
+    A loop is unfolded as soon as a child state of the container that is not part of the loop becomes active, the
+    container becomes inactive without being part of a folded loop itself or the loop slows down below the rate
+    within one window. The latest status of every
+    state of an unfolded loop is sent again.
+
+    Every key is a (StateIdTable, state_id) tuple, thus the state ids of replaced tables never collide.
+    """
+
+    def __init__(self):
+        self._statistics = {}
+        # maps the key of every container running a folded loop to the set of state ids of the loop
+        self._loops = OrderedDict()
+        # maps the key of every state of a folded loop to the key of its container
+        self._folded = {}
+        self._released = OrderedDict()
+        self._ended = []
+        self._window_start = time.time()
+
+    def observe(self, table, state_id, status_value, timestamp):
+        """
+        Records a single status change. Called for every change before the changes of one tick are collapsed.
+        :param table: the StateIdTable of the state machine of the state
+        :param state_id: the id of the state
+        :param status_value: the value of the new StateExecutionStatus
+        :param timestamp: the time of the change
+        :return:
+        """
+        key = (table, state_id)
+        statistics = self._statistics.get(key)
+        if statistics is None:
+            statistics = self._statistics[key] = StateStatistics()
+        statistics.status_value = status_value
+        if status_value != INACTIVE:
+            if statistics.active_since is not None:
+                return
+            statistics.active_since = timestamp
+            statistics.activations += 1
+            container_key = (table, table.parents[state_id])
+            if container_key in self._loops and key not in self._folded:
+                # the container left its loop
+                self._unfold(container_key)
+        elif statistics.active_since is not None:
+            duration = timestamp - statistics.active_since
+            statistics.active_since = None
+            statistics.durations += 1
+            statistics.total_duration += duration
+            if duration > statistics.max_duration:
+                statistics.max_duration = duration
+            if key in self._loops and key not in self._folded:
+                # the container left, unless it is part of a loop itself and runs its inner loop once per cycle
+                self._unfold(key)
+
+    def fold(self, records_by_table):
+        """
+        Removes the records of the states of folded loops and adds the latest records of the states of unfolded ones
+        :param records_by_table: a dict mapping each StateIdTable to a list of (state_id, status_value) tuples
+        :return: the folded dict
+        """
+        if not self._folded and not self._released:
+            return records_by_table
+        folded = OrderedDict()
+        # the records of the current tick are newer than the released ones and come last
+        for (table, state_id), status_value in self._released.iteritems():
+            folded.setdefault(table, []).append((state_id, status_value))
+        self._released.clear()
+        for table, records in records_by_table.iteritems():
+            kept = [record for record in records if (table, record[0]) not in self._folded]
+            if kept:
+                folded.setdefault(table, []).extend(kept)
+        return folded
+
+    def summarize(self):
+        """
+        Folds and unfolds loops according to the activation rates of the current window, if it is over
+        :return: a list of (table, container_id, window, cycles, records) tuples, one per folded loop and one without
+            records per loop that ended, where records is a list of
+            (state_id, activations, mean_duration, max_duration) tuples
+        """
+        now = time.time()
+        window = now - self._window_start
+        if window < float(global_network_config.get_config_value("LOOP_FOLD_INTERVAL", constants.LOOP_FOLD_INTERVAL)):
+            summaries = [(table, container_id, 0., 0, []) for table, container_id in self._ended]
+            del self._ended[:]
+            return summaries
+        self._window_start = now
+        min_activations = float(global_network_config.get_config_value("LOOP_FOLD_MIN_RATE",
+                                                                        constants.LOOP_FOLD_MIN_RATE)) * window
+
+        looping = OrderedDict()
+        for key, statistics in self._statistics.iteritems():
+            if statistics.activations >= min_activations:
+                table, state_id = key
+                parent_id = table.parents[state_id]
+                if parent_id is not None:
+                    looping.setdefault((table, parent_id), []).append(state_id)
+        for container_key in self._loops.keys():
+            if container_key not in looping:
+                self._unfold(container_key)
+        for container_key, state_ids in looping.iteritems():
+            loop = self._loops.get(container_key)
+            if loop is None:
+                logger.debug("Folding the loop of {0}".format(container_key[0].paths[container_key[1]]))
+                loop = self._loops[container_key] = set()
+            for state_id in state_ids:
+                loop.add(state_id)
+                self._folded[(container_key[0], state_id)] = container_key
+
+        summaries = [(table, container_id, 0., 0, []) for table, container_id in self._ended]
+        del self._ended[:]
+        for (table, container_id), loop in self._loops.iteritems():
+            records = []
+            cycles = 0
+            for state_id in sorted(loop):
+                statistics = self._statistics[(table, state_id)]
+                mean_duration = statistics.total_duration / statistics.durations if statistics.durations else 0.
+                records.append((state_id, statistics.activations, mean_duration, statistics.max_duration))
+                cycles = max(cycles, statistics.activations)
+            summaries.append((table, container_id, window, cycles, records))
+
+        for key, statistics in self._statistics.items():
+            if statistics.active_since is None and not statistics.activations and key not in self._folded:
+                del self._statistics[key]
+            else:
+                statistics.reset()
+        return summaries
+
+    def _unfold(self, container_key):
+        """
+        Ends a folded loop and releases the latest status of each of its states
+        :param container_key: the key of the container running the loop
+        :return:
+        """
+        table, container_id = container_key
+        logger.debug("Unfolding the loop of {0}".format(table.paths[container_id]))
+        for state_id in sorted(self._loops.pop(container_key)):
+            key = (table, state_id)
+            del self._folded[key]
+            self._released.pop(key, None)
+            self._released[key] = self._statistics[key].status_value
+        self._ended.append(container_key)
+
+    def forget_table(self, table):
+        """
+        Drops all loops and statistics of a replaced state id table
+        :param table: the StateIdTable
+        :return:
+        """
+        for key in [key for key in self._statistics if key[0] is table]:
+            del self._statistics[key]
+        for container_key in [key for key in self._loops if key[0] is table]:
+            for state_id in self._loops.pop(container_key):
+                self._folded.pop((table, state_id), None)
+        for key in [key for key in self._released if key[0] is table]:
+            del self._released[key]
+        self._ended = [key for key in self._ended if key[0] is not table]
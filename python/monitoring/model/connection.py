@@ -0,0 +1,57 @@
+"""
+.. module:: connection
+   :platform: Unix, Windows
+   :synopsis: a module holding the record of a single connection of the network manager model
+
+"""
+import time
+
+# gains of the smoothed round trip time and of the jitter estimate, as used for the retransmission timer of TCP
+RTT_GAIN = 0.125
+JITTER_GAIN = 0.25
+# gain of the smoothed probe loss rate
+LOSS_GAIN = 0.1
+
+
+class Connection(object):
+    """
+    The state of the connection to a single remote endpoint
+    """
+    __slots__ = ("address", "ident", "status", "ping", "rtt", "jitter", "last_seen", "queue_length", "dropped",
+                 "loss", "loops")
+
+    def __init__(self, address):
+        self.address = address
+        self.ident = None
+        self.status = None
+        self.ping = None
+        self.rtt = None
+        self.jitter = None
+        self.last_seen = time.time()
+        self.queue_length = 0
+        self.dropped = 0
+        self.loss = 0.
+        # the text describing the folded loops of the server and their rates
+        self.loops = None
+
+    def add_rtt_sample(self, rtt):
+        """
+        Updates the smoothed round trip time and the jitter estimate with a new measurement
+        :param rtt: the measured round trip time in seconds
+        :return:
+        """
+        if self.rtt is None:
+            self.rtt = rtt
+            self.jitter = rtt / 2.
+        else:
+            self.jitter += JITTER_GAIN * (abs(self.rtt - rtt) - self.jitter)
+            self.rtt += RTT_GAIN * (rtt - self.rtt)
+        self.ping = "{0:.2f} ms +/- {1:.2f}".format(self.rtt * 1000., self.jitter * 1000.)
+
+    def add_loss_sample(self, lost):
+        """
+        Updates the smoothed loss rate with the outcome of a probe
+        :param lost: whether the probe was not answered
+        :return:
+        """
+        self.loss += LOSS_GAIN * ((1. if lost else 0.) - self.loss)
@@ -1,35 +1,40 @@
-import gi
-gi.require_version('Gtk', '3.0')
-from gtkmvc3.model_mt import ModelMT
+import os
+import threading
+import time
+from collections import OrderedDict
+
 from acknowledged_udp.config import global_network_config
+from monitoring import constants
+from monitoring.model.connection import Connection
+from monitoring.model.ring_log import RingLog, SpillFile, LogWindow
 from rafcon.utils import log
 logger = log.get_logger(__name__)
 
 
-class NetworkManagerModel(ModelMT):
+class NetworkManagerModel(object):
     """
-    Model which manages the network monitoring
+    Model which manages the network monitoring. It is plain Python and does not depend on GTK, thus a server without
+    GUI never imports GTK. Listeners are notified about changes with the name of the changed part: 'status', 'ping',
+    'history', 'messages' or 'config'. The NetworkManagerGtkModel adapts these notifications for the GUI.
     """
-    status = []
-    ping = []
-    history_list = []
-    message_list = []
-    config_list = []
-    __observables__ = ["status", "ping", "history_list", "message_list", "config_list", ]
-
-    def __init__(self, status=[], ping=[], history_list=[], message_list=[], config_list=[], meta=None):
-        ModelMT.__init__(self)
-        self.connected_ip_port = []
-        self.status = status
-        self.id = []
-        self.ping = ping
+
+    def __init__(self, history_list=None, message_list=None, config_list=None):
+        self._listeners = []
+        self.connections = OrderedDict()
+        # immutable snapshots of the addresses of all connections and of the connections that are not stale, which can
+        # be iterated without locking
+        self.connected_ip_port = ()
+        self.active_ip_port = ()
+        self._connections_lock = threading.RLock()
         self.controller = None
-        self.history_list = history_list
-        self.history_store_list = []
-        self.message_list = message_list
-        self.message_store_list = []
-        self.config_list = config_list
-        self.register_observer(self)
+        self.history_list = history_list if history_list is not None else []
+        self.history_store_list = RingLog(constants.HISTORY_LENGTH)
+        self.history_window = LogWindow()
+        self.message_list = message_list if message_list is not None else []
+        self.message_store_list = RingLog(constants.HISTORY_LENGTH)
+        self.message_window = LogWindow()
+        self._log_lock = threading.RLock()
+        self.config_list = config_list if config_list is not None else []
 
         self.params = {'SERVER_IP',
                        'SERVER_UDP_PORT',
@@ -45,143 +50,318 @@ class NetworkManagerModel(ModelMT):
                        'ENABLED',
                        'TYPE',
                        'CLIENT_ID',
-                       'SERVER_ID'
+                       'SERVER_ID',
+                       'STATUS_BATCH_INTERVAL',
+                       'STATUS_BATCH_MAX_SIZE',
+                       'LOG_SPILL_DIRECTORY',
+                       'LOG_SPILL_MAX_BYTES',
+                       'LOG_SPILL_BACKUP_COUNT',
+                       'GUI_REFRESH_RATE',
+                       'RTT_PROBE_INTERVAL',
+                       'HEARTBEAT_STALE_THRESHOLD',
+                       'HEARTBEAT_EVICTION_THRESHOLD',
+                       'SUBSCRIBED_STATE_MACHINE_ID',
+                       'SUBSCRIBED_PATH_PREFIXES',
+                       'SUBSCRIBED_MAX_DEPTH',
+                       'STATUS_QUEUE_LENGTH',
+                       'STATUS_QUEUE_DRAIN_BUDGET',
+                       'GOVERNOR_CPU_BUDGET',
+                       'GOVERNOR_BATCH_FACTOR',
+                       'GOVERNOR_MAX_DEPTH',
+                       'GOVERNOR_LEAF_SAMPLE_INTERVAL',
+                       'LOOP_FOLD_MIN_RATE',
+                       'LOOP_FOLD_INTERVAL',
+                       'RECONNECT_MAX_DELAY',
+                       'RECONNECT_BACKOFF_FACTOR',
+                       'RELIABLE_WINDOW_SIZE',
+                       'DISCONNECT_DEADLINE',
+                       'STATUS_HANDOFF_LENGTH'
                        }
 
+    def add_listener(self, listener):
+        """
+        Registers a function notified about changes of the model. It is called from the thread changing the model.
+        :param listener: a function called with 'status', 'ping', 'history', 'messages' or 'config'
+        :return:
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Unregisters a function registered by add_listener
+        :param listener: the function
+        :return:
+        """
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, name):
+        """
+        Notifies all listeners about a change
+        :param name: 'status', 'ping', 'history', 'messages' or 'config'
+        :return:
+        """
+        for listener in self._listeners:
+            listener(name)
+
+    def configure_logs(self):
+        """
+        Applies HISTORY_LENGTH and the LOG_SPILL_* values of the config to the message and the history log.
+        HISTORY_LENGTH limits the number of entries of each log held in memory. If LOG_SPILL_DIRECTORY is set, evicted
+        entries are written to rotating files in this directory.
+        :return:
+        """
+        capacity = int(global_network_config.get_config_value("HISTORY_LENGTH", constants.HISTORY_LENGTH))
+        spill_directory = global_network_config.get_config_value("LOG_SPILL_DIRECTORY")
+        max_bytes = int(global_network_config.get_config_value("LOG_SPILL_MAX_BYTES", constants.LOG_SPILL_MAX_BYTES))
+        backup_count = int(global_network_config.get_config_value("LOG_SPILL_BACKUP_COUNT",
+                                                                  constants.LOG_SPILL_BACKUP_COUNT))
+        for ring_log, file_name, observable_list, window in \
+                ((self.message_store_list, "messages.log", self.message_list, self.message_window),
+                 (self.history_store_list, "history.log", self.history_list, self.history_window)):
+            spill_file = ring_log.spill_file
+            if not spill_directory:
+                spill_file = None
+            elif spill_file is None or spill_file.path != os.path.join(spill_directory, file_name) or \
+                    spill_file.max_bytes != max_bytes or spill_file.backup_count != backup_count:
+                spill_file = SpillFile(os.path.join(spill_directory, file_name), max_bytes, backup_count)
+            with self._log_lock:
+                ring_log.configure(capacity, spill_file)
+                window.first += self._trim(observable_list, capacity)
+        self._notify("history")
+        self._notify("messages")
+
+    @staticmethod
+    def _trim(observable_list, capacity):
+        """
+        Removes the oldest entries of an observable list, which exceed the capacity
+        :param observable_list: the message_list or the history_list
+        :param capacity: the maximal number of entries
+        :return: the number of removed entries
+        """
+        excess = len(observable_list) - capacity
+        if excess > 0:
+            del observable_list[:excess]
+            return excess
+        return 0
+
+    def _append_to_log(self, name, ring_log, observable_list, window, entry):
+        """
+        Appends an entry to a log and to the observable list showing it
+        :param name: 'history' or 'messages'
+        :param ring_log: the message_store_list or the history_store_list
+        :param observable_list: the message_list or the history_list
+        :param window: the LogWindow of the observable list
+        :param entry: the new entry
+        :return:
+        """
+        with self._log_lock:
+            ring_log.append(entry)
+            observable_list.append(entry)
+            window.first += self._trim(observable_list, ring_log.capacity)
+        self._notify(name)
+
+    def _refill_log_list(self, name, observable_list, window, entries):
+        """
+        Replaces the content of an observable list showing a log
+        :param name: 'history' or 'messages'
+        :param observable_list: the message_list or the history_list
+        :param window: the LogWindow of the observable list
+        :param entries: the new content
+        :return:
+        """
+        with self._log_lock:
+            window.generation += 1
+            window.first = 0
+            del observable_list[:]
+            observable_list.extend(entries)
+        self._notify(name)
+
+    def _get_log_entries(self, observable_list, window, generation, next_number):
+        """
+        Returns the entries of an observable list showing a log, which a view has not shown yet
+        :param observable_list: the message_list or the history_list
+        :param window: the LogWindow of the observable list
+        :param generation: the generation of the list the view shows
+        :param next_number: the running number of the first entry the view has not shown yet
+        :return: the current generation, the running number of the first entry of the list and the entries starting
+            with next_number or with the first entry, if the generation changed
+        """
+        with self._log_lock:
+            if generation != window.generation:
+                next_number = window.first
+            start = max(next_number - window.first, 0)
+            return window.generation, window.first, list(observable_list[start:])
+
+    def get_history_entries(self, generation, next_number):
+        """
+        Returns the entries of history_list a view has not shown yet. See _get_log_entries.
+        """
+        return self._get_log_entries(self.history_list, self.history_window, generation, next_number)
+
+    def get_message_entries(self, generation, next_number):
+        """
+        Returns the entries of message_list a view has not shown yet. See _get_log_entries.
+        """
+        return self._get_log_entries(self.message_list, self.message_window, generation, next_number)
+
+    def get_connection(self, address):
+        """
+        A method to get the connection record of an address
+        :param address: ('ip', port)
+        :return: the Connection or None, if the address is not connected
+        """
+        return self.connections.get(address)
+
     def set_connected_ip_port(self, address):
         """
-        A method to set a connected port into the connected_port_ip list: [('ip', port)]
+        A method to add a connection record for an address, if it does not exist yet
         :param address: address of client or server ('ip', port)
         :return:
         """
-        if address not in self.connected_ip_port:
-            self.connected_ip_port.append(address)
+        with self._connections_lock:
+            if address not in self.connections:
+                self.connections[address] = Connection(address)
+                self._update_snapshots()
+
+    def _update_snapshots(self):
+        """
+        Rebuilds connected_ip_port and active_ip_port. Has to be called with the connections lock held.
+        :return:
+        """
+        self.connected_ip_port = tuple(self.connections)
+        self.active_ip_port = tuple(address for address, connection in self.connections.iteritems()
+                                    if connection.status != "stale")
+
+    def touch_connection(self, address):
+        """
+        A method to record that a datagram of a connected endpoint was received
+        :param address: ('ip', port)
+        :return:
+        """
+        connection = self.connections.get(address)
+        if connection is not None:
+            connection.last_seen = time.time()
 
     def set_connected_id(self, address, ident):
         """
-        A method to set the client or server ID into the id list: [(('ip', port), ident)]
+        A method to set the client or server ID of a connection
         :param address: address of client or server('ip', port)
         :param ident: ID of the client or server
         :return:
         """
-        if address in self.connected_ip_port:
-            if not self.id:
-                self.id.append((address, ident))
-            else:
-                for key in self.id:
-                    if address == key[0]:
-                        self.id.remove(key)
-                        self.id.append((address, ident))
-                if address not in key:
-                    self.id.append((address, ident))
+        connection = self.connections.get(address)
+        if connection is not None:
+            connection.ident = ident
 
     def set_connected_ping(self, address, ping):
         """
-        A method to set the connected server or client ping into the ping list: [(('ip', port), ping)]
-        Gets triggert by ping thread
+        A method to set the ping of a connection
         :param address: ('ip', port)
         :param ping: 'ping'
         :return:
         """
-        if not self.ping:
-            self.ping.append((address, ping))
-        if address in self.connected_ip_port:
-            for key in self.ping:
-                if address in key:
-                    self.ping.remove(key)
-                    self.ping.append((address, ping))
-                else:
-                    self.ping.append((address, ping))
+        connection = self.connections.get(address)
+        if connection is not None:
+            connection.ping = ping
+            self._notify("ping")
 
-    def set_connected_status(self, address, status):
+    def set_connected_rtt(self, address, rtt):
         """
-        A method to set the status of a connection into status list: [(('ip', port), status)]
+        A method to add a round trip time measurement to the ping estimate of a connection
         :param address: ('ip', port)
-        :param status: status can be 'disconnected', 'connected' or 'disabled'
+        :param rtt: the measured round trip time in seconds
         :return:
         """
-        if address in self.connected_ip_port:
-            if not self.status:
-                self.status.append((address, status))
-            else:
-                for key in self.status:
-                    if address == key[0]:
-                        self.status.remove(key)
-                        self.status.append((address, status))
-                if address not in key:
-                    self.status.append((address, status))
-        self.history_list.append((address, status))
-        self.history_store_list.append((address, status))
-        # self.update_view()
+        connection = self.connections.get(address)
+        if connection is not None:
+            connection.add_rtt_sample(rtt)
+            self._notify("ping")
 
-    def get_connected_id(self, address):
+    def set_connected_loss(self, address, lost):
         """
-        A method to get the id of an address
+        A method to add the outcome of a probe to the loss rate of a connection
         :param address: ('ip', port)
-        :return: id
+        :param lost: whether the probe was not answered
+        :return:
         """
-        for key, ident in self.id:
-            if key == address:
-                return ident
+        connection = self.connections.get(address)
+        if connection is not None:
+            connection.add_loss_sample(lost)
 
-    def get_connected_ping(self, address):
+    def set_connected_queue(self, address, queue_length, dropped):
         """
-        A method to get the ping of an address
+        A method to set the send queue statistics of a connection
         :param address: ('ip', port)
-        :return: ping
+        :param queue_length: the number of datagrams waiting to be sent
+        :param dropped: the number of status records dropped because the queue overflowed
+        :return:
         """
-        for key, ping in self.ping:
-            if key == address:
-                return ping
+        connection = self.connections.get(address)
+        if connection is not None:
+            connection.queue_length = queue_length
+            connection.dropped = dropped
+            self._notify("ping")
 
-    def get_connected_status(self, address):
+    def set_connected_loops(self, address, loops):
         """
-        A method to get the status of an address
+        A method to set the folded loops reported by a server
         :param address: ('ip', port)
-        :return: status
+        :param loops: a text describing the folded loops and their rates or None, if no loop is folded
+        :return:
         """
-        for key, status in self.status:
-            if key == address:
-                return status
+        connection = self.connections.get(address)
+        if connection is not None:
+            connection.loops = loops
+            self._notify("ping")
 
-    def remove_connected_ip_port(self, address):
+    def set_connected_status(self, address, status, reason=None):
         """
-        A method to remove an address from connection_ip_port list
-        :param address: target address('ip', port)
+        A method to set the status of a connection and to add it to the history
+        :param address: ('ip', port)
+        :param status: status can be 'disconnected', 'connected', 'disabled' or 'stale'
+        :param reason: an optional explanation of the status change, which is added to the history
         :return:
         """
-        if address in self.connected_ip_port:
-            self.connected_ip_port.remove(address)
+        with self._connections_lock:
+            connection = self.connections.get(address)
+            if connection is not None:
+                was_stale = connection.status == "stale"
+                connection.status = status
+                if was_stale != (status == "stale"):
+                    self._update_snapshots()
+                self._notify("status")
+        if reason:
+            status = "{0} ({1})".format(status, reason)
+        self._append_to_log("history", self.history_store_list, self.history_list, self.history_window,
+                            (address, status))
 
-    def remove_connected_id(self, address):
+    def get_connected_id(self, address):
         """
-        A method to remove an ID from id list
-        :param address: target address('ip', port)
-        :return:
+        A method to get the id of an address
+        :param address: ('ip', port)
+        :return: id
         """
-        for key in self.id:
-            if address in key:
-                self.id.remove(key)
+        connection = self.connections.get(address)
+        return connection.ident if connection is not None else None
 
-    def remove_ping(self, address):
+    def get_connected_ping(self, address):
         """
-        A method to remove a ping from ping list
-        :param address: target address('ip', port)
-        :return:
+        A method to get the ping of an address
+        :param address: ('ip', port)
+        :return: ping
         """
-        for key in self.ping:
-            if address in key:
-                self.ping.remove(key)
+        connection = self.connections.get(address)
+        return connection.ping if connection is not None else None
 
-    def remove_status(self, address):
+    def get_connected_status(self, address):
         """
-        A method to remove a status from status list
-        :param address: target address('ip', port)
-        :return:
+        A method to get the status of an address
+        :param address: ('ip', port)
+        :return: status
         """
-        for key in self.status:
-            if address in key:
-                self.status.remove(key)
+        connection = self.connections.get(address)
+        return connection.status if connection is not None else None
 
     def delete_connection(self, address):
         """
@@ -189,36 +369,39 @@ class NetworkManagerModel(ModelMT):
         :param address: target address('ip', port)
         :return:
         """
-        self.remove_connected_id(address)
-        self.remove_connected_ip_port(address)
-        self.remove_ping(address)
-        self.remove_status(address)
+        with self._connections_lock:
+            if self.connections.pop(address, None) is not None:
+                self._update_snapshots()
+                self._notify("status")
 
     def delete_all(self):
         """
-        A method to remove all connections from all lists
+        A method to remove all connections
         :return:
         """
-        del self.connected_ip_port[:]
-        del self.id[:]
-        del self.ping[:]
-        del self.status[:]
+        with self._connections_lock:
+            self.connections.clear()
+            self._update_snapshots()
+            self._notify("status")
 
     def clear_history(self):
         """
         A method to clear history_list. Triggert when clear_history_button in clicked.
         :return:
         """
-        del self.history_list[:]
+        with self._log_lock:
+            self.history_window.first += len(self.history_list)
+            del self.history_list[:]
+        self._notify("history")
 
-    def reload_history(self):
+    def reload_history(self, page=0):
         """
         A method to relaod history_list. Triggert when relaod_history_button in clicked.
+        :param page: 0 for the most recent entries, higher pages for older ones, which may be read from disk
         :return:
         """
-        self.history_list = []
-        for key in self.history_store_list:
-            self.history_list.append(key)
+        self._refill_log_list("history", self.history_list, self.history_window,
+                              self.history_store_list.page(page, self.history_store_list.capacity))
 
     def add_to_message_list(self, message_content, address, direction):
         """
@@ -228,25 +411,27 @@ class NetworkManagerModel(ModelMT):
         :param direction: 'send' or 'received'
         :return:
         """
-        self.message_store_list.append((message_content, address, direction))
-        self.message_list.append((message_content, address, direction))
+        self._append_to_log("messages", self.message_store_list, self.message_list, self.message_window,
+                            (message_content, address, direction))
 
     def clear_message(self):
         """
         A method to clear message_list. Triggert when clear_message_button in clicked.
         :return:
         """
-        del self.message_list[:]
+        with self._log_lock:
+            self.message_window.first += len(self.message_list)
+            del self.message_list[:]
+        self._notify("messages")
 
-    def reload_message(self):
+    def reload_message(self, page=0):
         """
         A method to relaod message_list. Triggert when reload_message_button in clicked.
+        :param page: 0 for the most recent entries, higher pages for older ones, which may be read from disk
         :return:
         """
-        self.message_list = []
-        for key in self.message_store_list:
-            self.message_list.append(key)
-        # self.controller.update_message(self.message_list)
+        self._refill_log_list("messages", self.message_list, self.message_window,
+                              self.message_store_list.page(page, self.message_store_list.capacity))
 
     def set_config_value(self, param, value):
         """
@@ -266,6 +451,7 @@ class NetworkManagerModel(ModelMT):
                     self.config_list.remove(key)
                     global_network_config.set_config_value(param, value)
                     self.config_list.insert(index, (param, value))
+        self._notify("config")
 
     def load_config(self, path):
         """
@@ -276,6 +462,7 @@ class NetworkManagerModel(ModelMT):
         global_network_config.load(path=path)
         del self.config_list[:]
         self.set_config_value(None, None)
+        self.configure_logs()
 
 
 network_manager_model = NetworkManagerModel()
@@ -0,0 +1,66 @@
+"""
+.. module:: network model gtk
+   :platform: Unix, Windows
+   :synopsis: a module adapting the plain network manager model to the gtkmvc3 controllers of the monitoring GUI
+
+"""
+import threading
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import GLib
+from gtkmvc3.model_mt import ModelMT
+
+
+class NetworkManagerGtkModel(ModelMT):
+    """
+    Adapter exposing the NetworkManagerModel to the gtkmvc3 controllers. The notifications of the plain model only mark
+    their name dirty, a single idle callback of the GTK main loop then increments the counter of every dirty name once,
+    which the controllers observe with assign=True. Any number of changes between two idle callbacks thus cost one
+    observer dispatch per name. All other attributes are read from the plain model.
+    """
+    status = 0
+    ping = 0
+    history = 0
+    messages = 0
+    config = 0
+    __observables__ = ["status", "ping", "history", "messages", "config"]
+
+    def __init__(self, network_manager_model):
+        ModelMT.__init__(self)
+        self.network_manager_model = network_manager_model
+        self._dirty = []
+        self._dirty_lock = threading.Lock()
+        self._source_id = None
+        network_manager_model.add_listener(self.on_model_changed)
+
+    def on_model_changed(self, name):
+        """
+        Marks a changed part of the plain model dirty. Called from any thread.
+        :param name: 'status', 'ping', 'history', 'messages' or 'config'
+        :return:
+        """
+        with self._dirty_lock:
+            if name not in self._dirty:
+                self._dirty.append(name)
+            if self._source_id is None:
+                self._source_id = GLib.idle_add(self._notify_dirty)
+
+    def _notify_dirty(self):
+        """
+        Notifies the observers of the counters of all parts changed since the last call. Called from the GTK main loop.
+        :return: False to be called only once
+        """
+        with self._dirty_lock:
+            dirty = self._dirty
+            self._dirty = []
+            self._source_id = None
+        for name in dirty:
+            setattr(self, name, getattr(self, name) + 1)
+        return False
+
+    def __getattr__(self, name):
+        # only called for attributes the adapter does not have itself
+        if name == "network_manager_model":
+            raise AttributeError(name)
+        return getattr(self.network_manager_model, name)
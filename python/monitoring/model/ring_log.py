@@ -0,0 +1,215 @@
+"""
+.. module:: ring log
+   :platform: Unix, Windows
+   :synopsis: a module holding a bounded log, which optionally spills evicted entries to rotating files on disk
+
+"""
+import itertools
+import json
+import os
+import threading
+from collections import deque
+
+from rafcon.utils import log
+logger = log.get_logger(__name__)
+
+# the number of bytes read at once when reading a spill file backwards
+READ_BLOCK_SIZE = 65536
+
+
+def _read_lines_backwards(path):
+    """
+    Yields the lines of a file starting with the last one. The file is read block by block from its end, thus only
+    the blocks holding the requested lines are read.
+    :param path: the path of the file
+    :return: a generator of the lines without their line breaks
+    """
+    with open(path, "rb") as spilled:
+        spilled.seek(0, os.SEEK_END)
+        position = spilled.tell()
+        remainder = ""
+        while position > 0:
+            size = min(READ_BLOCK_SIZE, position)
+            position -= size
+            spilled.seek(position)
+            lines = (spilled.read(size) + remainder).split("\n")
+            # the first line may continue in the previous block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+
+def _to_tuple(value):
+    """
+    Converts lists read from the spill file back to the tuples they were written from
+    :param value: the loaded value
+    :return: the value with all lists replaced by tuples
+    """
+    if isinstance(value, list):
+        return tuple(_to_tuple(item) for item in value)
+    return value
+
+
+class SpillFile(object):
+    """
+    An append-only file of log entries, one json line per entry. If the file exceeds max_bytes, it is rotated to
+    path.1, path.1 to path.2 and so on. At most backup_count rotated files are kept.
+    """
+
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = open(path, "a")
+
+    def write(self, entry):
+        """
+        Appends an entry and rotates the files if necessary
+        :param entry: a tuple of json serializable values; other values are stored as strings
+        :return:
+        """
+        self._file.write(json.dumps(entry, default=str) + "\n")
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = "{0}.{1}".format(self.path, index)
+            if os.path.exists(source):
+                os.rename(source, "{0}.{1}".format(self.path, index + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, self.path + ".1")
+        self._file = open(self.path, "w")
+
+    def read_backwards(self, skip, count):
+        """
+        Reads entries starting with the most recently written one. Only the ends of the files holding the requested
+        entries are read.
+        :param skip: the number of most recent entries to skip
+        :param count: the maximal number of entries to read
+        :return: a list of entries, the most recent one last
+        """
+        self._file.flush()
+        entries = []
+        paths = [self.path] + ["{0}.{1}".format(self.path, index) for index in range(1, self.backup_count + 1)]
+        for path in paths:
+            if len(entries) >= count or not os.path.exists(path):
+                break
+            for line in _read_lines_backwards(path):
+                if skip > 0:
+                    skip -= 1
+                    continue
+                entries.append(_to_tuple(json.loads(line)))
+                if len(entries) >= count:
+                    break
+        entries.reverse()
+        return entries
+
+    def close(self):
+        self._file.close()
+
+
+class RingLog(object):
+    """
+    A log holding at most capacity entries in memory. Appending to a full log evicts the oldest entry, which is
+    written to the spill file, if one is set.
+    """
+
+    def __init__(self, capacity, spill_file=None):
+        self._entries = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.spill_file = spill_file
+        self.total = 0
+
+    @property
+    def capacity(self):
+        return self._entries.maxlen
+
+    def configure(self, capacity, spill_file=None):
+        """
+        Changes the capacity and the spill file. Entries that do not fit anymore are evicted.
+        :param capacity: the maximal number of entries held in memory
+        :param spill_file: the SpillFile evicted entries are written to or None
+        :return:
+        """
+        with self._lock:
+            if self.spill_file is not None and self.spill_file is not spill_file:
+                self.spill_file.close()
+            self.spill_file = spill_file
+            entries = self._entries
+            while len(entries) > capacity:
+                self._evict(entries.popleft())
+            self._entries = deque(entries, maxlen=capacity)
+
+    def append(self, entry):
+        """
+        Appends an entry and evicts the oldest one, if the log is full. A log with capacity 0 holds no entries, the
+        entry is evicted right away.
+        :param entry: the entry
+        :return:
+        """
+        with self._lock:
+            if not self._entries.maxlen:
+                self._evict(entry)
+            else:
+                if len(self._entries) == self._entries.maxlen:
+                    self._evict(self._entries[0])
+                self._entries.append(entry)
+            self.total += 1
+
+    def _evict(self, entry):
+        if self.spill_file is not None:
+            try:
+                self.spill_file.write(entry)
+            except (IOError, OSError) as e:
+                logger.error("Cannot spill log entry to {0}: {1}".format(self.spill_file.path, e))
+                self.spill_file = None
+
+    def page(self, page, page_size):
+        """
+        Returns a page of entries. Page 0 holds the most recent entries, higher pages hold older ones, which are read
+        from the spill file, if they are not held in memory anymore.
+        :param page: the number of the page
+        :param page_size: the number of entries per page
+        :return: a list of entries, the most recent one last
+        """
+        # the spill file is read under the lock too, as appending may write to and rotate it at any time
+        with self._lock:
+            entries = self._entries
+            end = len(entries) - page * page_size
+            start = max(0, end - page_size)
+            result = list(itertools.islice(entries, start, end)) if end > 0 else []
+            if len(result) < page_size and self.spill_file is not None:
+                skip = max(0, -end)
+                result = self.spill_file.read_backwards(skip, page_size - len(result)) + result
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+
+class LogWindow(object):
+    """
+    The bookkeeping of an observable list showing a part of a RingLog. first is the running number of the first entry
+    of the list, generation is changed whenever the list is refilled instead of appended to or trimmed.
+    """
+    __slots__ = ("first", "generation")
+
+    def __init__(self):
+        self.first = 0
+        self.generation = 0
@@ -95,15 +95,29 @@ class MonitoringExecutionEngine(ExecutionEngine):
 
     def send_current_execution_mode(self, protocol=None):
         """
-        This function sends the current execution engine status to the connected remote server
+        This function sends the current execution engine status to the connected remote server. Servers supporting
+        the reliable channel receive the commands acknowledged and in order, without waiting for the acknowledgement
+        of the previous command.
         :return:
         """
-        if protocol:
-            self.communication_endpoint.send_message_non_acknowledged(protocol, self.communication_endpoint.server_address)
-        else:
+        address = self.communication_endpoint.server_address
+        if not protocol:
             protocol = Protocol(MessageType.COMMAND, str(self.status.execution_mode.value))
-            self.communication_endpoint.send_message_non_acknowledged(protocol, self.communication_endpoint.server_address)
-            network_manager_model.add_to_message_list(str(self.status.execution_mode.value),
-                                                      self.communication_endpoint.server_address, "send")
+            network_manager_model.add_to_message_list(str(self.status.execution_mode.value), address, "send")
+        if self.communication_endpoint.reliable_channel.has_peer(address):
+            deferred = self.communication_endpoint.reliable_channel.send(protocol, address)
+            deferred.addCallback(self._on_command_acknowledged, protocol)
+        else:
+            self.communication_endpoint.send_message_non_acknowledged(protocol, address)
         # logger.info("The current execution mode is going to be sent: {0}".format(protocol))
 
+    @staticmethod
+    def _on_command_acknowledged(acknowledged, protocol):
+        """
+        Logs commands the remote server did not acknowledge
+        :param acknowledged: whether the command was acknowledged
+        :param protocol: the sent command
+        :return:
+        """
+        if not acknowledged:
+            logger.warn("The remote server did not acknowledge the command {0}".format(protocol.message_content))
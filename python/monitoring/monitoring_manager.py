@@ -1,6 +1,6 @@
 
-from client import MonitoringClient
-from server import MonitoringServer
+import copy
+
 from acknowledged_udp.config import global_network_config
 from rafcon.core.singleton import argument_parser
 
@@ -13,6 +13,9 @@ from twisted.internet import defer
 
 logger = log.get_logger(__name__)
 
+# the config keys that require to close the socket and to set up a new endpoint when changed
+REBIND_KEYS = frozenset(["SERVER", "SERVER_IP", "SERVER_UDP_PORT", "ENABLED"])
+
 
 class MonitoringManager:
     """
@@ -34,6 +37,8 @@ class MonitoringManager:
         self.endpoint_initialized = False
         self.config = None
         self.config_flag = False
+        # the config values the endpoint was set up or last reconfigured with
+        self.applied_config = {}
 
     def initialize(self, setup_config):
         """
@@ -44,13 +49,17 @@ class MonitoringManager:
         if not self.config_flag:
             self.config = setup_config
             self.config_flag = True
+        self.applied_config = self.get_current_config()
+        # the endpoints are imported on demand, as the client depends on the GUI while the server may run headless
         if global_network_config.get_config_value("SERVER", True):
             if not self.endpoint:
+                from monitoring.server import MonitoringServer
                 self.endpoint = MonitoringServer()
             self.endpoint_initialized = self.endpoint.connect()
 
         else:
             if not self.endpoint:
+                from monitoring.client import MonitoringClient
                 self.endpoint = MonitoringClient()
             self.endpoint_initialized = self.endpoint.connect()
         return self.endpoint_initialized
@@ -109,14 +118,36 @@ class MonitoringManager:
         if self.endpoint:
             self.endpoint.shutdown()
 
+    @staticmethod
+    def get_current_config():
+        """
+        Function to get the current values of all known config keys
+        :return: a dict mapping the keys to copies of their values
+        """
+        from monitoring.model.network_model import network_manager_model
+        return dict((key, copy.deepcopy(global_network_config.get_config_value(key)))
+                    for key in network_manager_model.params)
+
     @defer.inlineCallbacks
     def reinitialize(self, addresses):
         """
         A method to reinitialize the plugin. Called when applying changes in config
-        Disconnects all connections and connects with new config
+        Only if the role, the address of the server or ENABLED changed, all connections are cut and a new endpoint is
+        set up. All other changes are applied by the endpoint while staying connected.
+        :param addresses: the addresses of the connected endpoints
         :return:
         """
-        yield defer.maybeDeferred(self.endpoint.cut_connection, addresses)
+        current_config = self.get_current_config()
+        changed_keys = set(key for key, value in current_config.iteritems() if self.applied_config.get(key) != value)
+        if self.endpoint is not None and self.endpoint_initialized and not changed_keys & REBIND_KEYS:
+            if changed_keys:
+                yield defer.maybeDeferred(self.endpoint.apply_config, changed_keys)
+            else:
+                logger.info("No config values changed")
+            self.applied_config = current_config
+            defer.returnValue(True)
+        if self.endpoint is not None:
+            yield defer.maybeDeferred(self.endpoint.cut_connection, addresses)
         if self.networking_enabled():
             logger.info("Reinitializing...")
             self.endpoint = None
@@ -0,0 +1,186 @@
+"""
+.. module:: overhead governor
+   :platform: Unix, Windows
+   :synopsis: a module reducing the detail of the status stream while the server or the links are overloaded
+
+"""
+import math
+import sys
+import time
+from collections import OrderedDict
+try:
+    import resource
+except ImportError:
+    # the resource module is not available on Windows
+    resource = None
+
+from acknowledged_udp.config import global_network_config
+
+from monitoring import constants
+from monitoring.model.network_model import network_manager_model
+from monitoring.status_codec import MODE_FULL, MODE_BATCH, MODE_DEPTH, MODE_SAMPLE, MODE_NAMES
+
+from rafcon.utils import log
+logger = log.get_logger(__name__)
+
+# the length of the window the load is measured over in seconds
+EVALUATION_WINDOW = 1.
+# the number of calm windows before the detail is increased again
+RESTORE_WINDOWS = 3
+# the loss rate assumed for links without measured loss when estimating their capacity
+MIN_LOSS = 0.001
+# RUSAGE_THREAD of Linux, which the resource module of Python 2 does not define
+RUSAGE_THREAD = 1
+
+
+def get_cpu_time():
+    """
+    Returns the processor time of the calling thread. Unlike the wall-clock time, it does not grow while the reactor
+    thread is preempted or waits for the GIL held by the state execution threads. Where the time of a single thread
+    is not available, the processor time of the process is used instead, on Windows the wall-clock time.
+    :return: the processor time in seconds
+    """
+    if resource is not None and sys.platform.startswith("linux"):
+        usage = resource.getrusage(RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    return time.clock()
+
+
+class OverheadGovernor(object):
+    """
+    This class measures the processor time the server spends per status change, the rate of status changes and the
+    capacity of the link to every client, estimated from its round trip time and probe loss rate. If the processing time
+    exceeds GOVERNOR_CPU_BUDGET or a client is sent more than its link can carry, the monitoring mode is lowered by
+    one step: batch more aggressively, then limit the depth of the sent states, then sample the leaf states. After
+    RESTORE_WINDOWS calm windows the mode is raised again by one step.
+    """
+
+    def __init__(self):
+        self.mode = MODE_FULL
+        self._window_start = time.time()
+        self._busy_time = 0.
+        self._events = 0
+        self._bytes = {}
+        self._calm_windows = 0
+        self._sampled = OrderedDict()
+        self._last_sample = 0.
+
+    def record_flush(self, events, duration):
+        """
+        Adds a flush of the status broadcaster to the current window
+        :param events: the number of status changes handled
+        :param duration: the processor time the flush took in seconds, as measured by get_cpu_time
+        :return:
+        """
+        self._events += events
+        self._busy_time += duration
+
+    def record_bytes(self, address, number_of_bytes):
+        """
+        Adds the bytes queued for a client to the current window
+        :param address: the address of the client
+        :param number_of_bytes: the number of queued bytes
+        :return:
+        """
+        self._bytes[address] = self._bytes.get(address, 0) + number_of_bytes
+
+    def evaluate(self):
+        """
+        Changes the mode, if the current window is over and the load requires it
+        :return: the new mode or None, if the mode did not change
+        """
+        now = time.time()
+        elapsed = now - self._window_start
+        if elapsed < EVALUATION_WINDOW:
+            return None
+        budget = float(global_network_config.get_config_value("GOVERNOR_CPU_BUDGET", constants.GOVERNOR_CPU_BUDGET))
+        load = self._busy_time / elapsed
+        overloaded_links = [address for address, number_of_bytes in self._bytes.iteritems()
+                            if number_of_bytes / elapsed > self.get_link_capacity(address)]
+        if self._events:
+            logger.debug("{0} status changes/s, {1:.1f} us each, load {2:.3f}".format(
+                self._events / elapsed, self._busy_time / self._events * 1e6, load))
+        self._window_start = now
+        self._busy_time = 0.
+        self._events = 0
+        self._bytes = {}
+
+        if load > budget or overloaded_links:
+            self._calm_windows = 0
+            if self.mode < MODE_SAMPLE:
+                logger.info("Monitoring overloaded (load {0:.3f}, overloaded links {1})".format(load,
+                                                                                                overloaded_links))
+                return self._set_mode(self.mode + 1)
+        elif load < budget / 2.:
+            self._calm_windows += 1
+            if self._calm_windows >= RESTORE_WINDOWS and self.mode > MODE_FULL:
+                self._calm_windows = 0
+                return self._set_mode(self.mode - 1)
+        return None
+
+    def _set_mode(self, mode):
+        logger.info("Monitoring mode changed to {0}".format(MODE_NAMES[mode]))
+        self.mode = mode
+        if mode < MODE_SAMPLE:
+            self._sampled.clear()
+        return mode
+
+    @staticmethod
+    def get_link_capacity(address):
+        """
+        Estimates the number of bytes per second the link to a client can carry, using the throughput formula of
+        Mathis et al. with one datagram as segment size
+        :param address: the address of the client
+        :return: the capacity in bytes per second or infinity, if no round trip time was measured yet
+        """
+        connection = network_manager_model.get_connection(address)
+        if connection is None or not connection.rtt:
+            return float("inf")
+        max_size = int(global_network_config.get_config_value("STATUS_BATCH_MAX_SIZE",
+                                                              constants.STATUS_BATCH_MAX_SIZE))
+        return max_size / connection.rtt * 1.22 / math.sqrt(max(connection.loss, MIN_LOSS))
+
+    def get_batch_interval(self, interval):
+        """
+        Returns the interval between two flushes of the status broadcaster
+        :param interval: the configured STATUS_BATCH_INTERVAL
+        :return: the interval to use in the current mode
+        """
+        if self.mode >= MODE_BATCH:
+            return interval * float(global_network_config.get_config_value("GOVERNOR_BATCH_FACTOR",
+                                                                           constants.GOVERNOR_BATCH_FACTOR))
+        return interval
+
+    def filter(self, records_by_table):
+        """
+        Removes the records the current mode does not send
+        :param records_by_table: a dict mapping each StateIdTable to a list of (state_id, status_value) tuples
+        :return: the filtered dict
+        """
+        if self.mode < MODE_DEPTH:
+            return records_by_table
+        max_depth = int(global_network_config.get_config_value("GOVERNOR_MAX_DEPTH", constants.GOVERNOR_MAX_DEPTH))
+        filtered = OrderedDict()
+        for table, records in records_by_table.iteritems():
+            kept = []
+            for state_id, status_value in records:
+                if table.depths[state_id] > max_depth:
+                    continue
+                if self.mode >= MODE_SAMPLE and table.subtree_ends[state_id] == state_id + 1:
+                    # leaf states are sent with their latest status once per sample interval
+                    self._sampled.pop((table, state_id), None)
+                    self._sampled[(table, state_id)] = status_value
+                    continue
+                kept.append((state_id, status_value))
+            if kept:
+                filtered[table] = kept
+
+        now = time.time()
+        sample_interval = float(global_network_config.get_config_value("GOVERNOR_LEAF_SAMPLE_INTERVAL",
+                                                                       constants.GOVERNOR_LEAF_SAMPLE_INTERVAL))
+        if self._sampled and now - self._last_sample >= sample_interval:
+            self._last_sample = now
+            for (table, state_id), status_value in self._sampled.iteritems():
+                filtered.setdefault(table, []).append((state_id, status_value))
+            self._sampled.clear()
+        return filtered
@@ -0,0 +1,45 @@
+"""
+.. module:: reconnect backoff
+   :platform: Unix, Windows
+   :synopsis: a module computing the delays between the registration attempts of a client
+
+"""
+import random
+
+from acknowledged_udp.config import global_network_config
+
+from monitoring import constants
+
+
+class ReconnectBackoff(object):
+    """
+    This class computes capped exponential backoff delays with jitter. The first delay is
+    MAX_TIME_WAITING_BETWEEN_CONNECTION_TRY_OUTS, every following one is RECONNECT_BACKOFF_FACTOR times longer up to
+    RECONNECT_MAX_DELAY. Each delay is drawn from the upper half of the current backoff interval, thus clients that
+    lost the same server at the same time do not retry in the same instant.
+    """
+
+    def __init__(self):
+        self.attempts = 0
+
+    def reset(self):
+        """
+        Starts over with the initial delay, called after a successful registration
+        :return:
+        """
+        self.attempts = 0
+
+    def next_delay(self):
+        """
+        Returns the delay before the next registration attempt
+        :return: the delay in seconds
+        """
+        initial_delay = float(global_network_config.get_config_value("MAX_TIME_WAITING_BETWEEN_CONNECTION_TRY_OUTS",
+                                                                     constants.RECONNECT_INITIAL_DELAY))
+        max_delay = float(global_network_config.get_config_value("RECONNECT_MAX_DELAY", constants.RECONNECT_MAX_DELAY))
+        factor = float(global_network_config.get_config_value("RECONNECT_BACKOFF_FACTOR",
+                                                              constants.RECONNECT_BACKOFF_FACTOR))
+        # the exponent is limited to keep the power finite, the delay is capped anyway
+        delay = min(max_delay, initial_delay * factor ** min(self.attempts, 64))
+        self.attempts += 1
+        return delay / 2. + random.uniform(0., delay / 2.)
@@ -0,0 +1,398 @@
+"""
+.. module:: reliable channel
+   :platform: Unix, Windows
+   :synopsis: a module sending acknowledged control messages from within the reactor over a sliding window, without
+              blocking a thread per message
+
+"""
+import random
+import struct
+import time
+from collections import OrderedDict, deque
+
+from acknowledged_udp.protocol import Protocol, MessageType
+from acknowledged_udp.config import global_network_config
+
+from monitoring import constants
+from monitoring.model.network_model import network_manager_model
+
+from rafcon.utils import log
+logger = log.get_logger(__name__)
+
+# channel datagrams are sent without the acknowledged_udp protocol and are recognized by this prefix
+RELIABLE_MAGIC = "\x00RC"
+RELIABLE_DATA = 1
+RELIABLE_ACK = 2
+# magic, kind, session of the sender, sequence number, window base, message type code; the message content follows
+RELIABLE_DATA_HEADER = struct.Struct("!3sBIIIB")
+# the type code of a datagram without message, which only advances the window base after a message was given up
+NO_MESSAGE = 0
+# magic, kind, session of the sender, cumulative acknowledgement, selective acknowledgement bitmap
+RELIABLE_ACK_DATAGRAM = struct.Struct("!3sBIII")
+# the number of sequence numbers following the cumulative acknowledgement covered by the bitmap
+SELECTIVE_ACK_RANGE = 32
+# the codes of the message types the channel carries
+MESSAGE_TYPE_CODES = {MessageType.COMMAND: 1,
+                      MessageType.DISABLE: 2,
+                      MessageType.UNREGISTER: 3}
+MESSAGE_TYPES = dict((code, message_type) for message_type, code in MESSAGE_TYPE_CODES.iteritems())
+# the retransmission timeout before a round trip time was measured and its lower bound in seconds
+INITIAL_RETRANSMISSION_TIMEOUT = 1.
+MIN_RETRANSMISSION_TIMEOUT = 0.05
+# the number of sequence numbers ahead of the next expected one a receiver buffers
+RECEIVE_BUFFER_LIMIT = 1024
+# the number of previous sessions of a peer whose late datagrams are ignored
+RETIRED_SESSIONS = 8
+
+
+class PendingMessage(object):
+    """
+    A sent message waiting for its acknowledgement
+    """
+    __slots__ = ("deferred", "type_code", "content", "deadline", "timeout", "call", "fast_retransmitted")
+
+    def __init__(self, deferred, type_code, content):
+        self.deferred = deferred
+        self.type_code = type_code
+        self.content = content
+        self.deadline = None
+        self.timeout = None
+        self.call = None
+        self.fast_retransmitted = False
+
+
+class PeerSender(object):
+    """
+    The sending side of the channel to a single peer
+    """
+    __slots__ = ("session", "next_sequence_number", "in_flight", "queue")
+
+    def __init__(self):
+        # a random session distinguishes the sequence numbers of this peer from the ones sent to it before
+        self.session = random.getrandbits(32)
+        self.next_sequence_number = 1
+        # the sent and not yet acknowledged messages by their sequence numbers, in the order they were sent
+        self.in_flight = OrderedDict()
+        # the messages waiting for a free slot in the window
+        self.queue = deque()
+
+    def get_base(self):
+        """
+        :return: the lowest sequence number that may still be retransmitted
+        """
+        return next(iter(self.in_flight)) if self.in_flight else self.next_sequence_number
+
+
+class PeerReceiver(object):
+    """
+    The receiving side of the channel from a single peer
+    """
+    __slots__ = ("session", "next_sequence_number", "buffer")
+
+    def __init__(self, session):
+        self.session = session
+        self.next_sequence_number = 1
+        # the received messages following a missing one by their sequence numbers
+        self.buffer = {}
+
+
+class ReliableChannel(object):
+    """
+    This class sends acknowledged messages to the remote endpoints that agreed on the reliable channel capability.
+
+    Each peer has its own sequence numbers. Up to RELIABLE_WINDOW_SIZE messages per peer are in flight at once,
+    further messages wait until a slot of the window is acknowledged. Every message gets a Deferred, which is fired
+    with True by its acknowledgement or with False, if no acknowledgement arrived within
+    MAX_TIME_WAITING_FOR_ACKNOWLEDGEMENTS seconds. Unacknowledged messages are retransmitted by reactor.callLater
+    after a retransmission timeout derived from the round trip time of the connection, which is doubled after every
+    retransmission. A message that is not acknowledged while a later one is selectively acknowledged is retransmitted
+    once right away.
+
+    The receiver acknowledges every message with the cumulative acknowledgement of all messages it delivered and a
+    bitmap of the buffered messages following them. Messages are delivered to the datagram_received_function of the
+    endpoint in the order they were sent. Every message carries the window base of the sender, thus the receiver
+    skips the messages the sender gave up on instead of waiting for them. A datagram of a new session of the sender
+    resets the receiver, late datagrams of its previous sessions are ignored.
+
+    Messages to endpoints without the capability are still sent with send_message_acknowledged in a worker thread.
+    """
+
+    def __init__(self, endpoint):
+        """
+        :param endpoint: the MonitoringServer or MonitoringClient
+        """
+        self.endpoint = endpoint
+        self._senders = {}
+        self._receivers = {}
+        # the sessions a peer used before its current one, by the addresses of the peers
+        self._retired_sessions = {}
+
+    def add_peer(self, address):
+        """
+        Sends all further acknowledged messages to a remote endpoint over the channel
+        :param address: the address of the remote endpoint
+        :return:
+        """
+        if address not in self._senders:
+            self._senders[address] = PeerSender()
+
+    def remove_peer(self, address):
+        """
+        Sends all further acknowledged messages to a remote endpoint with the acknowledged_udp protocol again. The
+        Deferreds of the messages not acknowledged yet are fired with False.
+        :param address: the address of the remote endpoint
+        :return:
+        """
+        sender = self._senders.pop(address, None)
+        self._receivers.pop(address, None)
+        self._retired_sessions.pop(address, None)
+        if sender is not None:
+            self._fail(sender)
+
+    def has_peer(self, address):
+        return address in self._senders
+
+    def send(self, protocol, address):
+        """
+        Sends a message acknowledged. Can be called from any thread, the message is sent from within the reactor.
+        Called from the reactor thread, the message is sent right away.
+        :param protocol: the message, its type has to be one of MESSAGE_TYPE_CODES
+        :param address: the address of the remote endpoint
+        :return: a Deferred fired in the reactor with True, if the message was acknowledged, False otherwise
+        """
+        from twisted.internet import defer, reactor
+        from twisted.python import threadable
+        deferred = defer.Deferred()
+        if threadable.isInIOThread():
+            self._send(protocol, address, deferred)
+        else:
+            reactor.callFromThread(self._send, protocol, address, deferred)
+        return deferred
+
+    def _send(self, protocol, address, deferred):
+        from twisted.internet import threads
+        sender = self._senders.get(address)
+        if sender is None:
+            threads.deferToThread(self.endpoint.send_message_acknowledged, protocol, address=address,
+                                  blocking=True).chainDeferred(deferred)
+            return
+        sender.queue.append(PendingMessage(deferred, MESSAGE_TYPE_CODES[protocol.message_type],
+                                           protocol.message_content))
+        self._fill_window(address, sender)
+
+    def _fill_window(self, address, sender):
+        """
+        Sends queued messages while the window of the peer has free slots
+        :param address: the address of the remote endpoint
+        :param sender: the PeerSender of the remote endpoint
+        :return:
+        """
+        window_size = int(global_network_config.get_config_value("RELIABLE_WINDOW_SIZE",
+                                                                  constants.RELIABLE_WINDOW_SIZE))
+        failed = []
+        while sender.queue and len(sender.in_flight) < window_size:
+            pending = sender.queue.popleft()
+            if self.endpoint.transport is None:
+                failed.append(pending)
+                continue
+            sequence_number = sender.next_sequence_number
+            sender.next_sequence_number = (sequence_number + 1) & 0xffffffff
+            timeout = float(global_network_config.get_config_value("MAX_TIME_WAITING_FOR_ACKNOWLEDGEMENTS"))
+            pending.deadline = time.time() + timeout
+            pending.timeout = self.get_retransmission_timeout(address)
+            sender.in_flight[sequence_number] = pending
+            given_up = self._transmit(address, sender, sequence_number)
+            if given_up is not None:
+                failed.append(given_up)
+        for pending in failed:
+            pending.deferred.callback(False)
+
+    def _transmit(self, address, sender, sequence_number):
+        """
+        Sends or retransmits a message in flight and schedules its next retransmission or its timeout. A message whose
+        deadline passed is given up, its Deferred is left to the caller, which fires it after it is done with the
+        window.
+        :param address: the address of the remote endpoint
+        :param sender: the PeerSender of the remote endpoint
+        :param sequence_number: the sequence number of the message
+        :return: the given up PendingMessage or None
+        """
+        from twisted.internet import reactor
+        pending = sender.in_flight[sequence_number]
+        if pending.call is not None and pending.call.active():
+            pending.call.cancel()
+        remaining = pending.deadline - time.time()
+        if remaining <= 0. or self.endpoint.transport is None:
+            del sender.in_flight[sequence_number]
+            logger.warn("Message {0} to {1} was not acknowledged".format(sequence_number, address))
+            if self.endpoint.transport is not None:
+                # let the receiver deliver the messages it buffered behind the given up one
+                self.endpoint.transport.write(RELIABLE_DATA_HEADER.pack(RELIABLE_MAGIC, RELIABLE_DATA, sender.session,
+                                                                        sender.next_sequence_number,
+                                                                        sender.get_base(), NO_MESSAGE), address)
+            return pending
+        self.endpoint.transport.write(RELIABLE_DATA_HEADER.pack(RELIABLE_MAGIC, RELIABLE_DATA, sender.session,
+                                                                sequence_number, sender.get_base(),
+                                                                pending.type_code) + pending.content, address)
+        pending.call = reactor.callLater(min(pending.timeout, remaining), self._retransmit, address, sender,
+                                         sequence_number)
+        pending.timeout *= 2.
+        return None
+
+    def _retransmit(self, address, sender, sequence_number):
+        """
+        Retransmits a message in flight when its retransmission timeout expired or gives it up, if its deadline passed
+        :param address: the address of the remote endpoint
+        :param sender: the PeerSender of the remote endpoint
+        :param sequence_number: the sequence number of the message
+        :return:
+        """
+        given_up = self._transmit(address, sender, sequence_number)
+        if given_up is not None:
+            self._fill_window(address, sender)
+            # fired last, as the callbacks may remove the peer
+            given_up.deferred.callback(False)
+
+    @staticmethod
+    def get_retransmission_timeout(address):
+        """
+        Computes the retransmission timeout from the smoothed round trip time and jitter, as TCP does
+        :param address: the address of the remote endpoint
+        :return: the timeout in seconds
+        """
+        connection = network_manager_model.get_connection(address)
+        if connection is None or connection.rtt is None:
+            return INITIAL_RETRANSMISSION_TIMEOUT
+        return max(connection.rtt + 4. * connection.jitter, MIN_RETRANSMISSION_TIMEOUT)
+
+    def handle_datagram(self, datagram, address):
+        """
+        Acknowledges and delivers received messages and fires the Deferreds of acknowledged ones
+        :param datagram: the received datagram
+        :param address: the address where the datagram originates
+        :return: True, if the datagram was a channel datagram, False otherwise
+        """
+        if not datagram.startswith(RELIABLE_MAGIC):
+            return False
+        try:
+            if ord(datagram[3]) == RELIABLE_ACK:
+                _, _, session, cumulative_ack, bitmap = RELIABLE_ACK_DATAGRAM.unpack(datagram)
+                self._process_ack(address, session, cumulative_ack, bitmap)
+            else:
+                _, _, session, sequence_number, base, type_code = RELIABLE_DATA_HEADER.unpack_from(datagram)
+                if type_code == NO_MESSAGE:
+                    self._process_data(address, session, sequence_number, base, None)
+                elif type_code in MESSAGE_TYPES:
+                    self._process_data(address, session, sequence_number, base,
+                                       Protocol(MESSAGE_TYPES[type_code], datagram[RELIABLE_DATA_HEADER.size:]))
+        except (struct.error, IndexError):
+            logger.warn("Invalid channel datagram from {0}".format(address))
+        return True
+
+    def _process_ack(self, address, session, cumulative_ack, bitmap):
+        """
+        Fires the Deferreds of the acknowledged messages, retransmits the messages the receiver reported as missing
+        and sends queued messages into the freed slots of the window
+        :param address: the address of the remote endpoint
+        :param session: the session of the acknowledged messages
+        :param cumulative_ack: the highest sequence number up to which all messages were delivered
+        :param bitmap: bit i is set, if message cumulative_ack + 2 + i is buffered by the receiver
+        :return:
+        """
+        sender = self._senders.get(address)
+        if sender is None or session != sender.session:
+            return
+        highest_acknowledged = None
+        acknowledged = []
+        given_up = []
+        for sequence_number in sender.in_flight.keys():
+            offset = (sequence_number - cumulative_ack) & 0xffffffff
+            if offset == 0 or offset > 0x7fffffff or \
+                    (2 <= offset < SELECTIVE_ACK_RANGE + 2 and bitmap & (1 << (offset - 2))):
+                pending = sender.in_flight.pop(sequence_number)
+                if pending.call is not None and pending.call.active():
+                    pending.call.cancel()
+                acknowledged.append(pending)
+                highest_acknowledged = sequence_number
+        if highest_acknowledged is not None:
+            for sequence_number, pending in sender.in_flight.items():
+                if (highest_acknowledged - sequence_number) & 0xffffffff > 0x7fffffff:
+                    break
+                # a later message arrived, thus this one was most probably lost
+                if not pending.fast_retransmitted:
+                    pending.fast_retransmitted = True
+                    expired = self._transmit(address, sender, sequence_number)
+                    if expired is not None:
+                        given_up.append(expired)
+        self._fill_window(address, sender)
+        # fired last, as the callbacks may remove the peer
+        for pending in acknowledged:
+            pending.deferred.callback(True)
+        for pending in given_up:
+            pending.deferred.callback(False)
+
+    def _process_data(self, address, session, sequence_number, base, message):
+        """
+        Buffers a received message, delivers all messages that are complete in order and acknowledges them
+        :param address: the address of the remote endpoint
+        :param session: the session of the sender
+        :param sequence_number: the sequence number of the message
+        :param base: the lowest sequence number the sender may still retransmit
+        :param message: the received Protocol or None for a datagram only advancing the window base
+        :return:
+        """
+        receiver = self._receivers.get(address)
+        if receiver is None or receiver.session != session:
+            retired_sessions = self._retired_sessions.setdefault(address, deque(maxlen=RETIRED_SESSIONS))
+            if session in retired_sessions:
+                # a late datagram of a previous session must not reset the receiver of the current one
+                return
+            if receiver is not None:
+                retired_sessions.append(receiver.session)
+            receiver = self._receivers[address] = PeerReceiver(session)
+        offset = (sequence_number - receiver.next_sequence_number) & 0xffffffff
+        if message is not None and offset < RECEIVE_BUFFER_LIMIT:
+            receiver.buffer[sequence_number] = message
+        # the sender gave up on the messages below its base
+        skipped = (base - receiver.next_sequence_number) & 0xffffffff
+        deliverable = []
+        while skipped < RECEIVE_BUFFER_LIMIT and skipped or receiver.next_sequence_number in receiver.buffer:
+            message = receiver.buffer.pop(receiver.next_sequence_number, None)
+            if message is not None:
+                deliverable.append(message)
+            elif skipped:
+                logger.warn("Message {0} from {1} was given up".format(receiver.next_sequence_number, address))
+            receiver.next_sequence_number = (receiver.next_sequence_number + 1) & 0xffffffff
+            skipped = (base - receiver.next_sequence_number) & 0xffffffff
+
+        bitmap = 0
+        for offset in range(SELECTIVE_ACK_RANGE):
+            if (receiver.next_sequence_number + 1 + offset) & 0xffffffff in receiver.buffer:
+                bitmap |= 1 << offset
+        self.endpoint.transport.write(RELIABLE_ACK_DATAGRAM.pack(RELIABLE_MAGIC, RELIABLE_ACK, session,
+                                                                 (receiver.next_sequence_number - 1) & 0xffffffff,
+                                                                 bitmap), address)
+        for message in deliverable:
+            self.endpoint.datagram_received_function(message, address)
+
+    def _fail(self, sender):
+        """
+        Fires the Deferreds of all messages in flight or queued for a peer with False
+        :param sender: the PeerSender of the peer
+        :return:
+        """
+        pending_messages = sender.in_flight.values() + list(sender.queue)
+        sender.in_flight.clear()
+        sender.queue.clear()
+        for pending in pending_messages:
+            if pending.call is not None and pending.call.active():
+                pending.call.cancel()
+            pending.deferred.callback(False)
+
+    def stop(self):
+        """
+        Fires the Deferreds of all pending messages with False. Has to be called from within the reactor thread.
+        :return:
+        """
+        for sender in self._senders.values():
+            self._fail(sender)
@@ -0,0 +1,81 @@
+"""
+.. module:: remote state cache
+   :platform: Unix, Windows
+   :synopsis: a module caching the local states the monitoring client shows the remote execution status on
+
+"""
+from rafcon.core.states.state import State, StateExecutionStatus
+
+
+class RemoteStateCache(object):
+    """
+    This class caches the states of the local state machines by their paths and sets their execution status.
+    The cache of a state machine is dropped whenever the state machine is marked dirty, which happens on every
+    structural change.
+
+    When a state becomes active, only its inactive ancestors are set active. As parents are set inactive explicitly,
+    an ancestor that is already active has active ancestors as well and the walk towards the root stops there.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._state_machines = {}
+
+    def get_state(self, state_machine, state_path, as_check=False):
+        """
+        Returns the state of a state machine with the given path
+        :param state_machine: the state machine
+        :param state_path: the path of the state
+        :param as_check: whether a missing state is expected and must not be logged
+        :return: the state or None, if the state machine has no state with this path
+        """
+        state_machine_id = state_machine.state_machine_id
+        if self._state_machines.get(state_machine_id) is not state_machine:
+            self._observe(state_machine)
+        states = self._states[state_machine_id]
+        state = states.get(state_path)
+        if state is None:
+            state = state_machine.get_state_by_path(state_path, as_check=as_check)
+            if state is not None:
+                states[state_path] = state
+        return state
+
+    def _observe(self, state_machine):
+        """
+        Starts caching the states of a state machine and drops the cache of a replaced one with the same id
+        :param state_machine: the state machine
+        :return:
+        """
+        state_machine_id = state_machine.state_machine_id
+        replaced_state_machine = self._state_machines.get(state_machine_id)
+        if replaced_state_machine is not None:
+            replaced_state_machine.remove_observer(self, "marked_dirty")
+        state_machine.add_observer(self, "marked_dirty", notify_after_function=self.on_marked_dirty_after)
+        self._state_machines[state_machine_id] = state_machine
+        self._states[state_machine_id] = {}
+
+    def on_marked_dirty_after(self, observable, return_value, args):
+        """
+        Drops the cached states of a state machine that was changed
+        :param observable: the state machine
+        :param return_value:
+        :param args:
+        :return:
+        """
+        self._states[observable.state_machine_id] = {}
+
+    def set_status(self, state, state_execution_status):
+        """
+        Sets the execution status of a state and activates its inactive ancestors, if the state becomes active
+        :param state: the state
+        :param state_execution_status: the new StateExecutionStatus
+        :return:
+        """
+        if state.state_execution_status is not state_execution_status:
+            state.state_execution_status = state_execution_status
+        if state_execution_status is StateExecutionStatus.INACTIVE:
+            return
+        parent = state.parent
+        while isinstance(parent, State) and parent.state_execution_status is StateExecutionStatus.INACTIVE:
+            parent.state_execution_status = StateExecutionStatus.ACTIVE
+            parent = parent.parent
@@ -0,0 +1,174 @@
+"""
+.. module:: rtt probe
+   :platform: Unix, Windows
+   :synopsis: a module measuring the round trip time to the connected endpoints over the monitoring udp socket and
+              detecting endpoints that went silent
+
+"""
+import struct
+import time
+
+from acknowledged_udp.config import global_network_config
+
+from monitoring import constants
+from monitoring.model.network_model import network_manager_model
+
+from rafcon.utils import log
+logger = log.get_logger(__name__)
+
+# probe datagrams are sent without the acknowledged_udp protocol and are recognized by this prefix
+PROBE_MAGIC = "\x00RP"
+PROBE_PING = 1
+PROBE_PONG = 2
+# magic, kind, sequence number, send time of the ping echoed by the pong
+PROBE_DATAGRAM = struct.Struct("!3sBId")
+
+
+class RttProber(object):
+    """
+    This class sends a PING datagram to every connected endpoint that negotiated the heartbeat capability each
+    RTT_PROBE_INTERVAL seconds and answers the PINGs of the remote endpoints with PONG datagrams. The round trip
+    times of the PONGs are fed into the smoothed round trip time and jitter estimate of the connection in the network
+    manager model. A PING that is not answered before the next one is sent counts as lost.
+
+    Every datagram received from an endpoint counts as a heartbeat. An endpoint that was silent for
+    HEARTBEAT_STALE_THRESHOLD probe intervals is marked stale, one that was silent for HEARTBEAT_EVICTION_THRESHOLD
+    probe intervals is handed to the on_endpoint_lost function of the endpoint. Legacy endpoints neither know the probe
+    datagrams nor send anything periodically, thus they are neither probed nor checked for their heartbeat.
+    """
+
+    def __init__(self, endpoint, on_endpoint_lost):
+        """
+        :param endpoint: the MonitoringServer or MonitoringClient
+        :param on_endpoint_lost: a function called with the address of a silent endpoint and the reason as string
+        """
+        self.endpoint = endpoint
+        self.on_endpoint_lost = on_endpoint_lost
+        self._looping_call = None
+        self._interval = constants.RTT_PROBE_INTERVAL
+        self._sequence_number = 0
+        self._answered = {}
+        # the addresses of the endpoints that negotiated the heartbeat capability
+        self._peers = set()
+
+    def add_peer(self, address):
+        """
+        Starts probing an endpoint and checking its heartbeat
+        :param address: the address of the endpoint
+        :return:
+        """
+        self._peers.add(address)
+
+    def remove_peer(self, address):
+        """
+        Stops probing an endpoint and checking its heartbeat
+        :param address: the address of the endpoint
+        :return:
+        """
+        self._peers.discard(address)
+        self._answered.pop(address, None)
+
+    def get_peers(self):
+        """
+        :return: the connected endpoints that negotiated the heartbeat capability
+        """
+        return [address for address in network_manager_model.connected_ip_port if address in self._peers]
+
+    def start(self):
+        """
+        Starts probing periodically. Has to be called from within the reactor thread.
+        :return:
+        """
+        from twisted.internet import task
+        if self._looping_call is None:
+            self._interval = float(global_network_config.get_config_value("RTT_PROBE_INTERVAL",
+                                                                          constants.RTT_PROBE_INTERVAL))
+            self._looping_call = task.LoopingCall(self.probe)
+            self._looping_call.start(self._interval, now=False)
+
+    def stop(self):
+        """
+        Stops probing
+        :return:
+        """
+        if self._looping_call is not None:
+            if self._looping_call.running:
+                self._looping_call.stop()
+            self._looping_call = None
+
+    def reconfigure(self):
+        """
+        Applies a changed RTT_PROBE_INTERVAL from the next probe on. Has to be called from within the reactor thread.
+        :return:
+        """
+        self._interval = float(global_network_config.get_config_value("RTT_PROBE_INTERVAL",
+                                                                      constants.RTT_PROBE_INTERVAL))
+        if self._looping_call is not None:
+            self._looping_call.interval = self._interval
+
+    def probe(self):
+        """
+        Checks the liveness of all probed endpoints and sends a PING to every one of them
+        :return:
+        """
+        if self.endpoint.transport is None:
+            return
+        self.check_liveness()
+        peers = self.get_peers()
+        if self._sequence_number:
+            # the previous probe counts as lost, if it was not answered within one interval
+            for address in peers:
+                network_manager_model.set_connected_loss(address,
+                                                         self._answered.get(address) != self._sequence_number)
+        self._sequence_number = (self._sequence_number + 1) & 0xffffffff
+        datagram = PROBE_DATAGRAM.pack(PROBE_MAGIC, PROBE_PING, self._sequence_number, time.time())
+        for address in peers:
+            self.endpoint.transport.write(datagram, address)
+
+    def check_liveness(self):
+        """
+        Marks probed endpoints stale or hands them to on_endpoint_lost, if they were silent for too long. Stale
+        endpoints that are heard again are marked connected.
+        :return:
+        """
+        stale_threshold = float(global_network_config.get_config_value("HEARTBEAT_STALE_THRESHOLD",
+                                                                       constants.HEARTBEAT_STALE_THRESHOLD))
+        eviction_threshold = float(global_network_config.get_config_value("HEARTBEAT_EVICTION_THRESHOLD",
+                                                                          constants.HEARTBEAT_EVICTION_THRESHOLD))
+        now = time.time()
+        for address in self.get_peers():
+            connection = network_manager_model.get_connection(address)
+            if connection is None or connection.status in ("disconnected", "connecting", "backoff"):
+                continue
+            silence = now - connection.last_seen
+            if silence >= eviction_threshold * self._interval:
+                self.on_endpoint_lost(address, "no heartbeat for {0:.1f} s".format(silence))
+            elif silence >= stale_threshold * self._interval:
+                if connection.status == "connected":
+                    network_manager_model.set_connected_status(address, "stale",
+                                                               "no heartbeat for {0:.1f} s".format(silence))
+            elif connection.status == "stale":
+                network_manager_model.set_connected_status(address, "connected", "heartbeat received again")
+
+    def handle_datagram(self, datagram, address):
+        """
+        Records the heartbeat of the endpoint, answers PINGs and measures the round trip time of PONGs
+        :param datagram: the received datagram
+        :param address: the address where the datagram originates
+        :return: True, if the datagram was a probe datagram, False otherwise
+        """
+        network_manager_model.touch_connection(address)
+        if not datagram.startswith(PROBE_MAGIC):
+            return False
+        try:
+            _, kind, sequence_number, send_time = PROBE_DATAGRAM.unpack(datagram)
+        except struct.error:
+            logger.warn("Invalid probe datagram from {0}".format(address))
+            return True
+        if kind == PROBE_PING:
+            self.endpoint.transport.write(PROBE_DATAGRAM.pack(PROBE_MAGIC, PROBE_PONG, sequence_number, send_time),
+                                          address)
+        elif kind == PROBE_PONG:
+            self._answered[address] = sequence_number
+            network_manager_model.set_connected_rtt(address, time.time() - send_time)
+        return True
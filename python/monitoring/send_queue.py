@@ -0,0 +1,87 @@
+"""
+.. module:: send queue
+   :platform: Unix, Windows
+   :synopsis: a module holding the bounded queue of encoded status batches waiting to be sent to a single client
+
+"""
+from collections import deque, OrderedDict
+
+
+class QueuedBatch(object):
+    """
+    The status records of one state machine together with their encoded parts. The parts are encoded once and shared
+    by the queues of all clients with the same status format and subscription.
+    """
+    __slots__ = ("table", "records", "parts", "snapshot", "sent")
+
+    def __init__(self, table, records, parts, snapshot):
+        self.table = table
+        self.records = records
+        self.parts = parts
+        self.snapshot = snapshot
+        # the number of parts already sent
+        self.sent = 0
+
+
+class SendQueue(object):
+    """
+    The batches waiting to be sent to a single client. The length of the queue is the number of parts, i.e.
+    datagrams, waiting to be sent.
+    """
+
+    def __init__(self):
+        self.batches = deque()
+        self.length = 0
+        self.dropped = 0
+
+    def push(self, batch):
+        """
+        Appends a batch
+        :param batch: the QueuedBatch
+        :return:
+        """
+        self.batches.append(batch)
+        self.length += len(batch.parts)
+
+    def next_part(self):
+        """
+        Returns the next part to send without removing it
+        :return: the batch and the index of the part within the batch
+        """
+        batch = self.batches[0]
+        return batch, batch.sent
+
+    def advance(self):
+        """
+        Removes the part returned by next_part after it was sent
+        :return:
+        """
+        batch = self.batches[0]
+        batch.sent += 1
+        self.length -= 1
+        if batch.sent == len(batch.parts):
+            self.batches.popleft()
+
+    def compact(self):
+        """
+        Removes all batches and merges their records, keeping only the latest status of every state. A snapshot
+        supersedes all records of the same state machine queued before it. Records of parts already sent are merged
+        as well, they are sent again.
+        :return: a list of (table, records, snapshot) tuples, one per state machine
+        """
+        merged = OrderedDict()
+        number_of_records = 0
+        for batch in self.batches:
+            number_of_records += len(batch.records)
+            if batch.snapshot or batch.table not in merged:
+                merged[batch.table] = (OrderedDict(), batch.snapshot)
+            records = merged[batch.table][0]
+            for state_id, status_value in batch.records:
+                # re-insert the state to keep the records ordered by their latest change
+                records.pop(state_id, None)
+                records[state_id] = status_value
+        self.batches.clear()
+        self.length = 0
+        result = [(table, records.items(), snapshot) for table, (records, snapshot) in merged.iteritems()]
+        self.dropped += number_of_records - sum(len(records) for _, records, _ in result)
+        return result
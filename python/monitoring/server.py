@@ -1,18 +1,22 @@
 
-from rafcon.core.states.container_state import ContainerState
-from rafcon.core.states.library_state import LibraryState
-from rafcon.core.states.state import State
 from rafcon.core.singleton import state_machine_manager, state_machine_execution_engine
 from rafcon.core.execution.execution_status import StateMachineExecutionStatus
 
 from acknowledged_udp.config import global_network_config
-from acknowledged_udp.protocol import Protocol, MessageType, STATE_EXECUTION_STATUS_SEPARATOR
+from acknowledged_udp.protocol import Protocol, MessageType
 from acknowledged_udp.udp_server import UdpServer
 
+from monitoring import constants
+from monitoring.deferred_deadline import gather_with_deadline
 from monitoring.model.network_model import network_manager_model
-from threading import Thread
-from monitoring.ping_endpoint import ping_endpoint
-from twisted.internet import threads, defer
+from monitoring.reliable_channel import ReliableChannel
+from monitoring.rtt_probe import RttProber
+from monitoring.state_registry import StateObserverRegistry
+from monitoring.status_broadcaster import StatusBroadcaster
+from monitoring.status_codec import SUPPORTED_CAPABILITIES, CAPABILITY_RELIABLE_CHANNEL, CAPABILITY_HEARTBEAT, \
+    RESYNC_REQUEST, decode_resync_request
+from monitoring.subscription import ALL_STATES, decode_subscription
+from twisted.internet import defer
 
 from rafcon.utils import log
 logger = log.get_logger(__name__)
@@ -29,10 +33,16 @@ class MonitoringServer(UdpServer):
         UdpServer.__init__(self)
         self.connector = None
         self.initialized = False
-        self.register_to_new_state_machines()
-        self.register_all_statemachines()
+        self.state_observer_registry = StateObserverRegistry(self.on_state_execution_status_changed)
+        # the states activated by the execution threads are expanded in the reactor, before their changes are sent
+        self.status_broadcaster = StatusBroadcaster(self, self.state_observer_registry.expand_pending)
+        self.rtt_prober = RttProber(self, self.on_client_lost)
+        self.reliable_channel = ReliableChannel(self)
+        self.state_observer_registry.start()
         self.datagram_received_function = self.monitoring_data_received_function
         self.client_ip = []
+        self._shutdown_trigger = None
+        self._unregistering = None
 
     def connect(self):
         """
@@ -41,84 +51,53 @@ class MonitoringServer(UdpServer):
         """
         from twisted.internet import reactor
         self.connector = reactor.listenUDP(global_network_config.get_config_value("SERVER_UDP_PORT"), self)
+        if self._shutdown_trigger is None:
+            # logs off the clients also when the reactor of a headless server is stopped without a GUI shutdown
+            self._shutdown_trigger = reactor.addSystemEventTrigger("before", "shutdown", self.unregister_clients)
+        reactor.callFromThread(self.status_broadcaster.start)
+        reactor.callFromThread(self.rtt_prober.start)
         self.initialized = True
         logger.info("Initialized")
         return True
 
-    def register_to_new_state_machines(self):
+    def apply_config(self, changed_keys):
         """
-        This functions registers to add_state_machine calls of the state machine manager
+        Applies changed config values while staying connected to all clients. Most values are read whenever they are
+        used, only the log sizes and the intervals of the periodic tasks have to be updated.
+        :param changed_keys: the set of the changed config keys
         :return:
         """
-        state_machine_manager.add_observer(self, "add_state_machine",
-                                           notify_after_function=self.on_add_state_machine_after)
-
-    def on_add_state_machine_after(self, observable, return_value, args):
-        """
-        This function specifies what happens when a state machine is added to the state machine manager
-        :param observable: the state machine manager
-        :param return_value: the new state machine
-        :param args:
-        :return:
-        """
-        self.register_states_of_state_machine(args[1])
-
-    def register_all_statemachines(self):
-        """
-        This functions registers to all state machines currently known to the state machine manager
-        :return:
-        """
-        for id, sm in state_machine_manager.state_machines.iteritems():
-            self.register_states_of_state_machine(sm)
-
-    def register_states_of_state_machine(self, state_machine):
-        """
-        This functions registers all states of state machine.
-        :param state_machine: the state machine to register all states of
-        :return:
-        """
-        root = state_machine.root_state
-        root.add_observer(self, "state_execution_status",
-                          notify_after_function=self.on_state_execution_status_changed_after)
-
-        self.recursively_register_child_states(root)
+        from twisted.internet import reactor
+        logger.info("Applying changed config values: {0}".format(", ".join(sorted(changed_keys))))
+        network_manager_model.configure_logs()
+        reactor.callFromThread(self.status_broadcaster.reconfigure)
+        reactor.callFromThread(self.rtt_prober.reconfigure)
+        return True
 
-    def recursively_register_child_states(self, state):
+    def on_state_execution_status_changed(self, state, status_value):
         """
-        A function tha registers recursively all child states of a state
-        :param state:
+        This function specifies what happens if the execution status of a state changes
+        :param state: the state whose execution status changed
+        :param status_value: the value of the new StateExecutionStatus
         :return:
         """
-        if isinstance(state, ContainerState):
-            for state in state.states.itervalues():
-                self.recursively_register_child_states(state)
-                state.add_observer(self, "state_execution_status",
-                                   notify_after_function=self.on_state_execution_status_changed_after)
-
-        if isinstance(state, LibraryState):
-            self.recursively_register_child_states(state.state_copy)
-            state.add_observer(self, "state_execution_status",
-                               notify_after_function=self.on_state_execution_status_changed_after)
+        # called from the state execution threads: hand the change over to the reactor without doing any work here
+        if self.initialized:
+            self.status_broadcaster.push(state, status_value)
+        else:
+            logger.warn("Not initialized yet")
 
-    def on_state_execution_status_changed_after(self, observable, return_value, args):
+    def datagramReceived(self, datagram, address):
         """
-        This function specifies what happens if the state machine execution status of a state changes
-        :param observable: the state whose execution status changed
-        :param return_value: the new execution status
-        :param args: a list of all arguments of the observed function
+        Processes round trip time probes and reliable channel datagrams directly and passes all other datagrams to the
+        acknowledged udp protocol
+        :param datagram: the received datagram
+        :param address: the address where the datagram originates
         :return:
         """
-        assert isinstance(observable, State)
-        message = observable.get_path() + STATE_EXECUTION_STATUS_SEPARATOR + str(observable.state_execution_status.value)
-        protocol = Protocol(MessageType.STATE_ID, message)
-        # if len(self.get_registered_endpoints()) == 0:
-        #     logger.warn("No endpoint registered yet")
-        if self.initialized:
-            for address in network_manager_model.connected_ip_port:  # self.get_registered_endpoints():
-                self.send_message_non_acknowledged(protocol, address)
-                network_manager_model.add_to_message_list(message, address, "send")
-        else:
-            logger.warn("Not initialized yet")
+        if not self.rtt_prober.handle_datagram(datagram, address) and \
+                not self.reliable_channel.handle_datagram(datagram, address):
+            UdpServer.datagramReceived(self, datagram, address)
 
     def monitoring_data_received_function(self, message, address):
         """
@@ -133,28 +112,49 @@ class MonitoringServer(UdpServer):
         network_manager_model.add_to_message_list(message.message_content, address, "received")
 
         if message.message_type is MessageType.REGISTER:
+            # 'Registering@client_id@capability,capability@subscription' where capabilities and subscription are
+            # optional
             ident = message.message_content.split("@")
-            if 2 < ident:
+            while len(ident) < 4:
                 ident.append(None)
+            capabilities = SUPPORTED_CAPABILITIES.intersection(ident[2].split(",")) if ident[2] else frozenset()
             network_manager_model.set_connected_ip_port(address)
             network_manager_model.set_connected_id(address, ident[1])
             network_manager_model.set_connected_status(address, "connected")
+            if CAPABILITY_RELIABLE_CHANNEL in capabilities:
+                self.reliable_channel.add_peer(address)
+            else:
+                self.reliable_channel.remove_peer(address)
+            if CAPABILITY_HEARTBEAT in capabilities:
+                self.rtt_prober.add_peer(address)
+            else:
+                self.rtt_prober.remove_peer(address)
 
             if ident[1]:
-                protocol = Protocol(MessageType.ID, global_network_config.get_config_value("SERVER_ID"))
+                server_id = global_network_config.get_config_value("SERVER_ID")
+                if ident[2] is not None:
+                    server_id = "{0}@{1}".format(server_id, ",".join(sorted(capabilities)))
+                protocol = Protocol(MessageType.ID, server_id)
                 self.send_message_non_acknowledged(protocol, address)
                 network_manager_model.add_to_message_list(protocol, address, "send")
-            thread = Thread(target=ping_endpoint, args=(address, ))
-            thread.daemon = True
-            thread.start()
+            try:
+                subscription = decode_subscription(ident[3])
+            except ValueError:
+                logger.warn("Invalid subscription {0} of {1}, sending all states".format(ident[3], address))
+                subscription = ALL_STATES
+            self.status_broadcaster.add_client(address, capabilities, subscription)
 
         elif message.message_type is MessageType.COMMAND and network_manager_model.get_connected_status(address) is not "disabled":
             received_command = message.message_content.split("@")
 
             execution_mode = StateMachineExecutionStatus(int(received_command[0]))
 
-            # currently the monitoring plugin cannot select the target state machine
-            sm_key, sm = state_machine_manager.state_machines.items()[0]
+            # the command targets the state machine the client subscribed to or the first one
+            state_machine_id = self.status_broadcaster.get_subscription(address).state_machine_id
+            if state_machine_id in state_machine_manager.state_machines:
+                sm = state_machine_manager.state_machines[state_machine_id]
+            else:
+                sm_key, sm = state_machine_manager.state_machines.items()[0]
 
             if execution_mode is StateMachineExecutionStatus.STARTED:
                 # as there is no dedicated RUN_TO_STATE execution status the message has to be checked for an optional
@@ -180,12 +180,38 @@ class MonitoringServer(UdpServer):
                 state_machine_execution_engine.run_to_selected_state(received_command[1],
                                                                      state_machine_id=sm.state_machine_id)
 
+        elif message.message_type is MessageType.STATE_ID and \
+                message.message_content.startswith(RESYNC_REQUEST):
+            try:
+                state_machine_id = decode_resync_request(message.message_content)
+            except ValueError:
+                logger.warn("Ignoring the invalid resync request {0} of {1}".format(message.message_content, address))
+            else:
+                self.status_broadcaster.resync(state_machine_id, address)
+
         elif message.message_type is MessageType.UNREGISTER:
             network_manager_model.set_connected_status(address, "disconnected")
             network_manager_model.delete_connection(address)
+            self.status_broadcaster.remove_client(address)
+            self.reliable_channel.remove_peer(address)
+            self.rtt_prober.remove_peer(address)
 
         logger.info("Received datagram {0} from address: {1}".format(str(message), str(address)))
 
+    def on_client_lost(self, address, reason):
+        """
+        Removes a client that did not send any heartbeat for too long
+        :param address: the address of the client
+        :param reason: the reason recorded in the history
+        :return:
+        """
+        logger.warn("Evicting client {0}: {1}".format(address, reason))
+        network_manager_model.set_connected_status(address, "disconnected", reason)
+        network_manager_model.delete_connection(address)
+        self.status_broadcaster.remove_client(address)
+        self.reliable_channel.remove_peer(address)
+        self.rtt_prober.remove_peer(address)
+
     def print_message(self, message, address):
         """
         A dummy function to just print a message from a certain address.
@@ -200,15 +226,19 @@ class MonitoringServer(UdpServer):
         """
         A function to disconnect client. Client will be removed from connection list
         :param address: client address which shall be disconnected
-        :return:
+        :return: a Deferred fired with True, if the client acknowledged the disconnect, False otherwise
         """
         protocol = Protocol(MessageType.UNREGISTER, "Disconnecting")
         logger.info("sending protocol {0}".format(str(protocol)))
-        yield threads.deferToThread(self.send_message_acknowledged, protocol, address=address)
-        network_manager_model.set_connected_status(address, "disconnected")
+        acknowledged = yield self.reliable_channel.send(protocol, address)
+        network_manager_model.set_connected_status(address, "disconnected",
+                                                   None if acknowledged else "disconnect not acknowledged")
         network_manager_model.add_to_message_list("Disconnecting", address, "send")
         network_manager_model.delete_connection(address)
-        defer.returnValue(True)
+        self.status_broadcaster.remove_client(address)
+        self.reliable_channel.remove_peer(address)
+        self.rtt_prober.remove_peer(address)
+        defer.returnValue(acknowledged)
 
     @defer.inlineCallbacks
     def disable(self, address):
@@ -220,34 +250,84 @@ class MonitoringServer(UdpServer):
         if network_manager_model.get_connected_status(address) == "disabled":
             protocol = Protocol(MessageType.DISABLE, "Enabling")
             # logger.info("sending protocol {0}".format(str(protocol)))
-            yield threads.deferToThread(self.send_message_acknowledged, protocol, address=address)
+            yield self.reliable_channel.send(protocol, address)
             network_manager_model.set_connected_status(address, "connected")
             network_manager_model.add_to_message_list("Enabling", address, "send")
         else:
             protocol = Protocol(MessageType.DISABLE, "Disabling")
-            yield threads.deferToThread(self.send_message_acknowledged, protocol, address=address)
+            yield self.reliable_channel.send(protocol, address)
             network_manager_model.set_connected_status(address, "disabled")
             network_manager_model.add_to_message_list("Disabling", address, "send")
 
     def shutdown(self):
         """
-        A function to log off from clients when shutting down Rafcon
+        A function to log off from clients when shutting down Rafcon. Can be called from any thread. Called from
+        another thread, it blocks until all clients acknowledged or DISCONNECT_DEADLINE passed. Called from the reactor
+        thread, the UNREGISTER messages are sent right away and the reactor waits for their acknowledgements before it
+        shuts down.
         :return:
         """
-        for address in network_manager_model.connected_ip_port:
-            protocol = Protocol(MessageType.UNREGISTER, "Disconnecting")
-            self.send_message_non_acknowledged(protocol, address)
-            network_manager_model.add_to_message_list("Shutdown", address, "send")
+        from twisted.internet import reactor, threads
+        from twisted.python import threadable
+        if threadable.isInIOThread() or not reactor.running:
+            self.unregister_clients()
+        else:
+            threads.blockingCallFromThread(reactor, self.unregister_clients)
+
+    def unregister_clients(self):
+        """
+        Sends UNREGISTER to all connected clients, acknowledged to the clients supporting the reliable channel. Only the
+        first call sends, it is triggered before the reactor shuts down at the latest. Has to be called from within the
+        reactor thread.
+        :return: a Deferred fired as soon as all clients acknowledged or DISCONNECT_DEADLINE passed
+        """
+        if self._unregistering is None:
+            self.status_broadcaster.stop()
+            self.rtt_prober.stop()
+            unregistered = {}
+            if self.initialized:
+                for address in network_manager_model.connected_ip_port:
+                    protocol = Protocol(MessageType.UNREGISTER, "Disconnecting")
+                    if self.reliable_channel.has_peer(address):
+                        unregistered[address] = self.reliable_channel.send(protocol, address)
+                    else:
+                        self.send_message_non_acknowledged(protocol, address)
+                    network_manager_model.add_to_message_list("Shutdown", address, "send")
+            deadline = float(global_network_config.get_config_value("DISCONNECT_DEADLINE",
+                                                                    constants.DISCONNECT_DEADLINE))
+            self._unregistering = gather_with_deadline(unregistered, deadline)
+            self._unregistering.addCallback(self._on_clients_unregistered)
+        # every caller gets its own Deferred, as the callbacks of one caller must not change the result of the others
+        return defer.DeferredList([self._unregistering])
+
+    @staticmethod
+    def _on_clients_unregistered(results):
+        unresponsive = [address for address, acknowledged in results.iteritems() if not acknowledged]
+        if unresponsive:
+            logger.warn("Clients not acknowledging the shutdown: {0}".format(", ".join(map(str, unresponsive))))
+        return results
 
     @defer.inlineCallbacks
     def cut_connection(self, addresses):
         """
-        Called when reinitializing the connection. Cuts all communications.
+        Called when reinitializing the connection. Cuts all communications. The clients are disconnected
+        concurrently, clients that did not acknowledge the disconnect within DISCONNECT_DEADLINE seconds are reported
+        and not waited for any longer.
+        :param addresses: the addresses of the clients
         :return:
         """
         if self.initialized is True:
-            for address in addresses:
-                yield defer.maybeDeferred(self.disconnect, address)
+            self.status_broadcaster.stop()
+            self.rtt_prober.stop()
+            deadline = float(global_network_config.get_config_value("DISCONNECT_DEADLINE",
+                                                                    constants.DISCONNECT_DEADLINE))
+            results = yield gather_with_deadline(dict((address, self.disconnect(address)) for address in addresses),
+                                                 deadline)
+            unresponsive = [address for address in addresses if not results[address]]
+            if unresponsive:
+                logger.warn("Clients not acknowledging the disconnect: {0}".format(", ".join(map(str, unresponsive))))
+            # fires the disconnects still waiting for their acknowledgements
+            self.reliable_channel.stop()
             yield defer.maybeDeferred(self.connector.stopListening)
             self.initialized = False
         defer.returnValue(True)
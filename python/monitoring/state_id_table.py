@@ -0,0 +1,116 @@
+"""
+.. module:: state id table
+   :platform: Unix, Windows
+   :synopsis: a module assigning dense integer ids to the states of a state machine
+
+"""
+import zlib
+
+from rafcon.core.states.container_state import ContainerState
+from rafcon.core.states.library_state import LibraryState
+
+PATH_SEPARATOR = "/"
+
+
+class StateIdTable(object):
+    """
+    This class assigns a dense integer id to every state of a state machine, including the states of libraries.
+    The version is a hash over all state paths and thus changes with every structural change of the state machine.
+
+    The ids are assigned in depth-first pre-order, thus the states of every subtree have consecutive ids. This makes
+    the table an index for subscriptions to subtrees.
+    """
+
+    def __init__(self, state_machine):
+        self.state_machine_id = state_machine.state_machine_id
+        self.paths = []
+        self.states = []
+        self.depths = []
+        self._ids_by_state = {}
+        self._ids_by_path = {}
+        self._masks = {}
+
+        root_state = state_machine.root_state
+        stack = [(root_state, root_state.state_id, 0)]
+        while stack:
+            state, path, depth = stack.pop()
+            self._ids_by_state[id(state)] = len(self.paths)
+            self._ids_by_path[path] = len(self.paths)
+            self.states.append(state)
+            self.paths.append(path)
+            self.depths.append(depth)
+            if isinstance(state, LibraryState):
+                stack.append((state.state_copy, path + PATH_SEPARATOR + state.state_copy.state_id, depth + 1))
+            elif isinstance(state, ContainerState):
+                for state_id in sorted(state.states.iterkeys(), reverse=True):
+                    stack.append((state.states[state_id], path + PATH_SEPARATOR + state_id, depth + 1))
+        self.version = zlib.crc32("\n".join(self.paths)) & 0xffffffff
+
+        # the id following the last id of the subtree of every state and the id of the parent of every state
+        self.subtree_ends = [len(self.paths)] * len(self.paths)
+        self.parents = [None] * len(self.paths)
+        open_subtrees = []
+        for state_id, depth in enumerate(self.depths):
+            while open_subtrees and self.depths[open_subtrees[-1]] >= depth:
+                self.subtree_ends[open_subtrees.pop()] = state_id
+            if open_subtrees:
+                self.parents[state_id] = open_subtrees[-1]
+            open_subtrees.append(state_id)
+
+    def get_id(self, state):
+        """
+        Returns the id of a state
+        :param state: the state
+        :return: the id of the state or None, if the state was not part of the state machine when creating the table
+        """
+        return self._ids_by_state.get(id(state))
+
+    def get_mask(self, subscription):
+        """
+        Returns which states of the state machine are part of a subscription. The mask is created once per
+        subscription.
+        :param subscription: the Subscription
+        :return: a bytearray with a non-zero entry for the id of every subscribed state
+        """
+        mask = self._masks.get(subscription)
+        if mask is None:
+            mask = bytearray(len(self.paths))
+            if subscription.state_machine_id in (None, self.state_machine_id):
+                root_ids = [self._ids_by_path[prefix] for prefix in subscription.path_prefixes
+                            if prefix in self._ids_by_path] if subscription.path_prefixes else [0]
+                for root_id in root_ids:
+                    max_depth = self.depths[root_id] + subscription.max_depth \
+                        if subscription.max_depth is not None else len(self.paths)
+                    for state_id in xrange(root_id, self.subtree_ends[root_id]):
+                        if self.depths[state_id] <= max_depth:
+                            mask[state_id] = 1
+            self._masks[subscription] = mask
+        return mask
+
+
+class RemoteStateIdTable(object):
+    """
+    This class is the client side counterpart of the StateIdTable. It is filled chunk by chunk as the table arrives.
+    """
+
+    def __init__(self, state_machine_id, version, number_of_states):
+        self.state_machine_id = state_machine_id
+        self.version = version
+        self.paths = [None] * number_of_states
+        self._missing = number_of_states
+
+    def add_chunk(self, first_id, paths):
+        """
+        Adds a part of the table
+        :param first_id: the id of the first path
+        :param paths: the consecutive paths starting at first_id
+        :return:
+        """
+        for state_id, path in enumerate(paths, first_id):
+            if self.paths[state_id] is None:
+                self._missing -= 1
+            self.paths[state_id] = path
+
+    @property
+    def complete(self):
+        return self._missing == 0
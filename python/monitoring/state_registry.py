@@ -0,0 +1,224 @@
+"""
+.. module:: state registry
+   :platform: Unix, Windows
+   :synopsis: a module observing the execution status of the states of all state machines, registering at the states
+              lazily while they are executed
+
+"""
+import threading
+from collections import deque
+
+from rafcon.core.singleton import state_machine_manager
+from rafcon.core.states.container_state import ContainerState
+from rafcon.core.states.library_state import LibraryState
+from rafcon.core.states.state import StateExecutionStatus
+
+from rafcon.utils import log
+logger = log.get_logger(__name__)
+
+
+class StateObserverRegistry(object):
+    """
+    This class hands every execution status change of the states of all state machines to a single function.
+
+    Instead of walking the whole state tree on startup, only the root states are observed. The children of a container
+    state or the state copy of a library state are observed as soon as the state becomes active, as a state is never
+    executed before its parent. The state execution threads only enqueue the activated states, they are expanded by
+    expand_pending in the reactor. Expanded containers are observed for added and removed child states, thus the
+    registration follows structural changes and the observers of removed states and state machines are removed again.
+    The cost of the registration is thus proportional to the executed and changed states, not to the size of the
+    state machines.
+    """
+
+    def __init__(self, on_status_changed):
+        """
+        :param on_status_changed: a function called with the state and the value of its new execution status. It is
+            called from the state execution threads and, for the states already active when they are observed, from
+            the reactor thread.
+        """
+        self.on_status_changed = on_status_changed
+        # the registered states and the ids of their state machines by the ids of the states
+        self._registered = {}
+        # the observed child states or state copies of the expanded states, by the ids of the expanded states
+        self._expanded = {}
+        # the states that became active before they were expanded, filled by the state execution threads
+        self._pending_expansions = deque()
+        self._lock = threading.RLock()
+
+    def start(self):
+        """
+        Starts observing all current and future state machines of the state machine manager
+        :return:
+        """
+        state_machine_manager.add_observer(self, "add_state_machine",
+                                           notify_after_function=self.on_add_state_machine_after)
+        state_machine_manager.add_observer(self, "remove_state_machine",
+                                           notify_after_function=self.on_remove_state_machine_after)
+        for state_machine in state_machine_manager.state_machines.values():
+            self.register_state_machine(state_machine)
+
+    def register_state_machine(self, state_machine):
+        """
+        Observes the root state of a state machine and the replacement of the root state
+        :param state_machine: the state machine
+        :return:
+        """
+        state_machine.add_observer(self, "root_state", notify_after_function=self.on_root_state_changed_after)
+        self._register(state_machine.root_state, state_machine.state_machine_id)
+
+    def unregister_state_machine(self, state_machine_id):
+        """
+        Removes the observers of all states of a state machine
+        :param state_machine_id: the id of the state machine
+        :return:
+        """
+        with self._lock:
+            states = [state for state, owner_id in self._registered.itervalues() if owner_id == state_machine_id]
+            for state in states:
+                self._unregister_state(state)
+
+    def on_add_state_machine_after(self, observable, return_value, args):
+        """
+        Observes the root state of a state machine added to the state machine manager
+        :param observable: the state machine manager
+        :param return_value:
+        :param args: the arguments of add_state_machine, the second one is the new state machine
+        :return:
+        """
+        self.register_state_machine(args[1])
+
+    def on_remove_state_machine_after(self, observable, return_value, args):
+        """
+        Removes the observers of the states of a state machine removed from the state machine manager
+        :param observable: the state machine manager
+        :param return_value: the removed state machine
+        :param args:
+        :return:
+        """
+        if return_value is not None:
+            return_value.remove_observer(self, "root_state")
+            self.unregister_state_machine(return_value.state_machine_id)
+
+    def on_root_state_changed_after(self, observable, return_value, args):
+        """
+        Observes the new root state of a state machine
+        :param observable: the state machine
+        :param return_value:
+        :param args:
+        :return:
+        """
+        self.unregister_state_machine(observable.state_machine_id)
+        self._register(observable.root_state, observable.state_machine_id)
+
+    def on_state_execution_status_changed_after(self, observable, return_value, args):
+        """
+        Hands the new execution status of a state to on_status_changed and enqueues the state for its expansion, if it
+        became active. Called from the state execution threads, thus it must not take the lock.
+        :param observable: the state whose execution status changed
+        :param return_value:
+        :param args:
+        :return:
+        """
+        status = observable.state_execution_status
+        if status is not StateExecutionStatus.INACTIVE and id(observable) not in self._expanded:
+            self._pending_expansions.append(observable)
+        self.on_status_changed(observable, status.value)
+
+    def expand_pending(self):
+        """
+        Expands the states that became active since the last call. The newly observed states that are already active
+        are handed to on_status_changed with their current status, as their first change was missed. Has to be called
+        from within the reactor thread.
+        :return:
+        """
+        pending_expansions = self._pending_expansions
+        while pending_expansions:
+            self._expand(pending_expansions.popleft(), report_active=True)
+
+    def on_child_states_changed_after(self, observable, return_value, args):
+        """
+        Registers added child states and unregisters removed ones of an expanded container state
+        :param observable: the container state
+        :param return_value:
+        :param args:
+        :return:
+        """
+        with self._lock:
+            children = self._expanded.get(id(observable))
+            entry = self._registered.get(id(observable))
+            if children is None or entry is None:
+                return
+            current_children = dict((id(state), state) for state in observable.states.itervalues())
+            for state_id in [state_id for state_id in children if state_id not in current_children]:
+                self._unregister(children.pop(state_id))
+            for state_id, state in current_children.iteritems():
+                if state_id not in children:
+                    children[state_id] = state
+                    self._register(state, entry[1])
+
+    def _register(self, state, state_machine_id, report_active=False):
+        """
+        Observes the execution status of a state and expands it right away, if it is already active
+        :param state: the state
+        :param state_machine_id: the id of the state machine of the state
+        :param report_active: whether to hand the status of the state to on_status_changed, if it is already active
+        :return:
+        """
+        with self._lock:
+            if id(state) in self._registered:
+                return
+            self._registered[id(state)] = (state, state_machine_id)
+            state.add_observer(self, "state_execution_status",
+                               notify_after_function=self.on_state_execution_status_changed_after)
+            status = state.state_execution_status
+            if status is not StateExecutionStatus.INACTIVE:
+                if report_active:
+                    self.on_status_changed(state, status.value)
+                self._expand(state, report_active)
+
+    def _expand(self, state, report_active=False):
+        """
+        Observes the child states of a container state or the state copy of a library state
+        :param state: the state
+        :param report_active: whether to hand the status of the child states to on_status_changed, if they are already
+            active
+        :return:
+        """
+        with self._lock:
+            entry = self._registered.get(id(state))
+            if entry is None or id(state) in self._expanded:
+                return
+            if isinstance(state, LibraryState):
+                children = {id(state.state_copy): state.state_copy}
+            elif isinstance(state, ContainerState):
+                children = dict((id(child_state), child_state) for child_state in state.states.itervalues())
+                state.add_observer(self, "add_state", notify_after_function=self.on_child_states_changed_after)
+                state.add_observer(self, "remove_state", notify_after_function=self.on_child_states_changed_after)
+            else:
+                children = {}
+            self._expanded[id(state)] = children
+            for child_state in children.values():
+                self._register(child_state, entry[1], report_active)
+
+    def _unregister(self, state):
+        """
+        Removes the observers of a state and of all registered states of its subtree
+        :param state: the state
+        :return:
+        """
+        for child_state in self._expanded.get(id(state), {}).values():
+            self._unregister(child_state)
+        self._unregister_state(state)
+
+    def _unregister_state(self, state):
+        """
+        Removes the observers of a single state
+        :param state: the state
+        :return:
+        """
+        if self._registered.pop(id(state), None) is None:
+            return
+        state.remove_observer(self, "state_execution_status")
+        if self._expanded.pop(id(state), None) is not None and isinstance(state, ContainerState):
+            state.remove_observer(self, "add_state")
+            state.remove_observer(self, "remove_state")
@@ -0,0 +1,589 @@
+"""
+.. module:: status broadcaster
+   :platform: Unix, Windows
+   :synopsis: a module collecting state execution status changes and sending them to the clients once per tick
+
+"""
+import socket
+import time
+from collections import OrderedDict, deque
+
+from acknowledged_udp.config import global_network_config
+from acknowledged_udp.protocol import Protocol, MessageType
+
+from rafcon.core.singleton import state_machine_manager
+from rafcon.core.states.state import StateExecutionStatus
+
+from monitoring import constants
+from monitoring.loop_folder import LoopFolder
+from monitoring.model.network_model import network_manager_model
+from monitoring.overhead_governor import OverheadGovernor, get_cpu_time
+from monitoring.send_queue import SendQueue, QueuedBatch
+from monitoring.state_id_table import StateIdTable
+from monitoring.subscription import ALL_STATES
+from monitoring.status_codec import encode_status_batches, encode_status_records, pack_state_id_records, \
+    encode_state_id_batch, encode_state_id_table, encode_mode_change, encode_loop_summary, get_status_format, \
+    BinaryStatusEncoder, CAPABILITY_BATCHING, CAPABILITY_LOOP_FOLDING, FORMAT_BINARY, FORMAT_PATHS, FORMAT_STATE_IDS, \
+    KIND_DELTA, KIND_SNAPSHOT_BEGIN, KIND_SNAPSHOT, BINARY_HEADER, MODE_DEPTH, MODE_NAMES
+
+from rafcon.utils import log
+logger = log.get_logger(__name__)
+
+
+class StatusBroadcaster(object):
+    """
+    This class collects the execution status changes of states and sends them to all connected clients once per tick.
+    The state execution threads only hand the changes over, everything else is done in the reactor thread.
+    Several changes of the same state within one tick are collapsed, only the latest status is sent. All records
+    of one tick are packed into as few datagrams as possible. Legacy clients, which announced no batching capability,
+    receive a single state path per message.
+
+    Clients that announced the state id capability receive (id, status) records instead of state paths. The tables
+    mapping the ids to the state paths are sent on registration and whenever the structure of a state machine changed.
+    Clients that additionally support the binary format receive the records as binary datagrams.
+
+    Every state id batch sent to a client carries a sequence number. A client receives a snapshot of all states that
+    are not inactive when it registers and whenever it detects a gap in the sequence numbers and requests a resync.
+
+    Every client only receives the status records of the states it subscribed to. The records are filtered once per
+    distinct subscription before they are encoded.
+
+    The encoded batches are pushed into a bounded send queue per client, which is drained by the reactor every tick.
+    A client whose socket buffer is full keeps its batches queued without delaying the other clients. If its queue
+    grows beyond STATUS_QUEUE_LENGTH datagrams, the queued records are merged keeping only the latest status of every
+    state.
+
+    The OverheadGovernor lowers the detail of the stream while the flushes take too long or the links to the clients
+    are overloaded. The clients are told every change of the monitoring mode and receive new snapshots when the
+    depth limit or the sampling of leaf states is lifted again.
+
+    Clients that support loop folding do not receive the status changes of rapidly repeating state cycles, the
+    LoopFolder replaces them by periodic summaries.
+    """
+
+    def __init__(self, endpoint, on_flush=None):
+        """
+        :param endpoint: the MonitoringServer
+        :param on_flush: an optional function called from within the reactor at the start of every flush, before the
+            handed over status changes are collected
+        """
+        self.endpoint = endpoint
+        self.on_flush = on_flush
+        # filled by the state execution threads, emptied by the reactor; append and popleft of a deque are atomic
+        self._handoff = deque(maxlen=int(global_network_config.get_config_value("STATUS_HANDOFF_LENGTH",
+                                                                                constants.STATUS_HANDOFF_LENGTH)))
+        self._handoff_overflowed = False
+        self._looping_call = None
+        self._formats = {}
+        self._sequence_numbers = {}
+        self._subscriptions = {}
+        self._queues = {}
+        self._queue_stats = {}
+        self._binary_encoder = None
+        self._tables = {}
+        self._table_entries = {}
+        self.governor = OverheadGovernor()
+        self.loop_folder = LoopFolder()
+        self._loop_folding = set()
+        # the clients that expect a single status record per message
+        self._unbatched = set()
+
+    def start(self):
+        """
+        Starts sending the collected status changes periodically. Has to be called from within the reactor thread.
+        :return:
+        """
+        from twisted.internet import task
+        if self._looping_call is None:
+            self._looping_call = task.LoopingCall(self.flush)
+            self._looping_call.start(self._get_batch_interval(), now=False)
+
+    def stop(self):
+        """
+        Stops the periodic sending. Status changes that are still pending are sent right away.
+        :return:
+        """
+        if self._looping_call is not None:
+            if self._looping_call.running:
+                self._looping_call.stop()
+            self._looping_call = None
+            self.flush()
+
+    def reconfigure(self):
+        """
+        Applies a changed STATUS_BATCH_INTERVAL from the next flush on and a changed STATUS_HANDOFF_LENGTH right away.
+        Has to be called from within the reactor thread.
+        :return:
+        """
+        if self._looping_call is not None:
+            self._looping_call.interval = self._get_batch_interval()
+        handoff_length = int(global_network_config.get_config_value("STATUS_HANDOFF_LENGTH",
+                                                                    constants.STATUS_HANDOFF_LENGTH))
+        if handoff_length != self._handoff.maxlen:
+            # the changes still in the replaced queue are dropped, the next flush sends snapshots instead
+            self._handoff = deque(maxlen=handoff_length)
+            self._handoff_overflowed = True
+
+    def add_client(self, address, capabilities, subscription=ALL_STATES):
+        """
+        Chooses the format of the status stream of a client and sends it the state id tables, if it supports them,
+        and the snapshots of all subscribed state machines
+        :param address: the address of the client
+        :param capabilities: the set of capabilities the server and the client agreed on
+        :param subscription: the Subscription of the client
+        :return:
+        """
+        self._formats[address] = get_status_format(capabilities)
+        if CAPABILITY_LOOP_FOLDING in capabilities and self._formats[address] is not FORMAT_PATHS:
+            self._loop_folding.add(address)
+        if CAPABILITY_BATCHING in capabilities or self._formats[address] is not FORMAT_PATHS:
+            self._unbatched.discard(address)
+        else:
+            self._unbatched.add(address)
+        self._sequence_numbers[address] = 0
+        self._subscriptions[address] = subscription
+        self._queues[address] = SendQueue()
+        self.send_mode([address])
+        for state_machine_id in state_machine_manager.state_machines.keys():
+            self.resync(state_machine_id, address)
+
+    def remove_client(self, address):
+        """
+        Forgets the format of the status stream of a client
+        :param address: the address of the client
+        :return:
+        """
+        self._formats.pop(address, None)
+        self._loop_folding.discard(address)
+        self._unbatched.discard(address)
+        self._sequence_numbers.pop(address, None)
+        self._subscriptions.pop(address, None)
+        self._queues.pop(address, None)
+        self._queue_stats.pop(address, None)
+
+    def get_subscription(self, address):
+        """
+        Returns the subscription of a client
+        :param address: the address of the client
+        :return: the Subscription, ALL_STATES for unknown clients
+        """
+        return self._subscriptions.get(address, ALL_STATES)
+
+    def resync(self, state_machine_id, address):
+        """
+        Sends the state id table, if the client supports state ids, and a snapshot of a state machine to a client
+        :param state_machine_id: the id of the state machine
+        :param address: the address of the client
+        :return:
+        """
+        subscription = self.get_subscription(address)
+        if state_machine_id not in state_machine_manager.state_machines or \
+                subscription.state_machine_id not in (None, state_machine_id):
+            return
+        status_format = self._formats.get(address, FORMAT_PATHS)
+        if status_format is not FORMAT_PATHS:
+            self.send_table(state_machine_id, [address])
+        table = self.get_table(state_machine_id)
+        mask = table.get_mask(subscription)
+        records = [(state_id, state.state_execution_status.value) for state_id, state in enumerate(table.states)
+                   if mask[state_id] and state.state_execution_status is not StateExecutionStatus.INACTIVE]
+        self._enqueue(status_format, table, records, [address], self._get_max_size(), snapshot=True,
+                      batching=address not in self._unbatched)
+
+    def send_mode(self, addresses):
+        """
+        Tells clients the current monitoring mode of the governor. Clients without state ids do not know the message
+        and are skipped.
+        :param addresses: the addresses of the clients
+        :return:
+        """
+        message = encode_mode_change(self.governor.mode)
+        for address in addresses:
+            if self._formats.get(address, FORMAT_PATHS) is FORMAT_PATHS:
+                continue
+            self._send_message(Protocol(MessageType.STATE_ID, message), address)
+            network_manager_model.add_to_message_list(message, address, "send")
+
+    def _send_message(self, protocol, address):
+        """
+        Sends a message that is not part of the send queue to a client. Errors are logged, thus a single client
+        cannot stop the status stream of the others.
+        :param protocol: the message
+        :param address: the address of the client
+        :return:
+        """
+        try:
+            self.endpoint.send_message_non_acknowledged(protocol, address)
+        except Exception:
+            logger.exception("Cannot send {0} to {1}".format(protocol.message_type, address))
+
+    def push(self, state, status_value):
+        """
+        Hands the new execution status of a state over to the reactor. Called from the state execution threads, thus
+        it must not block and does nothing but appending to a queue. If the reactor stalls and the queue is full, the
+        oldest change is dropped and the clients receive snapshots on the next flush.
+        :param state: the state whose execution status changed
+        :param status_value: the value of the new StateExecutionStatus
+        :return:
+        """
+        handoff = self._handoff
+        if len(handoff) == handoff.maxlen:
+            self._handoff_overflowed = True
+        handoff.append((state, status_value, time.time()))
+
+    def invalidate_table(self, state_machine_id):
+        """
+        Drops the state id table of a state machine. It is rebuilt and sent to the clients on the next status change.
+        :param state_machine_id: the id of the state machine
+        :return:
+        """
+        table = self._tables.pop(state_machine_id, None)
+        if table:
+            for state in table.states:
+                self._table_entries.pop(id(state), None)
+            self.loop_folder.forget_table(table)
+
+    def get_table(self, state_machine_id):
+        """
+        Returns the state id table of a state machine and creates it, if it does not exist yet
+        :param state_machine_id: the id of the state machine
+        :return: the StateIdTable
+        """
+        table = self._tables.get(state_machine_id)
+        if table is None:
+            self.invalidate_table(state_machine_id)
+            table = StateIdTable(state_machine_manager.state_machines[state_machine_id])
+            self._tables[state_machine_id] = table
+            for state in table.states:
+                self._table_entries[id(state)] = (table, table.get_id(state))
+        return table
+
+    def send_table(self, state_machine_id, addresses):
+        """
+        Sends the state id table of a state machine to clients
+        :param state_machine_id: the id of the state machine
+        :param addresses: the addresses of the clients
+        :return:
+        """
+        if state_machine_id not in state_machine_manager.state_machines:
+            return
+        for message in encode_state_id_table(self.get_table(state_machine_id), self._get_max_size()):
+            protocol = Protocol(MessageType.STATE_ID, message)
+            for address in addresses:
+                self._send_message(protocol, address)
+        for address in addresses:
+            network_manager_model.add_to_message_list("State id table of state machine {0}".format(state_machine_id),
+                                                      address, "send")
+
+    def _lookup(self, state):
+        """
+        Returns the table entry of a state. Rebuilds the table of the state machine of the state, if the state is
+        unknown, and sends the new table to all clients supporting state ids.
+        :param state: the state to look up
+        :return: the StateIdTable and the id of the state or None, if the state is not part of any state machine
+        """
+        entry = self._table_entries.get(id(state))
+        if entry is None:
+            state_machine = state.get_state_machine()
+            if state_machine is None:
+                return None
+            self.invalidate_table(state_machine.state_machine_id)
+            self.send_table(state_machine.state_machine_id,
+                            self._get_addresses(FORMAT_STATE_IDS) + self._get_addresses(FORMAT_BINARY))
+            entry = self._table_entries.get(id(state))
+        return entry
+
+    def _get_addresses(self, status_format):
+        """
+        Returns the addresses of all connected clients that are not stale and receive the status stream in the given
+        format
+        :param status_format: FORMAT_BINARY, FORMAT_STATE_IDS or FORMAT_PATHS
+        :return: a list of addresses
+        """
+        return [address for address in network_manager_model.active_ip_port
+                if self._formats.get(address, FORMAT_PATHS) is status_format]
+
+    def _get_client_groups(self, status_format):
+        """
+        Groups the addresses of all connected clients that are not stale and receive the status stream in the given
+        format by their subscriptions, whether they support loop folding and whether they support batching
+        :param status_format: FORMAT_BINARY, FORMAT_STATE_IDS or FORMAT_PATHS
+        :return: a dict mapping each (Subscription, loop_folding, batching) tuple to a list of addresses
+        """
+        client_groups = OrderedDict()
+        for address in self._get_addresses(status_format):
+            client_groups.setdefault((self.get_subscription(address), address in self._loop_folding,
+                                      address not in self._unbatched), []).append(address)
+        return client_groups
+
+    def _next_sequence_number(self, address):
+        """
+        Returns the sequence number of the next state id batch sent to a client. The number is only used up by
+        _use_sequence_number, after the batch was sent.
+        :param address: the address of the client
+        :return: the sequence number
+        """
+        return (self._sequence_numbers.get(address, 0) + 1) & 0xffffffff
+
+    def _use_sequence_number(self, address, sequence_number):
+        """
+        Marks a sequence number as used after the batch carrying it was sent
+        :param address: the address of the client
+        :param sequence_number: the sequence number of the sent batch
+        :return:
+        """
+        self._sequence_numbers[address] = sequence_number
+
+    def _get_batch_interval(self):
+        """
+        Returns the interval between two flushes
+        :return: STATUS_BATCH_INTERVAL of the network config, stretched by the governor while batching aggressively
+        """
+        interval = float(global_network_config.get_config_value("STATUS_BATCH_INTERVAL",
+                                                                constants.STATUS_BATCH_INTERVAL))
+        return self.governor.get_batch_interval(interval)
+
+    @staticmethod
+    def _get_max_size():
+        """
+        Returns the maximal size of a datagram of the status stream
+        :return: STATUS_BATCH_MAX_SIZE of the network config
+        """
+        return int(global_network_config.get_config_value("STATUS_BATCH_MAX_SIZE", constants.STATUS_BATCH_MAX_SIZE))
+
+    def _get_binary_encoder(self, max_size):
+        """
+        Returns the encoder for binary datagrams and replaces it, if the maximal datagram size changed
+        :param max_size: the maximal size of a datagram
+        :return: the BinaryStatusEncoder
+        """
+        if self._binary_encoder is None or self._binary_encoder.max_size != max_size:
+            self._binary_encoder = BinaryStatusEncoder(max_size)
+        return self._binary_encoder
+
+    def flush(self):
+        """
+        Queues all pending status changes for all connected clients and drains the send queues
+        :return:
+        """
+        start_time = get_cpu_time()
+        if self.on_flush is not None:
+            self.on_flush()
+        number_of_events = len(self._handoff)
+        pending = OrderedDict()
+        oldest_timestamp = None
+        handoff = self._handoff
+        loop_folder = self.loop_folder
+        while handoff:
+            state, status_value, timestamp = handoff.popleft()
+            if oldest_timestamp is None:
+                oldest_timestamp = timestamp
+            entry = self._lookup(state)
+            if entry is None:
+                continue
+            # the loop folder needs every single change, the clients only the latest one per tick
+            loop_folder.observe(entry[0], entry[1], status_value, timestamp)
+            # re-insert the state to keep the records ordered by their latest change
+            pending.pop(entry, None)
+            pending[entry] = status_value
+        if oldest_timestamp is not None and time.time() - oldest_timestamp > 1.:
+            logger.warn("Status changes waited {0:.2f} s for the reactor".format(time.time() - oldest_timestamp))
+        handoff_overflowed = self._handoff_overflowed
+        self._handoff_overflowed = False
+
+        records_by_table = OrderedDict()
+        for (table, state_id), status_value in pending.iteritems():
+            records_by_table.setdefault(table, []).append((state_id, status_value))
+        records_by_table = self.governor.filter(records_by_table)
+        summaries = loop_folder.summarize()
+        folded_records_by_table = loop_folder.fold(records_by_table)
+
+        max_size = self._get_max_size()
+        for status_format in (FORMAT_BINARY, FORMAT_STATE_IDS, FORMAT_PATHS):
+            for (subscription, loop_folding, batching), addresses in \
+                    self._get_client_groups(status_format).iteritems():
+                # a failing group must neither keep the other clients from their updates nor stop the looping call
+                try:
+                    if loop_folding:
+                        self._send_loop_summaries(summaries, subscription, addresses, max_size)
+                    for table, records in (folded_records_by_table if loop_folding else records_by_table).iteritems():
+                        if subscription != ALL_STATES:
+                            mask = table.get_mask(subscription)
+                            records = [record for record in records if mask[record[0]]]
+                        if records:
+                            self._enqueue(status_format, table, records, addresses, max_size, batching=batching)
+                except Exception:
+                    logger.exception("Cannot queue the status changes for {0}".format(addresses))
+        if handoff_overflowed:
+            logger.warn("Status changes were dropped while the reactor stalled, sending snapshots")
+            for address in list(self._formats):
+                for state_machine_id in state_machine_manager.state_machines.keys():
+                    self.resync(state_machine_id, address)
+        self._drain()
+
+        self.governor.record_flush(number_of_events, get_cpu_time() - start_time)
+        previous_mode = self.governor.mode
+        mode = self.governor.evaluate()
+        if mode is not None:
+            self._on_mode_changed(previous_mode, mode)
+
+    def _on_mode_changed(self, previous_mode, mode):
+        """
+        Adapts the flush interval to the new monitoring mode and tells all clients about it. The clients receive
+        snapshots of all state machines, if states that were left out are sent again.
+        :param previous_mode: the previous monitoring mode
+        :param mode: the new monitoring mode
+        :return:
+        """
+        logger.info("Status stream switched from {0} to {1}".format(MODE_NAMES[previous_mode], MODE_NAMES[mode]))
+        if self._looping_call is not None:
+            self._looping_call.interval = self._get_batch_interval()
+        addresses = list(self._formats)
+        self.send_mode(addresses)
+        if MODE_DEPTH <= previous_mode > mode:
+            for address in addresses:
+                for state_machine_id in state_machine_manager.state_machines.keys():
+                    self.resync(state_machine_id, address)
+
+    def _send_loop_summaries(self, summaries, subscription, addresses, max_size):
+        """
+        Sends the summaries of the folded loops to clients
+        :param summaries: the summaries returned by LoopFolder.summarize
+        :param subscription: the Subscription of the clients
+        :param addresses: the addresses of the clients
+        :param max_size: the maximal size of a datagram
+        :return:
+        """
+        for table, container_id, window, cycles, records in summaries:
+            if subscription != ALL_STATES:
+                mask = table.get_mask(subscription)
+                if not mask[container_id]:
+                    continue
+                records = [record for record in records if mask[record[0]]]
+                if cycles and not records:
+                    # an empty summary would end the loop on the clients
+                    continue
+            message = encode_loop_summary(table.state_machine_id, table.version, container_id, window, cycles,
+                                          records, max_size)
+            for address in addresses:
+                self._send_message(Protocol(MessageType.STATE_ID, message), address)
+                network_manager_model.add_to_message_list(message, address, "send")
+
+    def _encode(self, status_format, table, records, max_size, batching=True):
+        """
+        Encodes the status records of one state machine
+        :param status_format: the format of the status stream
+        :param table: the StateIdTable of the state machine
+        :param records: a list of (state_id, status_value) tuples
+        :param max_size: the maximal size of a datagram
+        :param batching: whether several records may be sent in one datagram
+        :return: a list of parts, each of which is sent as one datagram
+        """
+        if status_format is FORMAT_PATHS:
+            path_records = ((table.paths[state_id], status_value) for state_id, status_value in records)
+            if not batching:
+                return encode_status_records(path_records)
+            return encode_status_batches(path_records, max_size)
+        if status_format is FORMAT_BINARY:
+            return self._get_binary_encoder(max_size).encode(records)
+        return pack_state_id_records(records, max_size)
+
+    def _get_queue(self, address):
+        queue = self._queues.get(address)
+        if queue is None:
+            queue = self._queues[address] = SendQueue()
+        return queue
+
+    def _enqueue(self, status_format, table, records, addresses, max_size, snapshot=False, batching=True):
+        """
+        Encodes the status records of one state machine once and queues them for all given clients
+        :param status_format: the format of the status stream of the clients
+        :param table: the StateIdTable of the state machine
+        :param records: a list of (state_id, status_value) tuples
+        :param addresses: the addresses of the clients
+        :param max_size: the maximal size of a datagram
+        :param snapshot: whether the records are a snapshot or a delta
+        :param batching: whether the clients support several records per datagram
+        :return:
+        """
+        parts = self._encode(status_format, table, records, max_size, batching)
+        if status_format is FORMAT_BINARY:
+            number_of_bytes = sum(len(payload) + BINARY_HEADER.size for _, payload in parts)
+        else:
+            number_of_bytes = sum(len(part) for part in parts)
+        max_length = int(global_network_config.get_config_value("STATUS_QUEUE_LENGTH", constants.STATUS_QUEUE_LENGTH))
+        for address in addresses:
+            self.governor.record_bytes(address, number_of_bytes)
+            queue = self._get_queue(address)
+            queue.push(QueuedBatch(table, records, parts, snapshot))
+            if queue.length > max_length:
+                for merged_table, merged_records, merged_snapshot in queue.compact():
+                    queue.push(QueuedBatch(merged_table, merged_records,
+                                           self._encode(status_format, merged_table, merged_records, max_size,
+                                                        batching),
+                                           merged_snapshot))
+
+    def _drain(self):
+        """
+        Sends at most STATUS_QUEUE_DRAIN_BUDGET datagrams of the send queue of every client. A client whose datagrams
+        cannot be sent right now keeps them queued.
+        :return:
+        """
+        budget = int(global_network_config.get_config_value("STATUS_QUEUE_DRAIN_BUDGET",
+                                                            constants.STATUS_QUEUE_DRAIN_BUDGET))
+        for address, queue in self._queues.items():
+            status_format = self._formats.get(address, FORMAT_PATHS)
+            sent = 0
+            while queue.length and sent < budget:
+                batch, index = queue.next_part()
+                try:
+                    self._send_part(status_format, batch, index, address)
+                except socket.error as e:
+                    logger.debug("Cannot send to {0} right now: {1}".format(address, e))
+                    break
+                except Exception:
+                    # the part can never be sent, drop it instead of stopping the looping call
+                    logger.exception("Cannot send a status update to {0}".format(address))
+                    if status_format is not FORMAT_PATHS:
+                        # skip its sequence number, thus the client detects the gap and requests a resync
+                        self._use_sequence_number(address, self._next_sequence_number(address))
+                queue.advance()
+                sent += 1
+            stats = (queue.length, queue.dropped)
+            if self._queue_stats.get(address) != stats:
+                self._queue_stats[address] = stats
+                network_manager_model.set_connected_queue(address, *stats)
+
+    def _send_part(self, status_format, batch, index, address):
+        """
+        Sends a single part of a queued batch to a client
+        :param status_format: the format of the status stream of the client
+        :param batch: the QueuedBatch
+        :param index: the index of the part within the batch
+        :param address: the address of the client
+        :return:
+        """
+        part = batch.parts[index]
+        if status_format is FORMAT_PATHS:
+            # clients without state ids know neither sequence numbers nor snapshots and just apply the records
+            self.endpoint.send_message_non_acknowledged(Protocol(MessageType.STATE_ID, part), address)
+            network_manager_model.add_to_message_list(part, address, "send")
+            return
+
+        if batch.snapshot:
+            kind = KIND_SNAPSHOT_BEGIN if index == 0 else KIND_SNAPSHOT
+        else:
+            kind = KIND_DELTA
+        table = batch.table
+        # the number is used up only if the send succeeds, a part that is retried keeps its number
+        sequence_number = self._next_sequence_number(address)
+        if status_format is FORMAT_BINARY:
+            self.endpoint.transport.write(BinaryStatusEncoder.stamp(kind, table.state_machine_id, table.version,
+                                                                    sequence_number, part), address)
+            self._use_sequence_number(address, sequence_number)
+            network_manager_model.add_to_message_list("{0} binary status records".format(part[0]), address, "send")
+        else:
+            message = encode_state_id_batch(kind, table.state_machine_id, table.version, sequence_number, part)
+            self.endpoint.send_message_non_acknowledged(Protocol(MessageType.STATE_ID, message), address)
+            self._use_sequence_number(address, sequence_number)
+            network_manager_model.add_to_message_list(message, address, "send")
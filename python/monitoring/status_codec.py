@@ -0,0 +1,358 @@
+"""
+.. module:: status codec
+   :platform: Unix, Windows
+   :synopsis: a module encoding and decoding batches of state execution status records
+
+"""
+import struct
+
+from acknowledged_udp.protocol import STATE_EXECUTION_STATUS_SEPARATOR
+
+RECORD_SEPARATOR = ";"
+
+# message contents starting with this prefix carry monitoring control data instead of state paths
+CONTROL_PREFIX = "#"
+STATE_ID_TABLE = "#TABLE"
+STATE_ID_BATCH = "#IDS"
+RESYNC_REQUEST = "#RESYNC"
+MODE_CHANGE = "#MODE"
+LOOP_SUMMARY = "#LOOP"
+
+# kinds of state id batches: deltas since the last batch, and the first and further parts of a snapshot of all states
+# that are not inactive
+KIND_DELTA = 1
+KIND_SNAPSHOT_BEGIN = 2
+KIND_SNAPSHOT = 3
+
+# the maximal length of the header of a textual state id batch
+STATE_ID_BATCH_HEADER_SIZE = 64
+
+# binary datagrams are sent without the acknowledged_udp protocol and are recognized by this prefix
+BINARY_MAGIC = "\x00RM"
+BINARY_FORMAT_VERSION = 3
+# magic, format version, kind, state machine id, table version, sequence number, number of records
+BINARY_HEADER = struct.Struct("!3sBBIIIH")
+# state id, status value
+BINARY_RECORD = struct.Struct("!IB")
+
+# the monitoring modes of the server, each one dropping more detail of the status stream than the previous one
+MODE_FULL = 0
+MODE_BATCH = 1
+MODE_DEPTH = 2
+MODE_SAMPLE = 3
+MODE_NAMES = {MODE_FULL: "full detail",
+              MODE_BATCH: "aggressive batching",
+              MODE_DEPTH: "depth limited",
+              MODE_SAMPLE: "leaf states sampled"}
+
+# capabilities a client can announce in its REGISTER message
+CAPABILITY_BATCHING = "batch"
+CAPABILITY_STATE_IDS = "ids"
+CAPABILITY_BINARY = "bin{0}".format(BINARY_FORMAT_VERSION)
+CAPABILITY_LOOP_FOLDING = "loops"
+CAPABILITY_RELIABLE_CHANNEL = "rc"
+CAPABILITY_HEARTBEAT = "hb"
+SUPPORTED_CAPABILITIES = frozenset([CAPABILITY_BATCHING, CAPABILITY_STATE_IDS, CAPABILITY_BINARY,
+                                    CAPABILITY_LOOP_FOLDING, CAPABILITY_RELIABLE_CHANNEL, CAPABILITY_HEARTBEAT])
+
+# the formats of the status stream, depending on the capabilities of a client
+FORMAT_PATHS = "paths"
+FORMAT_STATE_IDS = "ids"
+FORMAT_BINARY = "binary"
+
+
+def get_status_format(capabilities):
+    """
+    Chooses the most compact format of the status stream both endpoints support
+    :param capabilities: the capabilities the server and the client agreed on
+    :return: FORMAT_BINARY, FORMAT_STATE_IDS or FORMAT_PATHS
+    """
+    if CAPABILITY_STATE_IDS not in capabilities:
+        return FORMAT_PATHS
+    if CAPABILITY_BINARY in capabilities:
+        return FORMAT_BINARY
+    return FORMAT_STATE_IDS
+
+
+def _pack_records(records, max_size, header=""):
+    """
+    Joins record strings to message contents of at most max_size characters, each starting with header
+    :param records: iterable of record strings
+    :param max_size: the maximal length of a single message content
+    :param header: a string every message content starts with
+    :return: a list of message contents
+    """
+    batches = []
+    current = []
+    current_size = len(header)
+    for record in records:
+        record_size = len(record) + len(RECORD_SEPARATOR) if current else len(record)
+        if current and current_size + record_size > max_size:
+            batches.append(header + RECORD_SEPARATOR.join(current))
+            current = []
+            current_size = len(header)
+            record_size = len(record)
+        current.append(record)
+        current_size += record_size
+    if current:
+        batches.append(header + RECORD_SEPARATOR.join(current))
+    return batches
+
+
+def _split_records(records):
+    """
+    Splits 'key@status;key@status' into (key, status_value) tuples
+    :param records: the joined records
+    :return: a list of (key, status_value) tuples
+    """
+    result = []
+    for record in records.split(RECORD_SEPARATOR):
+        key, status_value = record.split(STATE_EXECUTION_STATUS_SEPARATOR)
+        result.append((key, int(status_value)))
+    return result
+
+
+def encode_status_batches(records, max_size):
+    """
+    Packs (state_path, status_value) records into as few message contents as possible.
+    Each message content looks like 'path@status;path@status' and is at most max_size characters long, if not a
+    single record is longer than that already.
+    :param records: iterable of (state_path, status_value) tuples
+    :param max_size: the maximal length of a single message content
+    :return: a list of message contents
+    """
+    return _pack_records((state_path + STATE_EXECUTION_STATUS_SEPARATOR + str(status_value)
+                          for state_path, status_value in records), max_size)
+
+
+def encode_status_records(records):
+    """
+    Encodes every (state_path, status_value) record as a message content of its own, as clients without the batching
+    capability expect a single 'path@status' per message
+    :param records: iterable of (state_path, status_value) tuples
+    :return: a list of message contents
+    """
+    return [state_path + STATE_EXECUTION_STATUS_SEPARATOR + str(status_value) for state_path, status_value in records]
+
+
+def decode_status_batch(message_content):
+    """
+    Unpacks a message content created by encode_status_batches
+    :param message_content: 'path@status;path@status'
+    :return: a list of (state_path, status_value) tuples
+    """
+    return _split_records(message_content)
+
+
+def pack_state_id_records(records, max_size):
+    """
+    Packs (state_id, status_value) records of one state machine into as few parts as possible. Each part can be sent
+    as the records of a textual state id batch of at most max_size characters. There is always at least one part.
+    :param records: iterable of (state_id, status_value) tuples
+    :param max_size: the maximal length of a single message content
+    :return: a list of 'id@status;id@status' parts
+    """
+    return _pack_records(("{0}@{1}".format(state_id, status_value) for state_id, status_value in records),
+                         max_size - STATE_ID_BATCH_HEADER_SIZE) or [""]
+
+
+def encode_state_id_batch(kind, state_machine_id, table_version, sequence_number, records):
+    """
+    Creates the message content of a textual state id batch
+    :param kind: KIND_DELTA, KIND_SNAPSHOT_BEGIN or KIND_SNAPSHOT
+    :param state_machine_id: the id of the state machine the records belong to
+    :param table_version: the version of the state id table the ids refer to
+    :param sequence_number: the sequence number of the batch
+    :param records: a part created by pack_state_id_records
+    :return: '#IDS@kind@sm_id@version@sequence_number@id@status;id@status'
+    """
+    return "{0}@{1}@{2}@{3}@{4}@{5}".format(STATE_ID_BATCH, kind, state_machine_id, table_version, sequence_number,
+                                            records)
+
+
+def decode_state_id_batch(message_content):
+    """
+    Unpacks a message content created by encode_state_id_batch
+    :param message_content: '#IDS@kind@sm_id@version@sequence_number@id@status;id@status'
+    :return: the kind, the state machine id, the table version, the sequence number and a list of
+        (state_id, status_value) tuples
+    """
+    _, kind, state_machine_id, table_version, sequence_number, records = message_content.split("@", 5)
+    records = [(int(state_id), status_value) for state_id, status_value in _split_records(records)] if records else []
+    return int(kind), int(state_machine_id), int(table_version), int(sequence_number), records
+
+
+def encode_state_id_table(table, max_size):
+    """
+    Splits a state id table into message contents of at most max_size characters.
+    A message content looks like '#TABLE@sm_id@version@number_of_states@first_id@path;path'.
+    :param table: the StateIdTable to send
+    :param max_size: the maximal length of a single message content
+    :return: a list of message contents
+    """
+    # the paths are packed once, leaving room for the longest header, which is stamped on every part afterwards
+    max_header_size = len("{0}@{1}@{2}@{3}@{3}@".format(STATE_ID_TABLE, table.state_machine_id, table.version,
+                                                       len(table.paths)))
+    chunks = []
+    first_id = 0
+    for part in _pack_records(table.paths, max_size - max_header_size):
+        chunks.append("{0}@{1}@{2}@{3}@{4}@{5}".format(STATE_ID_TABLE, table.state_machine_id, table.version,
+                                                       len(table.paths), first_id, part))
+        first_id += part.count(RECORD_SEPARATOR) + 1
+    return chunks
+
+
+def decode_state_id_table(message_content):
+    """
+    Unpacks a message content created by encode_state_id_table
+    :param message_content: '#TABLE@sm_id@version@number_of_states@first_id@path;path'
+    :return: the state machine id, the table version, the number of states, the first id and the list of paths
+    """
+    _, state_machine_id, table_version, number_of_states, first_id, paths = message_content.split("@", 5)
+    return int(state_machine_id), int(table_version), int(number_of_states), int(first_id), \
+        paths.split(RECORD_SEPARATOR)
+
+
+def encode_resync_request(state_machine_id):
+    """
+    Creates the message content a client uses to request the state id table and a snapshot of a state machine
+    :param state_machine_id: the id of the state machine
+    :return: '#RESYNC@sm_id'
+    """
+    return "{0}@{1}".format(RESYNC_REQUEST, state_machine_id)
+
+
+def decode_resync_request(message_content):
+    """
+    Unpacks a message content created by encode_resync_request
+    :param message_content: '#RESYNC@sm_id'
+    :return: the state machine id
+    :raises ValueError: if the message content is malformed
+    """
+    fields = message_content.split("@")
+    if len(fields) < 2:
+        raise ValueError("Invalid resync request {0}".format(message_content))
+    return int(fields[1])
+
+
+def encode_mode_change(mode):
+    """
+    Creates the message content the server uses to tell the clients its current monitoring mode
+    :param mode: MODE_FULL, MODE_BATCH, MODE_DEPTH or MODE_SAMPLE
+    :return: '#MODE@mode'
+    """
+    return "{0}@{1}".format(MODE_CHANGE, mode)
+
+
+def decode_mode_change(message_content):
+    """
+    Unpacks a message content created by encode_mode_change
+    :param message_content: '#MODE@mode'
+    :return: the monitoring mode
+    """
+    return int(message_content.split("@")[1])
+
+
+def encode_loop_summary(state_machine_id, table_version, container_id, window, cycles, records, max_size):
+    """
+    Creates the message content summarizing a folded loop over one window. A summary without records ends the loop.
+    The records of the states that do not fit into max_size characters are left out.
+    :param state_machine_id: the id of the state machine
+    :param table_version: the version of the state id table the ids refer to
+    :param container_id: the id of the container state running the loop
+    :param window: the length of the summarized window in seconds
+    :param cycles: the number of loop cycles within the window
+    :param records: a list of (state_id, activations, mean_duration, max_duration) tuples with durations in seconds
+    :param max_size: the maximal length of the message content
+    :return: '#LOOP@sm_id@version@container_id@window@cycles@id:activations:mean:max;...'
+    """
+    header = "{0}@{1}@{2}@{3}@{4:.3f}@{5}@".format(LOOP_SUMMARY, state_machine_id, table_version, container_id,
+                                                    window, cycles)
+    length = len(header)
+    fields = []
+    for record in records:
+        field = "{0}:{1}:{2:.6f}:{3:.6f}".format(*record)
+        length += len(field) + len(RECORD_SEPARATOR)
+        if length > max_size and fields:
+            break
+        fields.append(field)
+    return header + RECORD_SEPARATOR.join(fields)
+
+
+def decode_loop_summary(message_content):
+    """
+    Unpacks a message content created by encode_loop_summary
+    :param message_content: '#LOOP@sm_id@version@container_id@window@cycles@id:activations:mean:max;...'
+    :return: state machine id, table version, container id, window, cycles and a list of
+        (state_id, activations, mean_duration, max_duration) tuples, which is empty if the loop ended
+    """
+    _, state_machine_id, table_version, container_id, window, cycles, fields = message_content.split("@", 6)
+    records = []
+    for field in fields.split(RECORD_SEPARATOR) if fields else ():
+        state_id, activations, mean_duration, max_duration = field.split(":")
+        records.append((int(state_id), int(activations), float(mean_duration), float(max_duration)))
+    return int(state_machine_id), int(table_version), int(container_id), float(window), int(cycles), records
+
+
+class BinaryStatusEncoder(object):
+    """
+    This class packs (state_id, status_value) records into the payloads of binary datagrams. The records are packed
+    in a preallocated buffer once and only the header is stamped for every receiver.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._buffer = bytearray(max_size)
+        self._view = memoryview(self._buffer)
+        self._max_records = max(1, (max_size - BINARY_HEADER.size) // BINARY_RECORD.size)
+
+    def encode(self, records):
+        """
+        Packs the records into as few payloads as possible. There is always at least one payload.
+        :param records: iterable of (state_id, status_value) tuples
+        :return: a list of (number_of_records, payload) tuples
+        """
+        parts = []
+        offset = 0
+        count = 0
+        for state_id, status_value in records:
+            if count == self._max_records:
+                parts.append((count, self._view[:offset].tobytes()))
+                offset = 0
+                count = 0
+            BINARY_RECORD.pack_into(self._buffer, offset, state_id, status_value)
+            offset += BINARY_RECORD.size
+            count += 1
+        parts.append((count, self._view[:offset].tobytes()))
+        return parts
+
+    @staticmethod
+    def stamp(kind, state_machine_id, table_version, sequence_number, part):
+        """
+        Creates a datagram from a payload created by encode
+        :param kind: KIND_DELTA, KIND_SNAPSHOT_BEGIN or KIND_SNAPSHOT
+        :param state_machine_id: the id of the state machine the records belong to
+        :param table_version: the version of the state id table the ids refer to
+        :param sequence_number: the sequence number of the datagram
+        :param part: a (number_of_records, payload) tuple
+        :return: the datagram
+        """
+        count, payload = part
+        return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_FORMAT_VERSION, kind, state_machine_id, table_version,
+                                  sequence_number, count) + payload
+
+
+def decode_binary_state_id_batch(datagram):
+    """
+    Unpacks a datagram created by the BinaryStatusEncoder without copying it
+    :param datagram: the received datagram
+    :return: the kind, the state machine id, the table version, the sequence number and a list of
+        (state_id, status_value) tuples
+    """
+    _, format_version, kind, state_machine_id, table_version, sequence_number, count = \
+        BINARY_HEADER.unpack_from(datagram)
+    if format_version != BINARY_FORMAT_VERSION:
+        raise ValueError("Unsupported binary datagram format version {0}".format(format_version))
+    offsets = xrange(BINARY_HEADER.size, BINARY_HEADER.size + count * BINARY_RECORD.size, BINARY_RECORD.size)
+    return kind, state_machine_id, table_version, sequence_number, \
+        [BINARY_RECORD.unpack_from(datagram, offset) for offset in offsets]
@@ -0,0 +1,64 @@
+"""
+.. module:: subscription
+   :platform: Unix, Windows
+   :synopsis: a module describing which part of the executed state machines a client wants to monitor
+
+"""
+from collections import namedtuple
+
+# the separators must not collide with the '@' separating the fields of the REGISTER message and the '/' of state paths
+FIELD_SEPARATOR = "|"
+PREFIX_SEPARATOR = ";"
+
+# state_machine_id: the id of the monitored state machine or None for all state machines
+# path_prefixes: the paths of the monitored subtrees or an empty tuple for the whole state machine
+# max_depth: the maximal depth of monitored states below the subtree roots or None for unlimited depth
+Subscription = namedtuple("Subscription", ["state_machine_id", "path_prefixes", "max_depth"])
+
+ALL_STATES = Subscription(None, (), None)
+
+
+def get_configured_subscription(config):
+    """
+    Reads the subscription of a client from the network config
+    :param config: the network config
+    :return: the Subscription described by SUBSCRIBED_STATE_MACHINE_ID, SUBSCRIBED_PATH_PREFIXES and
+        SUBSCRIBED_MAX_DEPTH
+    """
+    state_machine_id = config.get_config_value("SUBSCRIBED_STATE_MACHINE_ID")
+    path_prefixes = config.get_config_value("SUBSCRIBED_PATH_PREFIXES") or ()
+    if isinstance(path_prefixes, basestring):
+        path_prefixes = path_prefixes.split(",")
+    max_depth = config.get_config_value("SUBSCRIBED_MAX_DEPTH")
+    return Subscription(int(state_machine_id) if state_machine_id is not None else None,
+                        tuple(prefix.strip() for prefix in path_prefixes if prefix.strip()),
+                        int(max_depth) if max_depth is not None else None)
+
+
+def encode_subscription(subscription):
+    """
+    Creates the subscription field of the REGISTER message
+    :param subscription: the Subscription
+    :return: 'sm_id|max_depth|prefix;prefix' where empty fields stand for no restriction
+    """
+    return FIELD_SEPARATOR.join(["" if subscription.state_machine_id is None else str(subscription.state_machine_id),
+                                 "" if subscription.max_depth is None else str(subscription.max_depth),
+                                 PREFIX_SEPARATOR.join(subscription.path_prefixes)])
+
+
+def decode_subscription(field):
+    """
+    Unpacks a subscription field created by encode_subscription
+    :param field: 'sm_id|max_depth|prefix;prefix' or None
+    :return: the Subscription, ALL_STATES if the field is missing
+    :raises ValueError: if the field is malformed
+    """
+    if not field:
+        return ALL_STATES
+    fields = field.split(FIELD_SEPARATOR, 2)
+    if len(fields) != 3:
+        raise ValueError("Invalid subscription {0}".format(field))
+    state_machine_id, max_depth, path_prefixes = fields
+    return Subscription(int(state_machine_id) if state_machine_id else None,
+                        tuple(path_prefixes.split(PREFIX_SEPARATOR)) if path_prefixes else (),
+                        int(max_depth) if max_depth else None)
@@ -0,0 +1,61 @@
+"""
+Benchmarks the startup time and memory of a headless monitoring server and checks that it never imports the GUI
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("twisted")
+pytest.importorskip("acknowledged_udp")
+pytest.importorskip("rafcon")
+
+# the time in seconds the headless server path may need to import and to create its models
+STARTUP_BUDGET = 2.
+# the memory in kilobytes the headless server path may add to the resident set size of the process
+RSS_BUDGET = 64 * 1024
+GUI_MODULES = ("gi", "gtkmvc3", "rafcon.gui")
+
+# runs in a fresh interpreter, as the modules imported by the test session would hide the cost of the imports
+BENCHMARK = """
+import json
+import resource
+import sys
+import time
+sys.path.insert(0, {python_path!r})
+import rafcon.core.singleton
+start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start_time = time.time()
+from monitoring.model.network_model import network_manager_model
+from monitoring.server import MonitoringServer
+from monitoring.state_registry import StateObserverRegistry
+StateObserverRegistry(lambda state, value: None)
+print(json.dumps({{
+    "duration": time.time() - start_time,
+    "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss,
+    "modules": sorted(sys.modules),
+}}))
+"""
+
+
+@pytest.fixture(scope="module")
+def benchmark():
+    python_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python")
+    output = subprocess.check_output([sys.executable, "-c", BENCHMARK.format(python_path=python_path)])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_headless_server_does_not_import_the_gui(benchmark):
+    gui_modules = [module for module in benchmark["modules"]
+                   if any(module == name or module.startswith(name + ".") for name in GUI_MODULES)]
+    assert not gui_modules
+
+
+def test_headless_server_startup_time(benchmark):
+    assert benchmark["duration"] < STARTUP_BUDGET
+
+
+def test_headless_server_rss(benchmark):
+    assert benchmark["rss"] < RSS_BUDGET
@@ -0,0 +1,83 @@
+"""
+Checks that the state execution threads only enqueue the states the registry has to expand
+"""
+import pytest
+
+pytest.importorskip("rafcon")
+
+from rafcon.core.states.state import StateExecutionStatus
+
+from monitoring import state_registry
+
+
+class StubState(object):
+
+    def __init__(self):
+        self.state_execution_status = StateExecutionStatus.INACTIVE
+        self.observers = {}
+
+    def add_observer(self, observer, property_name, notify_after_function):
+        self.observers[property_name] = notify_after_function
+
+    def remove_observer(self, observer, property_name):
+        self.observers.pop(property_name, None)
+
+    def set_status(self, status):
+        self.state_execution_status = status
+        if "state_execution_status" in self.observers:
+            self.observers["state_execution_status"](self, None, ())
+
+
+class StubContainerState(StubState):
+
+    def __init__(self, child_states):
+        StubState.__init__(self)
+        self.states = dict(enumerate(child_states))
+
+
+class StubStateMachine(object):
+    state_machine_id = 1
+
+    def __init__(self, root_state):
+        self.root_state = root_state
+
+    def add_observer(self, observer, property_name, notify_after_function):
+        pass
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(state_registry, "ContainerState", StubContainerState)
+    changes = []
+    registry = state_registry.StateObserverRegistry(lambda state, status_value: changes.append((state, status_value)))
+    registry.changes = changes
+    return registry
+
+
+def test_activation_is_expanded_in_the_reactor(registry):
+    child = StubState()
+    root = StubContainerState([child])
+    registry.register_state_machine(StubStateMachine(root))
+
+    root.set_status(StateExecutionStatus.ACTIVE)
+    # the execution thread neither observes the children nor reports anything but the change itself
+    assert "state_execution_status" not in child.observers
+    assert registry.changes == [(root, StateExecutionStatus.ACTIVE.value)]
+
+    registry.expand_pending()
+    assert "state_execution_status" in child.observers
+    assert registry.changes == [(root, StateExecutionStatus.ACTIVE.value)]
+
+
+def test_children_activated_before_the_expansion_are_reported(registry):
+    child = StubState()
+    root = StubContainerState([child])
+    registry.register_state_machine(StubStateMachine(root))
+
+    root.set_status(StateExecutionStatus.ACTIVE)
+    child.set_status(StateExecutionStatus.ACTIVE)
+    registry.expand_pending()
+    assert registry.changes == [(root, StateExecutionStatus.ACTIVE.value), (child, StateExecutionStatus.ACTIVE.value)]
+
+    child.set_status(StateExecutionStatus.INACTIVE)
+    assert registry.changes[-1] == (child, StateExecutionStatus.INACTIVE.value)
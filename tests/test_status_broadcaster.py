@@ -0,0 +1,241 @@
+"""
+Checks the overhead the status broadcaster adds per state execution status change
+"""
+import time
+from collections import deque
+
+import pytest
+
+pytest.importorskip("twisted")
+pytest.importorskip("acknowledged_udp")
+pytest.importorskip("rafcon")
+
+from rafcon.core.states.state import StateExecutionStatus
+
+from monitoring import constants, overhead_governor, state_id_table, status_broadcaster
+from monitoring.model.network_model import NetworkManagerModel
+from monitoring.status_codec import CAPABILITY_STATE_IDS
+
+# the multiples of the time of a bare handoff, which push may take per status change and flush per status change,
+# including encoding and sending; both are measured in the same run to be independent of the speed of the host
+PUSH_FACTOR = 10
+FLUSH_FACTOR = 100
+NUMBER_OF_STATES = 100
+NUMBER_OF_EVENTS = 10000
+REPETITIONS = 5
+CLIENT_ADDRESS = ("127.0.0.1", 65001)
+
+
+class StubState(object):
+
+    def __init__(self, state_id, state_machine, child_states=()):
+        self.state_id = state_id
+        self.states = dict((child_state.state_id, child_state) for child_state in child_states)
+        self.state_execution_status = StateExecutionStatus.INACTIVE
+        self.state_machine = state_machine
+
+    def get_state_machine(self):
+        return self.state_machine
+
+
+class StubStateMachine(object):
+    """
+    A state machine of a root state and its child states
+    """
+    state_machine_id = 1
+
+    def __init__(self, number_of_states):
+        self.child_states = [StubState("STATE{0}".format(index), self) for index in range(1, number_of_states)]
+        self.root_state = StubState("ROOT", self, self.child_states)
+        self.states = [self.root_state] + self.child_states
+
+
+class StubStateMachineManager(object):
+
+    def __init__(self, state_machines):
+        self.state_machines = state_machines
+
+
+class StubConfig(object):
+
+    def __init__(self, values):
+        self.values = values
+
+    def get_config_value(self, key, default=None):
+        return self.values.get(key, default)
+
+
+class StubTransport(object):
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, datagram, address):
+        self.written += 1
+
+
+class StubEndpoint(object):
+
+    def __init__(self):
+        self.transport = StubTransport()
+        self.sent = 0
+
+    def send_message_non_acknowledged(self, protocol, address):
+        self.sent += 1
+
+
+def count_datagrams(endpoint):
+    return endpoint.sent + endpoint.transport.written
+
+
+class ForbiddenLock(object):
+
+    def __enter__(self):
+        raise AssertionError("A lock was taken")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class RecordCounter(object):
+    """
+    Wraps an encoding function and counts the records it encodes
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.records = 0
+
+    def __call__(self, records, *args, **kwargs):
+        records = list(records)
+        self.records += len(records)
+        return self.function(records, *args, **kwargs)
+
+
+@pytest.fixture
+def state_machine(monkeypatch):
+    state_machine = StubStateMachine(NUMBER_OF_STATES)
+    monkeypatch.setattr(state_id_table, "ContainerState", StubState)
+    monkeypatch.setattr(status_broadcaster, "state_machine_manager",
+                        StubStateMachineManager({state_machine.state_machine_id: state_machine}))
+    return state_machine
+
+
+@pytest.fixture
+def model(monkeypatch):
+    # a model of its own keeps the connection of the test client out of the network_manager_model singleton
+    model = NetworkManagerModel()
+    monkeypatch.setattr(status_broadcaster, "network_manager_model", model)
+    monkeypatch.setattr(overhead_governor, "network_manager_model", model)
+    model.set_connected_ip_port(CLIENT_ADDRESS)
+    return model
+
+
+@pytest.fixture
+def broadcaster(state_machine, model):
+    broadcaster = status_broadcaster.StatusBroadcaster(StubEndpoint())
+    broadcaster.add_client(CLIENT_ADDRESS, {CAPABILITY_STATE_IDS})
+    # sends the snapshot of the new client
+    broadcaster.flush()
+    return broadcaster
+
+
+def push_events(broadcaster, states):
+    for event in range(NUMBER_OF_EVENTS):
+        broadcaster.push(states[event % NUMBER_OF_STATES], event % 2)
+
+
+def measure(function):
+    """
+    :return: the shortest of several runs of function in seconds
+    """
+    durations = []
+    for _ in range(REPETITIONS):
+        start = time.time()
+        function()
+        durations.append(time.time() - start)
+    return min(durations)
+
+
+def measure_bare_handoff(states):
+    """
+    :return: the time in seconds of handing NUMBER_OF_EVENTS status changes over through a bare deque
+    """
+    handoff = deque(maxlen=constants.STATUS_HANDOFF_LENGTH)
+
+    def push(state, status_value):
+        handoff.append((state, status_value, time.time()))
+
+    def push_bare_events():
+        handoff.clear()
+        for event in range(NUMBER_OF_EVENTS):
+            push(states[event % NUMBER_OF_STATES], event % 2)
+
+    return measure(push_bare_events)
+
+
+def test_push_does_no_work(broadcaster, state_machine, model, monkeypatch):
+    counters = []
+    for name in ("pack_state_id_records", "encode_status_batches", "encode_status_records"):
+        counters.append(RecordCounter(getattr(status_broadcaster, name)))
+        monkeypatch.setattr(status_broadcaster, name, counters[-1])
+    monkeypatch.setattr(model, "_connections_lock", ForbiddenLock())
+    monkeypatch.setattr(model, "_log_lock", ForbiddenLock())
+    sent = count_datagrams(broadcaster.endpoint)
+
+    push_events(broadcaster, state_machine.states)
+    assert sum(counter.records for counter in counters) == 0
+    assert count_datagrams(broadcaster.endpoint) == sent
+
+
+def test_push_overhead_per_event(broadcaster, state_machine):
+    baseline = measure_bare_handoff(state_machine.states)
+    push_duration = measure(lambda: push_events(broadcaster, state_machine.states))
+    broadcaster.flush()
+    assert push_duration < PUSH_FACTOR * baseline
+
+
+def test_flush_collapses_the_changes_of_every_state(broadcaster, state_machine, monkeypatch):
+    counter = RecordCounter(status_broadcaster.pack_state_id_records)
+    monkeypatch.setattr(status_broadcaster, "pack_state_id_records", counter)
+    sent = count_datagrams(broadcaster.endpoint)
+
+    push_events(broadcaster, state_machine.states)
+    broadcaster.flush()
+    assert counter.records == NUMBER_OF_STATES
+    assert count_datagrams(broadcaster.endpoint) > sent
+
+
+def test_flush_overhead_per_event(broadcaster, state_machine):
+    baseline = measure_bare_handoff(state_machine.states)
+
+    def push_and_flush_events():
+        push_events(broadcaster, state_machine.states)
+        broadcaster.flush()
+
+    flush_duration = measure(push_and_flush_events) - measure(lambda: push_events(broadcaster, state_machine.states))
+    broadcaster.flush()
+    assert flush_duration < FLUSH_FACTOR * baseline
+
+
+def test_handoff_length_is_applied_and_overflows_resync(broadcaster, state_machine, monkeypatch):
+    handoff_length = 4
+    monkeypatch.setattr(status_broadcaster, "global_network_config",
+                        StubConfig({"STATUS_HANDOFF_LENGTH": handoff_length}))
+    resyncs = []
+    monkeypatch.setattr(broadcaster, "resync", lambda state_machine_id, address: resyncs.append(address))
+
+    # the changes handed over before the queue was replaced are covered by snapshots
+    broadcaster.reconfigure()
+    broadcaster.flush()
+    assert resyncs == [CLIENT_ADDRESS]
+
+    for event in range(handoff_length):
+        broadcaster.push(state_machine.states[event], 1)
+    broadcaster.flush()
+    assert resyncs == [CLIENT_ADDRESS]
+
+    for event in range(handoff_length + 1):
+        broadcaster.push(state_machine.states[event], 1)
+    broadcaster.flush()
+    assert resyncs == [CLIENT_ADDRESS] * 2